@@ -2,12 +2,24 @@ import { useState, useEffect } from 'react'
 
 function Jobs() {
   const [jobs, setJobs] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [status, setStatus] = useState('')
 
-  useEffect(() => {
-    fetch('/api/admin/jobs')
+  const loadJobs = (cursor = null) => {
+    const params = new URLSearchParams()
+    if (cursor) params.set('cursor', cursor)
+    if (status) params.set('status', status)
+    fetch(`/api/admin/jobs?${params}`)
       .then(r => r.json())
-      .then(setJobs)
-  }, [])
+      .then(data => {
+        setJobs(prev => cursor ? [...prev, ...data.items] : data.items)
+        setNextCursor(data.next_cursor)
+      })
+  }
+
+  useEffect(() => {
+    loadJobs()
+  }, [status])
 
   const statusColor = (s) => ({
     pending: '#ffa500',
@@ -20,6 +32,14 @@ function Jobs() {
   return (
     <div className="page">
       <h1>📋 Анализы</h1>
+      <select value={status} onChange={e => setStatus(e.target.value)}>
+        <option value="">Все статусы</option>
+        <option value="pending">pending</option>
+        <option value="running">running</option>
+        <option value="done">done</option>
+        <option value="partial">partial</option>
+        <option value="failed">failed</option>
+      </select>
       <table className="data-table">
         <thead>
           <tr>
@@ -44,6 +64,9 @@ function Jobs() {
           ))}
         </tbody>
       </table>
+      {nextCursor && (
+        <button onClick={() => loadJobs(nextCursor)}>Загрузить ещё</button>
+      )}
     </div>
   )
 }
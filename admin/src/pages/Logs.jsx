@@ -20,6 +20,7 @@ function Logs() {
             <th>Модель</th>
             <th>Токены</th>
             <th>Время (мс)</th>
+            <th>Очередь (мс)</th>
             <th>Статус</th>
             <th>Дата</th>
           </tr>
@@ -32,6 +33,7 @@ function Logs() {
               <td>{log.model}</td>
               <td>{log.tokens_used}</td>
               <td>{log.response_time_ms}</td>
+              <td>{log.queue_wait_ms ?? '—'}</td>
               <td>
                 <span className={`status-badge ${log.status}`}>
                   {log.status}
@@ -0,0 +1,11 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_llm_cache_status_1766050000'
+down_revision = 'add_settings_1765572489'
+
+def upgrade():
+    op.add_column('llm_requests', sa.Column('cache_status', sa.String(20), nullable=True))
+
+def downgrade():
+    op.drop_column('llm_requests', 'cache_status')
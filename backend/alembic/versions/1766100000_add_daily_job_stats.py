@@ -0,0 +1,49 @@
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import func
+
+revision = 'add_daily_job_stats_1766100000'
+down_revision = 'add_llm_cache_status_1766050000'
+
+def upgrade():
+    op.create_index(op.f('ix_jobs_created_at'), 'jobs', ['created_at'], unique=False)
+    op.create_table('daily_job_stats',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('jobs_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('jobs_done', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('jobs_failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('jobs_partial', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('llm_requests', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tokens_used', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=func.now()),
+        sa.PrimaryKeyConstraint('day')
+    )
+    # Заполняем агрегаты по уже накопленной истории, дальше их поддерживает периодическая задача
+    op.execute("""
+        INSERT INTO daily_job_stats (day, jobs_total, jobs_done, jobs_failed, jobs_partial, llm_requests, tokens_used)
+        SELECT d.day,
+               COALESCE(j.total, 0), COALESCE(j.done, 0), COALESCE(j.failed, 0), COALESCE(j.partial, 0),
+               COALESCE(l.requests, 0), COALESCE(l.tokens, 0)
+        FROM (
+            SELECT date(created_at) AS day FROM jobs
+            UNION
+            SELECT date(created_at) AS day FROM llm_requests
+        ) d
+        LEFT JOIN (
+            SELECT date(created_at) AS day,
+                   count(*) AS total,
+                   count(*) FILTER (WHERE status = 'done') AS done,
+                   count(*) FILTER (WHERE status = 'failed') AS failed,
+                   count(*) FILTER (WHERE status = 'partial') AS partial
+            FROM jobs GROUP BY 1
+        ) j ON j.day = d.day
+        LEFT JOIN (
+            SELECT date(created_at) AS day, count(*) AS requests, sum(tokens_used) AS tokens
+            FROM llm_requests GROUP BY 1
+        ) l ON l.day = d.day
+        WHERE d.day IS NOT NULL
+    """)
+
+def downgrade():
+    op.drop_table('daily_job_stats')
+    op.drop_index(op.f('ix_jobs_created_at'), table_name='jobs')
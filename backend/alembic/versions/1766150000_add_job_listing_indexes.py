@@ -0,0 +1,17 @@
+from alembic import op
+
+revision = 'add_job_list_indexes_1766150000'
+down_revision = 'add_daily_job_stats_1766100000'
+
+def upgrade():
+    op.create_index('ix_forms_session_id', 'forms', ['session_id'], unique=False)
+    # Составной индекс покрывает и keyset-пагинацию, и диапазоны по created_at
+    op.create_index('ix_jobs_created_at_id', 'jobs', ['created_at', 'id'], unique=False)
+    op.create_index('ix_jobs_status_created_at_id', 'jobs', ['status', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_jobs_created_at', table_name='jobs')
+
+def downgrade():
+    op.create_index('ix_jobs_created_at', 'jobs', ['created_at'], unique=False)
+    op.drop_index('ix_jobs_status_created_at_id', table_name='jobs')
+    op.drop_index('ix_jobs_created_at_id', table_name='jobs')
+    op.drop_index('ix_forms_session_id', table_name='forms')
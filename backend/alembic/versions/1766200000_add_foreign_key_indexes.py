@@ -0,0 +1,22 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_fk_indexes_1766200000'
+down_revision = 'add_job_list_indexes_1766150000'
+
+def upgrade():
+    # Треки ищутся по job_id, консолидация дополнительно фильтрует по статусу
+    op.create_index('ix_tracks_job_id_status', 'tracks', ['job_id', 'status'], unique=False)
+    op.create_index(op.f('ix_reports_job_id'), 'reports', ['job_id'], unique=False)
+    op.create_index(op.f('ix_llm_requests_track_id'), 'llm_requests', ['track_id'], unique=False)
+    # Частичный индекс: активная версия у трека одна, неактивные версии в него не попадают
+    op.create_index(
+        'ix_prompts_active_track_name', 'prompts', ['track_name'], unique=False,
+        postgresql_where=sa.text('is_active')
+    )
+
+def downgrade():
+    op.drop_index('ix_prompts_active_track_name', table_name='prompts')
+    op.drop_index(op.f('ix_llm_requests_track_id'), table_name='llm_requests')
+    op.drop_index(op.f('ix_reports_job_id'), table_name='reports')
+    op.drop_index('ix_tracks_job_id_status', table_name='tracks')
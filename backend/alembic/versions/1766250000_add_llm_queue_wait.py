@@ -0,0 +1,11 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_llm_queue_wait_1766250000'
+down_revision = 'add_fk_indexes_1766200000'
+
+def upgrade():
+    op.add_column('llm_requests', sa.Column('queue_wait_ms', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column('llm_requests', 'queue_wait_ms')
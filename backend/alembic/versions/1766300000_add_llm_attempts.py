@@ -0,0 +1,15 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_llm_attempts_1766300000'
+down_revision = 'add_llm_queue_wait_1766250000'
+
+def upgrade():
+    op.add_column('llm_requests', sa.Column('attempt', sa.Integer(), nullable=True))
+    op.add_column('llm_requests', sa.Column('hedged', sa.Boolean(), nullable=True))
+    op.add_column('llm_requests', sa.Column('first_token_ms', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column('llm_requests', 'first_token_ms')
+    op.drop_column('llm_requests', 'hedged')
+    op.drop_column('llm_requests', 'attempt')
@@ -0,0 +1,26 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_report_sections_1766350000'
+down_revision = 'add_llm_attempts_1766300000'
+
+def upgrade():
+    op.create_table('report_sections',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(length=50), nullable=True),
+    sa.Column('content', sa.LargeBinary(), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('compressed_size', sa.Integer(), nullable=True),
+    sa.Column('sha256', sa.String(length=64), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['job_id'], ['jobs.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_report_sections_id'), 'report_sections', ['id'], unique=False)
+    op.create_index('ix_report_sections_job_id_name', 'report_sections', ['job_id', 'name'], unique=True)
+
+def downgrade():
+    op.drop_index('ix_report_sections_job_id_name', table_name='report_sections')
+    op.drop_index(op.f('ix_report_sections_id'), table_name='report_sections')
+    op.drop_table('report_sections')
@@ -0,0 +1,30 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_batches_1766400000'
+down_revision = 'add_report_sections_1766350000'
+
+def upgrade():
+    op.create_table('batches',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('total', sa.Integer(), nullable=True),
+    sa.Column('backend', sa.String(length=20), nullable=True),
+    sa.Column('provider_batches', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_batches_id'), 'batches', ['id'], unique=False)
+    op.create_index(op.f('ix_batches_status'), 'batches', ['status'], unique=False)
+    op.add_column('jobs', sa.Column('batch_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('jobs_batch_id_fkey', 'jobs', 'batches', ['batch_id'], ['id'])
+    op.create_index(op.f('ix_jobs_batch_id'), 'jobs', ['batch_id'], unique=False)
+
+def downgrade():
+    op.drop_index(op.f('ix_jobs_batch_id'), table_name='jobs')
+    op.drop_constraint('jobs_batch_id_fkey', 'jobs', type_='foreignkey')
+    op.drop_column('jobs', 'batch_id')
+    op.drop_index(op.f('ix_batches_status'), table_name='batches')
+    op.drop_index(op.f('ix_batches_id'), table_name='batches')
+    op.drop_table('batches')
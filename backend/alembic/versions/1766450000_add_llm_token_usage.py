@@ -0,0 +1,21 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_llm_token_usage_1766450000'
+down_revision = 'add_batches_1766400000'
+
+def upgrade():
+    op.add_column('llm_requests', sa.Column('prompt_tokens', sa.Integer(), nullable=True))
+    op.add_column('llm_requests', sa.Column('completion_tokens', sa.Integer(), nullable=True))
+    op.add_column('llm_requests', sa.Column('cached_tokens', sa.Integer(), nullable=True))
+    op.add_column('llm_requests', sa.Column('prompt_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('llm_requests_prompt_id_fkey', 'llm_requests', 'prompts', ['prompt_id'], ['id'])
+    op.create_index(op.f('ix_llm_requests_prompt_id'), 'llm_requests', ['prompt_id'], unique=False)
+
+def downgrade():
+    op.drop_index(op.f('ix_llm_requests_prompt_id'), table_name='llm_requests')
+    op.drop_constraint('llm_requests_prompt_id_fkey', 'llm_requests', type_='foreignkey')
+    op.drop_column('llm_requests', 'prompt_id')
+    op.drop_column('llm_requests', 'cached_tokens')
+    op.drop_column('llm_requests', 'completion_tokens')
+    op.drop_column('llm_requests', 'prompt_tokens')
@@ -0,0 +1,24 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'prompt_params_dflt_1766500000'
+down_revision = 'add_llm_token_usage_1766450000'
+
+# load_prompts.py записывал max_tokens=8000, но треки шли с жёстко заданными 16000.
+# Теперь params применяются — переносим фактический лимит, чтобы ответы не укоротились.
+SEED = {"temperature": 0.7, "max_tokens": 8000}
+ACTUAL = {"temperature": 0.7, "max_tokens": 16000}
+
+prompts = sa.table('prompts', sa.column('id', sa.Integer), sa.column('params', sa.JSON))
+
+def _replace(old: dict, new: dict):
+    conn = op.get_bind()
+    for prompt_id, params in conn.execute(sa.select(prompts.c.id, prompts.c.params)).all():
+        if params == old:
+            conn.execute(prompts.update().where(prompts.c.id == prompt_id).values(params=new))
+
+def upgrade():
+    _replace(SEED, ACTUAL)
+
+def downgrade():
+    _replace(ACTUAL, SEED)
@@ -0,0 +1,11 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_llm_finish_reason_1766550000'
+down_revision = 'prompt_params_dflt_1766500000'
+
+def upgrade():
+    op.add_column('llm_requests', sa.Column('finish_reason', sa.String(length=20), nullable=True))
+
+def downgrade():
+    op.drop_column('llm_requests', 'finish_reason')
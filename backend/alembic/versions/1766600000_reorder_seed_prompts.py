@@ -0,0 +1,33 @@
+from alembic import op
+import hashlib
+import sqlalchemy as sa
+
+revision = 'reorder_seed_prompts_1766600000'
+down_revision = 'add_llm_finish_reason_1766550000'
+
+# Провайдер кэширует общий префикс запросов: в шаблонах из load_prompts.py методика
+# теперь идёт первой, а абзацы с полями анкеты — в конце. Переставляем только версии,
+# текст которых совпадает с прежним сидом; правленные вручную не трогаем.
+SEED_HASHES = {
+    '1c99094e603ff9b0483d11cb1d535c3a2ac4feddbf04c86eaaedb4293830f5a8',  # track1_market_analysis
+    '1baba31b96e2037d28daaa3247ec167d70f6d996c5e57b47449339c656d0e2cf',  # track2_growth_strategy
+    '263215be9fa3e2129b2d03e18a2a7354e24d5537e5ba208aec11f9fa54ae27a6',  # track3_risks_analysis
+}
+
+prompts = sa.table('prompts', sa.column('id', sa.Integer), sa.column('prompt_template', sa.Text))
+
+def _reorder(template: str) -> str:
+    paragraphs = template.split("\n\n")
+    static = [p for p in paragraphs if '{' not in p]
+    fields = [p for p in paragraphs if '{' in p]
+    return "\n\n".join(static + fields)
+
+def upgrade():
+    conn = op.get_bind()
+    for prompt_id, template in conn.execute(sa.select(prompts.c.id, prompts.c.prompt_template)).all():
+        if hashlib.sha256(template.encode()).hexdigest() in SEED_HASHES:
+            conn.execute(prompts.update().where(prompts.c.id == prompt_id).values(prompt_template=_reorder(template)))
+
+def downgrade():
+    # Исходный порядок абзацев не восстановить; шаблон подставляется так же в любом порядке
+    pass
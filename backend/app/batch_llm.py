@@ -0,0 +1,255 @@
+import os
+import json
+import uuid
+import logging
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified
+from app.models import Batch, Job, Track, LLMRequest
+from app.llm_service import client, build_params, token_usage, SYSTEM_PROMPT, DEFAULT_MAX_TOKENS
+from app.llm_cache import CACHE_ENABLED, make_cache_key, get_cached
+from app.prompt_registry import get_prompt
+from app import queries
+
+logger = logging.getLogger(__name__)
+
+# openai — Batch API (вдвое дешевле онлайн-запросов, ответ в течение 24 ч);
+# local — те же JSONL-файлы на диске с ответами-заглушками, для тестов и разработки
+BATCH_BACKEND = os.getenv("BATCH_LLM_BACKEND", "openai")
+BATCH_LOCAL_DIR = os.getenv("BATCH_LOCAL_DIR", "/app/batches")
+# Ограничения пропускной способности: запросов в одном файле и пакетов у провайдера одновременно
+BATCH_MAX_REQUESTS_PER_FILE = int(os.getenv("BATCH_MAX_REQUESTS_PER_FILE", "1500"))
+BATCH_MAX_ACTIVE = int(os.getenv("BATCH_MAX_ACTIVE", "2"))
+BATCH_COMPLETION_WINDOW = "24h"
+
+TRACK_NAMES = ['track1_market_analysis', 'track2_growth_strategy', 'track3_risks_analysis']
+# Статусы пакета у провайдера, после которых он больше не меняется
+FINISHED = {"completed", "failed", "expired", "cancelled"}
+
+def _parse_jsonl(text: str) -> list:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+class OpenAIBatchBackend:
+    name = "openai"
+
+    def submit(self, lines: list) -> str:
+        data = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines).encode("utf-8")
+        input_file = client.files.create(file=("batch.jsonl", data), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def poll(self, provider_id: str):
+        """(статус, строки результата); результаты — только когда пакет завершён"""
+        batch = client.batches.retrieve(provider_id)
+        if batch.status not in FINISHED:
+            return batch.status, []
+        lines = []
+        # Неуспешные и просроченные запросы лежат в отдельном файле ошибок
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines += _parse_jsonl(client.files.content(file_id).text)
+        return batch.status, lines
+
+class LocalBatchBackend:
+    name = "local"
+
+    def submit(self, lines: list) -> str:
+        provider_id = f"local-{uuid.uuid4().hex}"
+        path = os.path.join(BATCH_LOCAL_DIR, provider_id)
+        os.makedirs(path)
+        with open(os.path.join(path, "input.jsonl"), "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return provider_id
+
+    def poll(self, provider_id: str):
+        path = os.path.join(BATCH_LOCAL_DIR, provider_id)
+        output = os.path.join(path, "output.jsonl")
+        if not os.path.exists(output):
+            with open(os.path.join(path, "input.jsonl"), encoding="utf-8") as f:
+                requests = _parse_jsonl(f.read())
+            with open(output, "w", encoding="utf-8") as f:
+                for i, request in enumerate(requests):
+                    body = request["body"]
+                    content = f"Локальный ответ ({request['custom_id']}): {body['messages'][-1]['content'][:200]}"
+                    f.write(json.dumps({
+                        "id": f"{provider_id}-{i}",
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": {
+                            "model": body["model"],
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                            "usage": {"total_tokens": 0}
+                        }},
+                        "error": None
+                    }, ensure_ascii=False) + "\n")
+        with open(output, encoding="utf-8") as f:
+            return "completed", _parse_jsonl(f.read())
+
+BACKENDS = {backend.name: backend for backend in (OpenAIBatchBackend(), LocalBatchBackend())}
+
+def create_tracks(db: Session, batch: Batch):
+    """По три трека на каждую анкету пакета, все в очереди на отправку"""
+    job_ids = db.execute(queries.batch_job_ids(batch.id)).scalars().all()
+    db.add_all([Track(job_id=job_id, track_name=name, status="queued") for job_id in job_ids for name in TRACK_NAMES])
+    db.commit()
+
+def _complete_track(db: Session, track: Track, text: str, usage: dict, model: str, cache_status: str, prompt_id: int = None, finish_reason: str = None):
+    track.status = "completed"
+    track.raw_output = {"status": "success", "result": text, "tokens": usage["total_tokens"]}
+    track.finished_at = datetime.now(timezone.utc)
+    db.add(LLMRequest(
+        track_id=track.id,
+        model=model,
+        tokens_used=usage["total_tokens"],
+        prompt_tokens=usage["prompt_tokens"],
+        completion_tokens=usage["completion_tokens"],
+        cached_tokens=usage["cached_tokens"],
+        finish_reason=finish_reason,
+        status="success",
+        cache_status=cache_status,
+        attempt=1,
+        hedged=False,
+        prompt_id=prompt_id
+    ))
+
+def _fail_track(db: Session, track: Track, error: str, model: str = None):
+    track.status = "failed"
+    track.raw_output = {"status": "error", "error": error}
+    track.finished_at = datetime.now(timezone.utc)
+    db.add(LLMRequest(track_id=track.id, model=model, tokens_used=0, status="error", error=error, attempt=1, hedged=False))
+
+def submit_pending(db: Session, batch: Batch):
+    """Отправляет треки из очереди, пока у провайдера есть свободные слоты.
+
+    Ответы, которые уже есть в кэше LLM, засчитываются сразу и в пакет не попадают.
+    Модель, лимит токенов и temperature берутся из параметров промпта трека. Бюджет токенов
+    по истории (token_budget) здесь не применяем: задержки у пакета нет, а обрезанный ответ
+    пришлось бы ждать в следующем пакете ещё до суток.
+    """
+    backend = BACKENDS[batch.backend]
+    default_model = os.getenv("LLM_MODEL", "gpt-4.1-nano")
+    active = sum(1 for entry in batch.provider_batches or [] if entry["status"] not in FINISHED)
+
+    while active < BATCH_MAX_ACTIVE:
+        rows = db.execute(queries.queued_batch_tracks(batch.id, BATCH_MAX_REQUESTS_PER_FILE)).all()
+        if not rows:
+            break
+
+        lines = {}
+        for track, form in rows:
+            prompt_obj = get_prompt(track.track_name)
+            if not prompt_obj:
+                _fail_track(db, track, f"No active prompt for {track.track_name}")
+                continue
+
+            prompt = prompt_obj.render(form.payload)
+            model = prompt_obj.params.get("model") or default_model
+            max_tokens = prompt_obj.params.get("max_tokens", DEFAULT_MAX_TOKENS)
+            params = build_params(model, SYSTEM_PROMPT, prompt, max_tokens, prompt_obj.params.get("temperature"))
+            if CACHE_ENABLED:
+                cached = get_cached(make_cache_key(model, SYSTEM_PROMPT, params.get("temperature"), max_tokens, prompt))
+                if cached:
+                    _complete_track(db, track, cached["result"], token_usage(None), model, "hit", prompt_obj.id)
+                    continue
+
+            track.status = "batched"
+            track.started_at = datetime.now(timezone.utc)
+            # Версия промпта — в custom_id: к приходу ответа активной может стать другая
+            lines.setdefault(model, []).append({"custom_id": f"track-{track.id}-{prompt_obj.id}", "method": "POST", "url": "/v1/chat/completions", "body": params})
+
+        # В одном файле Batch API — запросы только к одной модели
+        for model, model_lines in lines.items():
+            provider_id = backend.submit(model_lines)
+            batch.provider_batches = [*(batch.provider_batches or []), {"id": provider_id, "status": "validating", "requests": len(model_lines)}]
+            active += 1
+            logger.info(f"Batch {batch.id}: submitted {len(model_lines)} {model} requests as {provider_id}")
+        batch.status = "running"
+        db.commit()
+
+def _parse_custom_id(custom_id: str):
+    """(track_id, prompt_id) из track-{id}-{prompt_id}; у пакетов, отправленных до версий промптов, — track-{id}"""
+    parts = custom_id.split("-")
+    if parts[0] != "track" or len(parts) not in (2, 3) or not all(part.isdigit() for part in parts[1:]):
+        return None, None
+    return int(parts[1]), int(parts[2]) if len(parts) == 3 else None
+
+def _apply_results(db: Session, lines: list):
+    for line in lines:
+        custom_id = line.get("custom_id") or ""
+        track_id, prompt_id = _parse_custom_id(custom_id)
+        if track_id is None:
+            logger.warning(f"Skipping batch result with unexpected custom_id {custom_id!r}")
+            continue
+        track = db.get(Track, track_id)
+        if track is None or track.status != "batched":
+            continue
+
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") == 200 and body.get("choices"):
+            choice = body["choices"][0]
+            _complete_track(db, track, choice["message"]["content"], token_usage(body.get("usage")), body.get("model"), "miss", prompt_id, choice.get("finish_reason"))
+        else:
+            error = line.get("error") or body.get("error") or {"status_code": response.get("status_code")}
+            _fail_track(db, track, json.dumps(error, ensure_ascii=False), body.get("model"))
+
+def poll(db: Session, batch: Batch):
+    """Опрашивает пакеты у провайдера и записывает ответы завершённых в треки"""
+    backend = BACKENDS[batch.backend]
+    for entry in batch.provider_batches or []:
+        if entry["status"] in FINISHED:
+            continue
+        status, lines = backend.poll(entry["id"])
+        entry["status"] = status
+        if status in FINISHED:
+            _apply_results(db, lines)
+            logger.info(f"Batch {batch.id}: {entry['id']} {status}, {len(lines)} results")
+    flag_modified(batch, "provider_batches")
+
+    # Все пакеты завершены, а ответа на трек так и не пришло
+    if all(entry["status"] in FINISHED for entry in batch.provider_batches or []):
+        # autoflush выключен: без flush запрос не увидит только что записанные ответы
+        db.flush()
+        orphaned = db.execute(queries.batch_tracks(batch.id, "batched")).scalars().all()
+        for track in orphaned:
+            _fail_track(db, track, "No result in provider batch output")
+    db.commit()
+
+def finish_jobs(db: Session, batch: Batch) -> list:
+    """Отмечает анкеты, у которых все треки завершены; возвращает id анкет, готовых к синтезу"""
+    counts = {}
+    for job_id, status, count in db.execute(queries.pending_job_track_counts(batch.id)).all():
+        counts.setdefault(job_id, {})[status] = count
+
+    ready = []
+    for job_id, statuses in counts.items():
+        if statuses.get("queued") or statuses.get("batched"):
+            continue
+        job = db.get(Job, job_id)
+        completed = statuses.get("completed", 0)
+        if completed == len(TRACK_NAMES):
+            # Синтез идёт отдельной задачей; running — чтобы не запустить его дважды
+            job.status = "running"
+            ready.append(job_id)
+        else:
+            job.status = "partial" if completed else "failed"
+            job.finished_at = datetime.now(timezone.utc)
+
+    unfinished = db.execute(queries.unfinished_batch_job(batch.id)).first()
+    if unfinished is None and not ready:
+        batch.status = "done"
+        batch.finished_at = datetime.now(timezone.utc)
+        logger.info(f"Batch {batch.id} finished")
+    db.commit()
+    return ready
+
+def advance(db: Session, batch: Batch) -> list:
+    """Один шаг обработки пакета: опрос провайдера, итоги по анкетам, отправка следующей порции"""
+    poll(db, batch)
+    ready = finish_jobs(db, batch)
+    submit_pending(db, batch)
+    return ready
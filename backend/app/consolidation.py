@@ -1,13 +1,67 @@
-from sqlalchemy.orm import Session
 from app.database import SessionLocal
-from app.models import Track, Report, Job, Form
-from openai import OpenAI
+from app.models import Track, Report, ReportSection, Job, Form
+from app.report_store import pack_sections
+from app import report_cache
+from app.llm_service import call_llm, DEFAULT_MAX_TOKENS
 import os
 import json
-from app.document_generator import generate_pdf, generate_docx
-from app.s3_service import upload_to_s3
+import time
+from app.document_generator import render_documents
+from app.s3_service import upload_many
 
-def consolidate_and_swot(job_id: int):
+CONSOLIDATION_SYSTEM_PROMPT = "Ты стратегический консультант топ-уровня. Создаёшь executive отчеты для руководителей. Отвечай подробно, структурированно, с bullets."
+
+DIGEST_MAX_TOKENS = int(os.getenv("CONSOLIDATION_DIGEST_MAX_TOKENS", "2500"))
+# Синтез можно отдать более сильной модели, а дайджесты — быстрой; пусто — LLM_MODEL
+CONSOLIDATION_MODEL = os.getenv("CONSOLIDATION_LLM_MODEL") or None
+DIGEST_MODEL = os.getenv("CONSOLIDATION_DIGEST_LLM_MODEL") or None
+CONSOLIDATION_MAX_TOKENS = int(os.getenv("CONSOLIDATION_MAX_TOKENS", str(DEFAULT_MAX_TOKENS)))
+
+TRACK_TITLES = {
+    'track1_market_analysis': 'АНАЛИЗ НАПРАВЛЕНИЙ РОСТА',
+    'track2_growth_strategy': 'АНАЛИЗ АНАЛОГОВ И АНТИЛОГОВ',
+    'track3_risks_analysis': 'АНАЛИЗ КЛИЕНТСКИХ БОЛЕЙ'
+}
+
+def _elapsed_ms(start: float) -> int:
+    return int((time.time() - start) * 1000)
+
+def _track_text(track: Track) -> str:
+    # Извлекаем текстовый результат
+    if isinstance(track.raw_output, dict) and 'result' in track.raw_output:
+        return track.raw_output['result']
+    return str(track.raw_output)
+
+def digest_track_output(track: Track, use_cache: bool = True) -> dict:
+    """Сжимает результат трека в компактный дайджест для итогового синтеза.
+    
+    Запрос пишется в журнал без track_id: это не сам трек, и его время и токены
+    не должны попадать в статистику треков и порог хеджирования.
+    """
+    prompt = f"""Сожми отчет ниже в компактный дайджест для последующего синтеза в итоговый executive-отчет.
+Сохрани ключевые выводы, цифры, рассмотренные опции с их оценками, рекомендации и риски. Без вступлений и повторов, используй bullets, не более 700 слов.
+
+ОТЧЕТ - {TRACK_TITLES.get(track.track_name, track.track_name)}:
+{_track_text(track)}"""
+    
+    return call_llm(
+        prompt=prompt,
+        form_data=None,
+        track_id=None,
+        model=DIGEST_MODEL,
+        use_cache=use_cache,
+        system_prompt=CONSOLIDATION_SYSTEM_PROMPT,
+        max_tokens=DIGEST_MAX_TOKENS
+    )
+
+def consolidate_and_swot(job_id: int, digests: dict = None, timings: dict = None, use_cache: bool = True):
+    """Итоговый синтез по трекам, генерация PDF/DOCX и сохранение отчета.
+    
+    Если переданы digests (дайджесты треков, посчитанные по мере их готовности),
+    синтез строится по ним вместо полных текстов. В timings пишутся длительности этапов.
+    use_cache=False — как и у треков, заново спросить модель, минуя кэш LLM.
+    """
+    timings = timings if timings is not None else {}
     db = SessionLocal()
     try:
         # Получаем треки
@@ -15,25 +69,20 @@ def consolidate_and_swot(job_id: int):
         if len(tracks) < 3:
             return None
         
-        track_data = {}
-        for t in tracks:
-            # Извлекаем текстовый результат
-            if isinstance(t.raw_output, dict) and 'result' in t.raw_output:
-                track_data[t.track_name] = t.raw_output['result']
-            else:
-                track_data[t.track_name] = str(t.raw_output)
+        track_data = {t.track_name: _track_text(t) for t in tracks}
+        sources = {name: (digests or {}).get(name) or text for name, text in track_data.items()}
         
         # Промпт консолидации
         prompt = f"""Сформируй результат в формате аналитического отчета по трем полученным отчетам, увязанным в логическую цепочку для executives с буллетами на 3–5 страниц: больше связного текста и понятной структуры и bullets с ответом на вопрос "что из этого следует".
 
 ОТЧЕТ 1 - АНАЛИЗ НАПРАВЛЕНИЙ РОСТА:
-{track_data.get('track1_market_analysis', 'Нет данных')}
+{sources.get('track1_market_analysis', 'Нет данных')}
 
 ОТЧЕТ 2 - АНАЛИЗ АНАЛОГОВ И АНТИЛОГОВ:
-{track_data.get('track2_growth_strategy', 'Нет данных')}
+{sources.get('track2_growth_strategy', 'Нет данных')}
 
 ОТЧЕТ 3 - АНАЛИЗ КЛИЕНТСКИХ БОЛЕЙ:
-{track_data.get('track3_risks_analysis', 'Нет данных')}
+{sources.get('track3_risks_analysis', 'Нет данных')}
 
 После окончания отчета, не раньше, сделай анализ предлагаемых опций по критериям и выбери оптимальный вариант.
 
@@ -46,19 +95,22 @@ def consolidate_and_swot(job_id: int):
 
 Пиши на русском языке, структурированно, используй bullets для ключевых выводов."""
 
-        # Вызываем OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-            model=os.getenv("LLM_MODEL", "gpt-4.1-nano"),
-            messages=[
-                {"role": "system", "content": "Ты стратегический консультант топ-уровня. Создаёшь executive отчеты для руководителей. Отвечай подробно, структурированно, с bullets."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=16000
+        # Вызываем LLM
+        stage_start = time.time()
+        result = call_llm(
+            prompt=prompt,
+            form_data=None,
+            track_id=None,
+            model=CONSOLIDATION_MODEL,
+            use_cache=use_cache,
+            system_prompt=CONSOLIDATION_SYSTEM_PROMPT,
+            max_tokens=CONSOLIDATION_MAX_TOKENS
         )
+        timings["consolidation_ms"] = _elapsed_ms(stage_start)
         
-        consolidation_text = response.choices[0].message.content
+        if result["status"] != "success":
+            raise Exception(f"Consolidation LLM error: {result.get('error')}")
+        consolidation_text = result["result"]
         
         # Формируем финальный отчет
         final_report = {
@@ -72,24 +124,27 @@ def consolidate_and_swot(job_id: int):
             }
         }
         
-        # Генерируем PDF и DOCX
-        os.makedirs("/app/reports", exist_ok=True)
-        pdf_path = f"/app/reports/report_{job_id}.pdf"
-        docx_path = f"/app/reports/report_{job_id}.docx"
-        
         # Получаем исходные данные формы
         job = db.query(Job).filter(Job.id == job_id).first()
         form = db.query(Form).filter(Form.session_id == job.session_id).first()
         form_input = form.payload if form else {}
         
-        generate_pdf(final_report, pdf_path, form_input)
-        generate_docx(final_report, docx_path, form_input)
+        # Генерируем PDF и DOCX параллельно, сразу в память
+        stage_start = time.time()
+        pdf_bytes, docx_bytes, render_timings = render_documents(final_report, form_input)
+        timings.update(render_timings)
+        timings["documents_ms"] = _elapsed_ms(stage_start)
         
-        # Загружаем в S3
-        pdf_url = upload_to_s3(pdf_path, f"reports/report_{job_id}.pdf")
-        docx_url = upload_to_s3(docx_path, f"reports/report_{job_id}.docx")
+        # Загружаем в S3 оба файла одновременно
+        stage_start = time.time()
+        pdf_name = f"reports/report_{job_id}.pdf"
+        docx_name = f"reports/report_{job_id}.docx"
+        urls = upload_many({pdf_name: pdf_bytes, docx_name: docx_bytes})
+        pdf_url, docx_url = urls[pdf_name], urls[docx_name]
+        timings["s3_ms"] = _elapsed_ms(stage_start)
         
-        # Сохраняем отчет в БД
+        # Сохраняем отчет в БД; при перегенерации заменяем прежний
+        db.query(Report).filter(Report.job_id == job_id).delete()
         report = Report(
             job_id=job_id,
             report_json=final_report,
@@ -97,7 +152,11 @@ def consolidate_and_swot(job_id: int):
             docx_url=docx_url
         )
         db.add(report)
+        # Разделы храним отдельно и сжатыми — их отдаёт /api/report/{job_id}/sections
+        db.query(ReportSection).filter(ReportSection.job_id == job_id).delete()
+        db.add_all(pack_sections(job_id, final_report))
         db.commit()
+        report_cache.invalidate(job_id)
         
         return final_report
         
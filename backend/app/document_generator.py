@@ -8,29 +8,52 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak,
 from reportlab.lib.colors import HexColor
 from docx import Document
 from docx.shared import Pt, RGBColor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from app import metrics
+import multiprocessing
+import io
 import os
+import time
+import logging
 
-def generate_pdf(report_data: dict, output_path: str, form_input: dict = None):
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=None)
+def _pdf_styles():
+    """Шрифты и стили регистрируются один раз на процесс"""
     try:
         pdfmetrics.registerFont(TTFont('DejaVu', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'))
         pdfmetrics.registerFont(TTFont('DejaVu-Bold', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'))
     except:
         pass
     
+    styles = getSampleStyleSheet()
+    return {
+        'title': ParagraphStyle('CustomTitle', parent=styles['Heading1'], 
+                                fontName='DejaVu-Bold', fontSize=24, textColor=HexColor('#667eea')),
+        'h1': ParagraphStyle('CustomH1', parent=styles['Heading1'], 
+                             fontName='DejaVu-Bold', fontSize=16, textColor=HexColor('#333333')),
+        'h2': ParagraphStyle('CustomH2', parent=styles['Heading2'], 
+                             fontName='DejaVu-Bold', fontSize=12, textColor=HexColor('#555555')),
+        'text': ParagraphStyle('CustomText', parent=styles['Normal'], 
+                               fontName='DejaVu', fontSize=10, leading=14),
+        'small': ParagraphStyle('CustomSmall', parent=styles['Normal'], 
+                                fontName='DejaVu', fontSize=9, leading=12, textColor=HexColor('#666666'))
+    }
+
+def generate_pdf(report_data: dict, output_path, form_input: dict = None):
+    """output_path — путь к файлу или file-like буфер"""
     doc = SimpleDocTemplate(output_path, pagesize=A4, topMargin=40, bottomMargin=40)
     story = []
-    styles = getSampleStyleSheet()
+    styles = _pdf_styles()
     
-    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], 
-                                 fontName='DejaVu-Bold', fontSize=24, textColor=HexColor('#667eea'))
-    h1_style = ParagraphStyle('CustomH1', parent=styles['Heading1'], 
-                             fontName='DejaVu-Bold', fontSize=16, textColor=HexColor('#333333'))
-    h2_style = ParagraphStyle('CustomH2', parent=styles['Heading2'], 
-                             fontName='DejaVu-Bold', fontSize=12, textColor=HexColor('#555555'))
-    text_style = ParagraphStyle('CustomText', parent=styles['Normal'], 
-                                fontName='DejaVu', fontSize=10, leading=14)
-    small_style = ParagraphStyle('CustomSmall', parent=styles['Normal'], 
-                                fontName='DejaVu', fontSize=9, leading=12, textColor=HexColor('#666666'))
+    title_style = styles['title']
+    h1_style = styles['h1']
+    h2_style = styles['h2']
+    text_style = styles['text']
+    small_style = styles['small']
     
     tracks = report_data.get('tracks', {})
     cons = report_data.get('consolidation', {})
@@ -107,7 +130,8 @@ def generate_pdf(report_data: dict, output_path: str, form_input: dict = None):
     return output_path
 
 
-def generate_docx(report_data: dict, output_path: str, form_input: dict = None):
+def generate_docx(report_data: dict, output_path, form_input: dict = None):
+    """output_path — путь к файлу или file-like буфер"""
     doc = Document()
     tracks = report_data.get('tracks', {})
     cons = report_data.get('consolidation', {})
@@ -179,4 +203,60 @@ def generate_docx(report_data: dict, output_path: str, form_input: dict = None):
             doc.add_paragraph(para.strip())
     
     doc.save(output_path)
-    return output_path
\ No newline at end of file
+    return output_path
+
+
+def render_pdf_bytes(report_data: dict, form_input: dict = None):
+    """Рендерит PDF в память, возвращает (bytes, время в мс)"""
+    start = time.time()
+    buffer = io.BytesIO()
+    generate_pdf(report_data, buffer, form_input)
+    return buffer.getvalue(), int((time.time() - start) * 1000)
+
+
+def render_docx_bytes(report_data: dict, form_input: dict = None):
+    """Рендерит DOCX в память, возвращает (bytes, время в мс)"""
+    start = time.time()
+    buffer = io.BytesIO()
+    generate_docx(report_data, buffer, form_input)
+    return buffer.getvalue(), int((time.time() - start) * 1000)
+
+
+_pool = None
+_pool_pid = None
+
+
+def _get_pool():
+    """Пул процессов рендеринга: создаётся лениво, один на процесс воркера"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        context = multiprocessing.get_context(os.getenv("DOC_RENDER_START_METHOD", "spawn"))
+        _pool = ProcessPoolExecutor(max_workers=int(os.getenv("DOC_RENDER_WORKERS", "2")), mp_context=context)
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def render_documents(report_data: dict, form_input: dict = None):
+    """Рендерит PDF и DOCX параллельно в пуле процессов.
+    
+    Возвращает (pdf_bytes, docx_bytes, timings). Если пул недоступен,
+    форматы рендерятся последовательно в текущем процессе.
+    """
+    global _pool
+    try:
+        pool = _get_pool()
+        pdf_future = pool.submit(render_pdf_bytes, report_data, form_input)
+        docx_future = pool.submit(render_docx_bytes, report_data, form_input)
+        pdf_bytes, pdf_ms = pdf_future.result()
+        docx_bytes, docx_ms = docx_future.result()
+    except (BrokenProcessPool, AssertionError, OSError) as e:
+        # Например, демонизированный процесс не может порождать дочерние
+        logger.warning(f"Parallel rendering unavailable, rendering inline: {e}")
+        _pool = None
+        pdf_bytes, pdf_ms = render_pdf_bytes(report_data, form_input)
+        docx_bytes, docx_ms = render_docx_bytes(report_data, form_input)
+    
+    # Время рендеринга меряется в процессе пула, пишем его отсюда
+    metrics.DOCUMENT_RENDER_SECONDS.labels("pdf").observe(pdf_ms / 1000)
+    metrics.DOCUMENT_RENDER_SECONDS.labels("docx").observe(docx_ms / 1000)
+    return pdf_bytes, docx_bytes, {"pdf_ms": pdf_ms, "docx_ms": docx_ms}
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+import json
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_CHANNEL_PATTERN = "session:*"
+# Сколько событий ждёт отправки в один сокет, прежде чем он считается отставшим
+SESSION_QUEUE_SIZE = int(os.getenv("WS_SESSION_QUEUE_SIZE", "1000"))
+
+# Маркер в очереди: подписчик отстал, часть событий выброшена — нужно догнать по stream
+LAGGED = object()
+
+class Subscription:
+    def __init__(self, session_id: str, maxsize: int):
+        self.session_id = session_id
+        self.queue = asyncio.Queue(maxsize)
+        self.lagged = False
+
+    async def get(self):
+        item = await self.queue.get()
+        if item is LAGGED:
+            self.lagged = False
+        return item
+
+    def offer(self, event: dict):
+        """Не блокирует раздачу: медленный подписчик теряет буфер и получает LAGGED"""
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.mark_lagged()
+
+    def mark_lagged(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(LAGGED)
+        self.lagged = True
+
+class EventHub:
+    """Один pattern-подписчик Redis на процесс API, раздаёт события по очередям сессий"""
+
+    def __init__(self, redis_client, queue_size: int = SESSION_QUEUE_SIZE):
+        self.redis = redis_client
+        self.queue_size = queue_size
+        self.subscriptions = {}
+        self._task = None
+
+    def subscribe(self, session_id: str) -> Subscription:
+        subscription = Subscription(str(session_id), self.queue_size)
+        self.subscriptions.setdefault(subscription.session_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscriptions.get(subscription.session_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.subscriptions[subscription.session_id]
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe(SESSION_CHANNEL_PATTERN)
+                logger.info(f"Event hub subscribed to {SESSION_CHANNEL_PATTERN}")
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                await pubsub.aclose()
+                raise
+            except Exception as e:
+                logger.error(f"Event hub connection lost: {e}")
+                await pubsub.aclose()
+                # Пока соединения не было, события могли пройти мимо — пусть все догонят по stream
+                for subscribers in self.subscriptions.values():
+                    for subscription in subscribers:
+                        subscription.mark_lagged()
+                await asyncio.sleep(1)
+
+    def _dispatch(self, channel: str, data: str):
+        subscribers = self.subscriptions.get(channel.split(":", 1)[1])
+        if not subscribers:
+            return
+        # Разбираем JSON один раз на всех подписчиков сессии
+        event = json.loads(data)
+        for subscription in subscribers:
+            subscription.offer(event)
@@ -0,0 +1,111 @@
+import os
+import re
+import anyio
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 256 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match совпал с текущим ETag (слабое сравнение, как требует RFC 9110)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if "if-none-match" in request.headers:
+        return etag_matches(request, etag)
+    since = request.headers.get("if-modified-since")
+    if since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _parse_range(request: Request, size: int, etag: str):
+    """(start, end) включительно или None — отдаём файл целиком.
+
+    Несколько диапазонов сразу не поддерживаем: по RFC можно ответить всем файлом.
+    """
+    header = request.headers.get("range")
+    if not header:
+        return None
+    # If-Range: диапазон только если у клиента та же версия файла
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        return None
+
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def _read_file(path: str, start: int, length: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def file_response(request: Request, path: str, media_type: str, filename: str) -> Response:
+    """Отдача локального файла с ETag/Last-Modified, 304, Range и готовой .gz-копией"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Vary": "Accept-Encoding",
+    }
+
+    # Сжатая копия — только для запроса файла целиком, диапазоны считаем по исходнику
+    gz_path = path + ".gz"
+    if "range" not in request.headers and "gzip" in request.headers.get("accept-encoding", "") and os.path.exists(gz_path):
+        gz_stat = os.stat(gz_path)
+        if gz_stat.st_mtime >= stat.st_mtime:
+            etag = f'"{gz_stat.st_mtime_ns:x}-{gz_stat.st_size:x}-gz"'
+            headers["ETag"] = etag
+            if _not_modified(request, etag, stat.st_mtime):
+                return Response(status_code=304, headers=headers)
+            headers["Content-Encoding"] = "gzip"
+            headers["Content-Length"] = str(gz_stat.st_size)
+            return StreamingResponse(_read_file(gz_path, 0, gz_stat.st_size), media_type=media_type, headers=headers)
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers["ETag"] = etag
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _parse_range(request, stat.st_size, etag)
+    if byte_range is None:
+        headers["Content-Length"] = str(stat.st_size)
+        return StreamingResponse(_read_file(path, 0, stat.st_size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_read_file(path, start, end - start + 1), status_code=206, media_type=media_type, headers=headers)
@@ -0,0 +1,59 @@
+import os
+import json
+import hashlib
+import logging
+import redis
+from app.local_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Отдельный Redis с вытеснением по LRU; без него — общий (тогда вытеснение там должно быть выключено)
+redis_client = redis.from_url(
+    os.getenv("LLM_CACHE_REDIS_URL") or os.getenv("REDIS_URL", "redis://redis:6379/0"),
+    decode_responses=True
+)
+
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Слишком большие ответы не кэшируем вовсе
+CACHE_MAX_ENTRY_BYTES = int(os.getenv("LLM_CACHE_MAX_ENTRY_BYTES", str(512 * 1024)))
+
+local_cache = LRUCache(
+    max_items=int(os.getenv("LLM_CACHE_LOCAL_ITEMS", "256")),
+    max_bytes=int(os.getenv("LLM_CACHE_LOCAL_BYTES", str(32 * 1024 * 1024))),
+    ttl=CACHE_TTL
+)
+
+def make_cache_key(model: str, system_prompt: str, temperature, max_tokens: int, prompt: str) -> str:
+    """Ключ кэша: хэш от всего, что влияет на ответ модели"""
+    raw = json.dumps([model, system_prompt, temperature, max_tokens, prompt], ensure_ascii=False)
+    return "llm_cache:" + hashlib.sha256(raw.encode()).hexdigest()
+
+def get_cached(key: str):
+    """Ищет ответ сначала в локальном LRU, затем в Redis"""
+    value = local_cache.get(key)
+    if value is not None:
+        return value
+
+    try:
+        raw = redis_client.get(key)
+    except Exception as e:
+        logger.warning(f"LLM cache read failed: {e}")
+        return None
+    if raw is None:
+        return None
+
+    value = json.loads(raw)
+    local_cache.set(key, value, size=len(raw))
+    return value
+
+def set_cached(key: str, value: dict):
+    raw = json.dumps(value, ensure_ascii=False)
+    if len(raw) > CACHE_MAX_ENTRY_BYTES:
+        return
+
+    local_cache.set(key, value, size=len(raw))
+    try:
+        redis_client.set(key, raw, ex=CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"LLM cache write failed: {e}")
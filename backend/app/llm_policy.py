@@ -0,0 +1,156 @@
+import os
+import time
+import queue
+import random
+import logging
+import threading
+from app.database import SessionLocal
+from app.llm_service import call_llm
+from app import queries
+
+logger = logging.getLogger(__name__)
+
+# Повторы на временных ошибках (сеть, 5xx, таймаут) — на каждую модель из списка
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "2"))
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX_SECONDS", "30"))
+# Запасные модели, если основная так и не ответила: LLM_FALLBACK_MODELS=gpt-4.1-mini,gpt-4o-mini
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+
+# Дублирующий запрос, если первый не ответил (или не начал стримить) за p95 латентности модели
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_SAMPLES = int(os.getenv("LLM_HEDGE_SAMPLES", "500"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "3"))
+HEDGE_DELAY_TTL = 300
+
+_hedge_delays = {}
+
+def hedge_delay(model: str, stream: bool):
+    """Порог для дублирующего запроса, с: p95 времени до первого токена (стрим) или до ответа.
+
+    None — хеджирование выключено или истории по модели пока мало.
+    """
+    if not LLM_HEDGE_ENABLED:
+        return None
+
+    cached = _hedge_delays.get((model, stream))
+    if cached and time.time() - cached[1] < HEDGE_DELAY_TTL:
+        return cached[0]
+
+    delay = None
+    db = SessionLocal()
+    try:
+        count, percentile = db.execute(queries.hedge_latency(model, stream, LLM_HEDGE_PERCENTILE, LLM_HEDGE_SAMPLES)).one()
+        if count >= LLM_HEDGE_MIN_SAMPLES and percentile:
+            delay = max(percentile / 1000, LLM_HEDGE_MIN_DELAY)
+    except Exception as e:
+        logger.warning(f"Hedge delay for {model} unavailable: {e}")
+    finally:
+        db.close()
+
+    _hedge_delays[(model, stream)] = (delay, time.time())
+    return delay
+
+def _attempt(call_kwargs: dict, model: str, attempt: int, hedged: bool, on_delta, cancel: threading.Event) -> dict:
+    """Одна попытка; попытки могут идти параллельно"""
+    return {**call_llm(model=model, attempt=attempt, hedged=hedged, on_delta=on_delta, cancel=cancel, **call_kwargs),
+            "model": model, "hedged": hedged}
+
+def _hedged_attempt(call_kwargs: dict, model: str, attempt: int, stream: bool, on_delta, delay: float) -> dict:
+    """Запускает попытку и, если она не успела за delay, её дубликат.
+
+    При стриминге ответ отдаёт тот, кто первым прислал токен; второй запрос
+    закрывается. Без стриминга побеждает первый успешный ответ.
+    """
+    results = queue.Queue()
+    progress = threading.Event()
+    lock = threading.Lock()
+    cancels = {}
+    owner = []
+
+    def deliver(name):
+        def on_attempt_delta(delta):
+            with lock:
+                if not owner:
+                    owner.append(name)
+                    progress.set()
+                    for other, cancel in cancels.items():
+                        if other != name:
+                            cancel.set()
+            if owner[0] == name:
+                if on_delta:
+                    on_delta(delta)
+            else:
+                cancels[name].set()
+        return on_attempt_delta
+
+    def launch(name, hedged):
+        cancels[name] = threading.Event()
+
+        def run():
+            try:
+                result = _attempt(call_kwargs, model, attempt, hedged, deliver(name) if stream else None, cancels[name])
+            except Exception as e:
+                result = {"status": "error", "error": str(e), "retryable": True}
+            results.put(result)
+            progress.set()
+
+        threading.Thread(target=run, name=f"llm-{name}", daemon=True).start()
+
+    with lock:
+        launch("primary", False)
+
+    if not progress.wait(delay):
+        logger.info(f"LLM hedge: model={model}, attempt={attempt}, no {'first token' if stream else 'response'} after {delay:.1f}s")
+        with lock:
+            if not owner:
+                launch("hedge", True)
+
+    error = None
+    for _ in range(len(cancels)):
+        result = results.get()
+        if result["status"] == "success":
+            for cancel in cancels.values():
+                cancel.set()
+            return result
+        if result["status"] == "error" or error is None:
+            error = result
+    return error
+
+def call_llm_with_policy(prompt: str, track_id: int, model: str = None, stream: bool = False, on_delta=None, on_retry=None, **call_kwargs) -> dict:
+    """call_llm с повторами, хеджированием и запасными моделями.
+
+    Каждая попытка (и каждый дубликат) пишется отдельной строкой LLMRequest.
+    on_retry(attempt, model) вызывается перед повторной попыткой — например,
+    чтобы сбросить частично показанный стрим.
+    """
+    primary = model or os.getenv("LLM_MODEL", "gpt-4.1-nano")
+    models = [primary] + [m for m in LLM_FALLBACK_MODELS if m != primary]
+    call_kwargs = {"prompt": prompt, "form_data": None, "track_id": track_id, "stream": stream, **call_kwargs}
+
+    attempt = 0
+    result = None
+    for model in models:
+        for retry in range(LLM_RETRIES + 1):
+            attempt += 1
+            if attempt > 1:
+                if on_retry:
+                    on_retry(attempt, model)
+                logger.warning(f"LLM retry: track_id={track_id}, model={model}, attempt={attempt}, previous error: {result.get('error')}")
+
+            delay = hedge_delay(model, stream)
+            if delay is None:
+                result = _attempt(call_kwargs, model, attempt, False, on_delta, None)
+            else:
+                result = _hedged_attempt(call_kwargs, model, attempt, stream, on_delta, delay)
+
+            if result["status"] == "success":
+                return {**result, "attempts": attempt}
+            if not result.get("retryable") or retry == LLM_RETRIES:
+                break
+            # Экспоненциальная пауза с полным джиттером
+            time.sleep(random.uniform(0, min(LLM_RETRY_BACKOFF_MAX, LLM_RETRY_BACKOFF * 2 ** retry)))
+
+    return {**result, "attempts": attempt}
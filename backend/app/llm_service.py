@@ -2,90 +2,325 @@ import os
 import json
 import time
 import hashlib
-from openai import OpenAI
-from sqlalchemy.orm import Session
-from app.models import LLMRequest, Track
+import threading
+from openai import OpenAI, RateLimitError, APIConnectionError, InternalServerError
+from app.models import Track
+from app.llm_cache import CACHE_ENABLED, make_cache_key, get_cached, set_cached
+from app import rate_limiter, metrics, llm_telemetry
 import logging
 
 logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Встроенные ретраи SDK отключены: 429 должен видеть общий лимитер,
+# остальные повторы делает политика в app.llm_policy
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=0,
+    timeout=float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "600"))
+)
+
+SYSTEM_PROMPT = "Ты стратегический консультант. Отвечай подробно, структурированно, используй bullets и нумерованные списки. НИКОГДА не используй ASCII-таблицы (|---|---), вместо них используй простые нумерованные списки или bullets с отступами."
+
+# Параметры запроса по умолчанию; у треков их переопределяет Prompt.params
+DEFAULT_MAX_TOKENS = 16000
+DEFAULT_TEMPERATURE = 0.7
+
+# Как часто отдаём накопленные токены подписчику при стриминге
+STREAM_FLUSH_INTERVAL = float(os.getenv("LLM_STREAM_FLUSH_MS", "250")) / 1000
+
+# Сколько запросов к модели держит одновременно один процесс (важно для threads-пула воркера).
+# Лимит не общий: у N воркеров в полёте до N × LLM_PROCESS_MAX_INFLIGHT запросов.
+# Общие для всех процессов ограничения RPM/TPM провайдера держит rate_limiter в Redis.
+LLM_PROCESS_MAX_INFLIGHT = int(os.getenv("LLM_PROCESS_MAX_INFLIGHT") or os.getenv("LLM_MAX_INFLIGHT", "100"))
+_process_inflight = threading.BoundedSemaphore(LLM_PROCESS_MAX_INFLIGHT)
+
+# Сколько раз после 429 возвращаемся в очередь лимитера
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "5"))
+
+# Ошибки, после которых имеет смысл повторить запрос
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+def token_usage(usage) -> dict:
+    """Токены запроса: вход, выход и часть входа, взятая провайдером из кэша префиксов.
+
+    usage — объект SDK или словарь из ответа (Batch API); без usage — только total_tokens=0.
+    """
+    if usage is None:
+        usage = {}
+    elif not isinstance(usage, dict):
+        usage = usage.model_dump()
+    prompt_tokens = usage.get("prompt_tokens")
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": usage.get("completion_tokens"),
+        "cached_tokens": (details.get("cached_tokens") or 0) if prompt_tokens is not None else None,
+        "total_tokens": usage.get("total_tokens") or 0
+    }
+
+def _stream_completion(params: dict, on_delta=None, cancel: threading.Event = None):
+    """Читает стрим ответа, пачками отдаёт дельты в on_delta, возвращает (текст, usage, мс до первого токена).
+    
+    В usage добавляется finish_reason: "length" — ответ обрезан по max_tokens.
+    
+    Если выставлен cancel, стрим закрывается на следующем фрагменте.
+    """
+    params = {**params, "stream": True, "stream_options": {"include_usage": True}}
+    
+    parts = []
+    pending = []
+    usage = token_usage(None)
+    finish_reason = None
+    first_token_ms = None
+    start_time = time.time()
+    last_flush = start_time
+    
+    def emit(text):
+        # Сбой доставки дельты не должен ронять сам вызов LLM
+        try:
+            on_delta(text)
+        except Exception as e:
+            logger.warning(f"LLM delta delivery failed: {e}")
+    
+    with client.chat.completions.create(**params) as response:
+        for chunk in response:
+            if cancel and cancel.is_set():
+                break
+            if chunk.usage:
+                usage = token_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            
+            piece = chunk.choices[0].delta.content
+            if not piece:
+                continue
+            parts.append(piece)
+            if first_token_ms is None:
+                first_token_ms = int((time.time() - start_time) * 1000)
+            
+            if on_delta:
+                pending.append(piece)
+                # Первый фрагмент отправляем сразу, дальше — не чаще STREAM_FLUSH_INTERVAL
+                if len(parts) == 1 or time.time() - last_flush >= STREAM_FLUSH_INTERVAL:
+                    emit("".join(pending))
+                    pending = []
+                    last_flush = time.time()
+    
+    if on_delta and pending and not (cancel and cancel.is_set()):
+        emit("".join(pending))
+    
+    return "".join(parts), {**usage, "finish_reason": finish_reason}, first_token_ms
+
+def _limited_completion(params: dict, estimated_tokens: int, stream: bool, on_delta=None, cancel: threading.Event = None):
+    """Запрос к модели через общий лимитер: при 429 ждём и повторяем, а не падаем.
+    
+    Возвращает (текст, usage, мс до первого токена, время ожидания в очереди, мс).
+    """
+    model = params["model"]
+    queue_wait_ms = 0
+    
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        lease = rate_limiter.acquire(model, estimated_tokens)
+        queue_wait_ms += lease.wait_ms
+        try:
+            if stream:
+                result_text, usage, first_token_ms = _stream_completion(params, on_delta, cancel)
+            else:
+                response = client.chat.completions.create(**params)
+                result_text = response.choices[0].message.content
+                usage = {**token_usage(response.usage), "finish_reason": response.choices[0].finish_reason}
+                first_token_ms = None
+        except RateLimitError as e:
+            rate_limiter.release(lease, throttled=True, retry_after_ms=rate_limiter.retry_after_ms(e))
+            if attempt == LLM_RATE_LIMIT_RETRIES:
+                raise
+            continue
+        except Exception:
+            rate_limiter.release(lease)
+            raise
+        
+        rate_limiter.release(lease, used_tokens=usage["total_tokens"])
+        return result_text, usage, first_token_ms, queue_wait_ms
+
+def _cached_response(cached: dict, track_id: int, prompt_hash: str, model: str, start_time: float, on_delta=None, attempt: int = 1, hedged: bool = False, prompt_id: int = None) -> dict:
+    """Отдаёт ответ из кэша: токены не тратятся, в лог пишется cache_status=hit"""
+    response_time_ms = int((time.time() - start_time) * 1000)
+    
+    if on_delta:
+        try:
+            on_delta(cached["result"])
+        except Exception as e:
+            logger.warning(f"LLM delta delivery failed: {e}")
+    
+    llm_telemetry.record(
+        track_id=track_id,
+        prompt_hash=prompt_hash,
+        model=model,
+        tokens_used=0,
+        response_time_ms=response_time_ms,
+        status="success",
+        cache_status="hit",
+        attempt=attempt,
+        hedged=hedged,
+        prompt_id=prompt_id
+    )
+    
+    metrics.LLM_REQUEST_SECONDS.labels(model, "success", "hit").observe(response_time_ms / 1000)
+    logger.info(f"LLM cache hit: track_id={track_id}, time={response_time_ms}ms")
+    
+    return {
+        "status": "success",
+        "result": cached["result"],
+        "tokens": 0,
+        "response_time_ms": response_time_ms,
+        "cached": True
+    }
+
+def build_params(model: str, system_prompt: str, prompt: str, max_tokens: int, temperature: float = None) -> dict:
+    """Тело запроса chat.completions — общее для онлайн-вызовов и Batch API.
+
+    Системный промпт и начало prompt одинаковы у всех анализов — провайдер кэширует этот префикс,
+    поэтому изменяемая часть (контекст из анкеты) должна идти в конце prompt.
+    """
+    is_gpt5 = model.startswith("gpt-5") or model.startswith("o1") or model.startswith("o3") or model.startswith("o4")
+    
+    params = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    }
+    
+    if is_gpt5:
+        params["max_completion_tokens"] = max_tokens
+    else:
+        params["max_tokens"] = max_tokens
+        # Модели с рассуждением temperature не принимают
+        params["temperature"] = DEFAULT_TEMPERATURE if temperature is None else temperature
+    return params
 
 def call_llm(
     prompt: str,
     form_data: dict,
     track_id: int,
-    db: Session,
-    model: str = None
+    model: str = None,
+    stream: bool = False,
+    on_delta=None,
+    use_cache: bool = True,
+    system_prompt: str = None,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    temperature: float = None,
+    timeout: float = None,
+    attempt: int = 1,
+    hedged: bool = False,
+    cancel: threading.Event = None,
+    prompt_id: int = None
 ) -> dict:
-    """Вызывает LLM и сохраняет метрики в БД"""
+    """Вызывает LLM и ставит метрики в очередь на запись в БД (одна строка LLMRequest на попытку).
+    
+    При stream=True ответ читается потоком, фрагменты текста передаются в on_delta.
+    Одинаковые запросы отдаются из кэша; use_cache=False принудительно идёт в модель.
+    Если form_data=None, prompt считается уже готовым текстом.
+    cancel позволяет прервать попытку, которая проиграла дублирующему запросу.
+    prompt_id — версия промпта трека, по ней считается доля кэшированных входных токенов.
+    timeout (с) заменяет общий LLM_REQUEST_TIMEOUT_SECONDS для этого запроса.
+    """
     model = model or os.getenv("LLM_MODEL", "gpt-4.1-nano")
+    system_prompt = system_prompt or SYSTEM_PROMPT
     
-    formatted_prompt = prompt.format(**form_data)
+    formatted_prompt = prompt.format(**form_data) if form_data is not None else prompt
     prompt_hash = hashlib.sha256(formatted_prompt.encode()).hexdigest()
     
     start_time = time.time()
+    cache_status = "bypass"
+    queue_wait_ms = None
+    first_token_ms = None
     
     try:
-        is_gpt5 = model.startswith("gpt-5") or model.startswith("o1") or model.startswith("o3") or model.startswith("o4")
+        params = build_params(model, system_prompt, formatted_prompt, max_tokens, temperature)
         
-        params = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "Ты стратегический консультант. Отвечай подробно, структурированно, используй bullets и нумерованные списки. НИКОГДА не используй ASCII-таблицы (|---|---), вместо них используй простые нумерованные списки или bullets с отступами."},
-                {"role": "user", "content": formatted_prompt}
-            ]
-        }
+        cache_key = None
+        if use_cache and CACHE_ENABLED:
+            cache_key = make_cache_key(model, system_prompt, params.get("temperature"), max_tokens, formatted_prompt)
+            cached = get_cached(cache_key)
+            if cached:
+                return _cached_response(cached, track_id, prompt_hash, model, start_time, on_delta, attempt, hedged, prompt_id)
+            cache_status = "miss"
         
-        if is_gpt5:
-            params["max_completion_tokens"] = 16000
-        else:
-            params["max_tokens"] = 16000
-            params["temperature"] = 0.7
-        
-        response = client.chat.completions.create(**params)
+        estimated_tokens = rate_limiter.estimate_tokens(system_prompt + formatted_prompt, max_tokens)
+        with _process_inflight:
+            request_params = {**params, "timeout": timeout} if timeout else params
+            result_text, usage, first_token_ms, queue_wait_ms = _limited_completion(request_params, estimated_tokens, stream, on_delta, cancel)
+        total_tokens = usage["total_tokens"]
         response_time_ms = int((time.time() - start_time) * 1000)
-        result_text = response.choices[0].message.content
         
-        llm_log = LLMRequest(
+        # Попытку обогнал дублирующий запрос: ответ (возможно, неполный) не используем
+        status = "cancelled" if cancel and cancel.is_set() else "success"
+        
+        # Обрезанный по max_tokens ответ не кэшируем: повтор с большим лимитом должен уйти в модель
+        if cache_key and result_text and status == "success" and usage["finish_reason"] != "length":
+            set_cached(cache_key, {"result": result_text, "tokens": total_tokens})
+        
+        llm_telemetry.record(
             track_id=track_id,
             prompt_hash=prompt_hash,
             model=model,
-            tokens_used=response.usage.total_tokens,
+            tokens_used=total_tokens,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            cached_tokens=usage["cached_tokens"],
+            finish_reason=usage["finish_reason"],
             response_time_ms=response_time_ms,
-            status="success"
+            status=status,
+            cache_status=cache_status,
+            queue_wait_ms=queue_wait_ms,
+            attempt=attempt,
+            hedged=hedged,
+            first_token_ms=first_token_ms,
+            prompt_id=prompt_id
         )
-        db.add(llm_log)
-        db.commit()
         
-        logger.info(f"LLM success: track_id={track_id}, tokens={response.usage.total_tokens}, time={response_time_ms}ms")
+        metrics.LLM_REQUEST_SECONDS.labels(model, status, cache_status).observe(response_time_ms / 1000)
+        metrics.LLM_QUEUE_WAIT_SECONDS.labels(model).observe((queue_wait_ms or 0) / 1000)
+        logger.info(f"LLM {status}: track_id={track_id}, model={model}, attempt={attempt}, hedged={hedged}, "
+                    f"tokens={total_tokens}, cached={usage['cached_tokens']}, time={response_time_ms}ms, queue={queue_wait_ms}ms")
         
         return {
-            "status": "success",
+            "status": status,
             "result": result_text,
-            "tokens": response.usage.total_tokens,
-            "response_time_ms": response_time_ms
+            "tokens": total_tokens,
+            "response_time_ms": response_time_ms,
+            "first_token_ms": first_token_ms,
+            "finish_reason": usage["finish_reason"]
         }
         
     except Exception as e:
         response_time_ms = int((time.time() - start_time) * 1000)
         
-        llm_log = LLMRequest(
+        llm_telemetry.record(
             track_id=track_id,
             prompt_hash=prompt_hash,
             model=model,
             tokens_used=0,
             response_time_ms=response_time_ms,
             status="error",
-            error=str(e)
+            error=str(e),
+            cache_status=cache_status,
+            queue_wait_ms=queue_wait_ms,
+            attempt=attempt,
+            hedged=hedged,
+            prompt_id=prompt_id
         )
-        db.add(llm_log)
-        db.commit()
         
-        logger.error(f"LLM error: track_id={track_id}, error={str(e)}")
+        metrics.LLM_REQUEST_SECONDS.labels(model, "error", cache_status).observe(response_time_ms / 1000)
+        logger.error(f"LLM error: track_id={track_id}, model={model}, attempt={attempt}, error={str(e)}")
         
         return {
             "status": "error",
             "error": str(e),
+            "retryable": isinstance(e, RETRYABLE_ERRORS),
             "response_time_ms": response_time_ms
         }
\ No newline at end of file
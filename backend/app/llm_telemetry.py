@@ -0,0 +1,144 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError, InterfaceError
+from app.database import SessionLocal
+from app.models import LLMRequest
+
+logger = logging.getLogger(__name__)
+
+# Строки LLMRequest копятся в памяти процесса и пишутся пачкой фоновым потоком:
+# запрос к модели не ждёт коммита и не делит транзакцию с треком
+TELEMETRY_BATCH_SIZE = int(os.getenv("LLM_TELEMETRY_BATCH_SIZE", "200"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("LLM_TELEMETRY_FLUSH_SECONDS", "2"))
+# Потолок буфера, если БД недоступна: дальше выбрасываем самые старые строки
+TELEMETRY_MAX_BUFFER = int(os.getenv("LLM_TELEMETRY_MAX_BUFFER", "10000"))
+
+# Одинаковый набор ключей у всех строк — тогда пачка уходит одним multi-row INSERT
+FIELDS = [column.name for column in LLMRequest.__table__.columns if column.name != "id"]
+# БД недоступна или оборвала соединение: пачку стоит повторить позже.
+# Остальные ошибки (DataError, IntegrityError...) относятся к самим строкам — повтор не поможет.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+_buffer = deque()
+_dropped = 0
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_writer_pid = None
+
+def _reset_after_fork():
+    # Буфер родителя запишет сам родитель; блокировки могли остаться захваченными его потоками
+    global _buffer, _dropped, _lock, _flush_lock, _wakeup, _writer_pid
+    _buffer = deque()
+    _dropped = 0
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _wakeup = threading.Event()
+    _writer_pid = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def record(**fields):
+    """Ставит строку LLMRequest в очередь на запись; в БД не ходит"""
+    global _dropped
+    _start_writer()
+
+    row = dict.fromkeys(FIELDS)
+    row.update(fields)
+    # Время запроса, а не записи пачки
+    row["created_at"] = row["created_at"] or datetime.now(timezone.utc)
+
+    with _lock:
+        if len(_buffer) >= TELEMETRY_MAX_BUFFER:
+            _buffer.popleft()
+            _dropped += 1
+        _buffer.append(row)
+        full = len(_buffer) >= TELEMETRY_BATCH_SIZE
+    if full:
+        _wakeup.set()
+
+def _write(rows: list) -> list:
+    """Пишет пачку; возвращает строки, не записанные из-за недоступности БД.
+
+    Пачку, которую БД отвергла из-за самих данных, делим пополам, пока не останутся
+    отдельные плохие строки — их отбрасываем, остальные записываются.
+    """
+    chunks = [rows]
+    while chunks:
+        chunk = chunks.pop()
+        db = SessionLocal()
+        try:
+            db.execute(insert(LLMRequest), chunk)
+            db.commit()
+        except TRANSIENT_ERRORS as e:
+            db.rollback()
+            logger.error(f"LLM telemetry flush failed, rows kept: {e}")
+            return chunk + [row for rest in reversed(chunks) for row in rest]
+        except Exception as e:
+            db.rollback()
+            if len(chunk) == 1:
+                row = chunk[0]
+                logger.error(f"LLM telemetry row dropped: track_id={row['track_id']}, model={row['model']}, "
+                             f"status={row['status']}, created_at={row['created_at']}: {e}")
+            else:
+                middle = len(chunk) // 2
+                chunks += [chunk[middle:], chunk[:middle]]
+        finally:
+            db.close()
+    return []
+
+def flush() -> bool:
+    """Записывает всё накопленное пачками по TELEMETRY_BATCH_SIZE.
+
+    Если БД не ответила, строки возвращаются в начало буфера; False — запись не удалась.
+    Строки, которые БД не принимает, отбрасываются с записью в лог.
+    """
+    global _dropped
+    with _flush_lock:
+        while True:
+            with _lock:
+                rows = [_buffer.popleft() for _ in range(min(len(_buffer), TELEMETRY_BATCH_SIZE))]
+                dropped, _dropped = _dropped, 0
+            if dropped:
+                logger.warning(f"LLM telemetry buffer full: {dropped} rows dropped")
+            if not rows:
+                return True
+
+            kept = _write(rows)
+            if kept:
+                with _lock:
+                    space = max(TELEMETRY_MAX_BUFFER - len(_buffer), 0)
+                    _buffer.extendleft(reversed(kept[:space]))
+                    _dropped += len(kept) - len(kept[:space])
+                return False
+
+def _run():
+    while True:
+        _wakeup.wait(TELEMETRY_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            if not flush():
+                # БД недоступна: не долбим её на каждой новой строке
+                time.sleep(TELEMETRY_FLUSH_INTERVAL)
+        except Exception as e:
+            logger.error(f"LLM telemetry writer error: {e}")
+
+def _start_writer():
+    global _writer_pid
+    if _writer_pid == os.getpid():
+        return
+    with _lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+    threading.Thread(target=_run, name="llm-telemetry", daemon=True).start()
+
+# Обычный выход процесса (API, threads-воркер); дочерние процессы prefork завершаются
+# через os._exit — для них flush вызывает сигнал worker_process_shutdown в celery_app
+atexit.register(flush)
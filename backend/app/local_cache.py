@@ -0,0 +1,64 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Потокобезопасный in-process LRU с TTL и ограничением по числу записей и объёму"""
+
+    def __init__(self, max_items: int = 256, max_bytes: int = 0, ttl: float = 0):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, size, expires_at = item
+            if expires_at and expires_at < time.time():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, size: int = None, ttl: float = None):
+        size = size if size is not None else sys.getsizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else 0
+
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            # Вытесняем самые старые записи, пока не уложимся в лимиты
+            while self._data and (
+                len(self._data) > self.max_items
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _pop(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
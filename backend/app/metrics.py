@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import socket
+from prometheus_client import Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, values
+from prometheus_client import multiprocess
+
+# Общий для API и воркеров каталог (том) — /metrics API собирает из него метрики всех процессов.
+# Без PROMETHEUS_MULTIPROC_DIR метрики живут в памяти процесса (локальный запуск).
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# В каждом контейнере pid начинаются с 1, поэтому в имя файла метрик добавляем сервис
+SERVICE = os.getenv("METRICS_SERVICE") or socket.gethostname()
+
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    values.ValueClass = values.MultiProcessValue(process_identifier=lambda: f"{SERVICE}-{os.getpid()}")
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Секунды: от быстрых HTTP-ответов до минутных ответов модели
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "bizeval_http_request_duration_seconds", "Время ответа API",
+    ["method", "route", "status"], buckets=BUCKETS
+)
+WS_EVENT_DELIVERY_SECONDS = Histogram(
+    "bizeval_ws_event_delivery_seconds", "От записи события в stream до отправки в WebSocket",
+    buckets=BUCKETS
+)
+CELERY_QUEUE_WAIT_SECONDS = Histogram(
+    "bizeval_celery_queue_wait_seconds", "Ожидание задачи в очереди Celery",
+    ["task"], buckets=BUCKETS
+)
+CELERY_TASK_SECONDS = Histogram(
+    "bizeval_celery_task_duration_seconds", "Выполнение задачи Celery",
+    ["task", "state"], buckets=BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "bizeval_analysis_stage_seconds", "Этапы анализа: треки, дайджесты, синтез, документы, S3, всего",
+    ["stage"], buckets=BUCKETS
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "bizeval_llm_request_duration_seconds", "Запрос к LLM, включая ожидание лимита",
+    ["model", "status", "cache"], buckets=BUCKETS
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "bizeval_llm_rate_limit_wait_seconds", "Ожидание слота в общем лимите запросов к LLM",
+    ["model"], buckets=BUCKETS
+)
+DOCUMENT_RENDER_SECONDS = Histogram(
+    "bizeval_document_render_seconds", "Рендеринг документа отчета",
+    ["format"], buckets=BUCKETS
+)
+S3_UPLOAD_SECONDS = Histogram(
+    "bizeval_s3_upload_duration_seconds", "Загрузка файла в S3, включая повторы",
+    ["result"], buckets=BUCKETS
+)
+
+def reset_process_files():
+    """Удаляет файлы метрик прошлых процессов этого сервиса — вызывается при старте"""
+    if not MULTIPROC_DIR:
+        return
+    # Имя файла — {тип}_{сервис}-{pid}.db; сервис сравниваем целиком,
+    # иначе у worker под шаблон попали бы живые файлы worker-llm и worker-batch
+    pattern = re.compile(rf"(counter|histogram|summary|gauge_[a-z]+)_{re.escape(SERVICE)}-(\d+)\.db")
+    for name in os.listdir(MULTIPROC_DIR):
+        match = pattern.fullmatch(name)
+        # Свои файлы уже открыты этим процессом
+        if not match or int(match.group(2)) == os.getpid():
+            continue
+        try:
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+        except OSError:
+            pass
+
+def render() -> bytes:
+    """Текстовый формат Prometheus; в multiprocess-режиме — по всем процессам всех сервисов"""
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    return generate_latest(registry)
+
+class PrometheusMiddleware:
+    """ASGI-middleware: время HTTP-ответов по шаблону маршрута (без id в пути)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route.path if route else "unmatched", str(status[0])
+            ).observe(time.perf_counter() - start)
+
+# --- Celery ---
+
+def instrument_celery():
+    """Ожидание в очереди и длительность задач по сигналам Celery"""
+    from celery.signals import before_task_publish, task_prerun, task_postrun
+
+    @before_task_publish.connect(weak=False)
+    def stamp_sent_at(headers=None, **kwargs):
+        headers["sent_at"] = time.time()
+
+    @task_prerun.connect(weak=False)
+    def start_timer(task=None, **kwargs):
+        sent_at = getattr(task.request, "sent_at", None)
+        if sent_at:
+            CELERY_QUEUE_WAIT_SECONDS.labels(task.name).observe(max(time.time() - sent_at, 0))
+        task.request._metrics_start = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def stop_timer(task=None, state=None, **kwargs):
+        start = getattr(task.request, "_metrics_start", None)
+        if start:
+            CELERY_TASK_SECONDS.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - start)
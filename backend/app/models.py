@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Boolean, Float
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, Text, JSON, ForeignKey, Boolean, Float, Index, LargeBinary
+from sqlalchemy.sql import func, text
 from app.database import Base
 
 class Session(Base):
@@ -16,21 +16,43 @@ class Form(Base):
     __tablename__ = "forms"
     
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("sessions.id"))
+    session_id = Column(Integer, ForeignKey("sessions.id"), index=True)
     payload = Column(JSON)
     submitted_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Job(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        # Keyset-пагинация списка анализов, в том числе с фильтром по статусу
+        Index("ix_jobs_created_at_id", "created_at", "id"),
+        Index("ix_jobs_status_created_at_id", "status", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("sessions.id"))
     status = Column(String(50), default="pending", index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     finished_at = Column(DateTime(timezone=True), nullable=True)
+    batch_id = Column(Integer, ForeignKey("batches.id"), nullable=True, index=True)
+
+class Batch(Base):
+    """Пакетная оценка: много анкет, треки идут через Batch API"""
+    __tablename__ = "batches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(50), default="pending", index=True)
+    total = Column(Integer)
+    backend = Column(String(20))
+    # [{"id": id пакета у провайдера, "status": ...}]
+    provider_batches = Column(JSON, default=list)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
 
 class Track(Base):
     __tablename__ = "tracks"
+    __table_args__ = (
+        Index("ix_tracks_job_id_status", "job_id", "status"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     job_id = Column(Integer, ForeignKey("jobs.id"))
@@ -45,14 +67,33 @@ class Report(Base):
     __tablename__ = "reports"
     
     id = Column(Integer, primary_key=True, index=True)
-    job_id = Column(Integer, ForeignKey("jobs.id"))
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True)
     report_json = Column(JSON)
     pdf_url = Column(String(500), nullable=True)
     docx_url = Column(String(500), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class ReportSection(Base):
+    __tablename__ = "report_sections"
+    __table_args__ = (
+        Index("ix_report_sections_job_id_name", "job_id", "name", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"))
+    name = Column(String(50))
+    content = Column(LargeBinary)  # gzip
+    size = Column(Integer)
+    compressed_size = Column(Integer)
+    sha256 = Column(String(64))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Prompt(Base):
     __tablename__ = "prompts"
+    __table_args__ = (
+        # analyze_track ищет только активную версию промпта трека
+        Index("ix_prompts_active_track_name", "track_name", postgresql_where=text("is_active")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     track_name = Column(String(100), index=True)
@@ -76,13 +117,28 @@ class LLMRequest(Base):
     __tablename__ = "llm_requests"
     
     id = Column(Integer, primary_key=True, index=True)
-    track_id = Column(Integer, ForeignKey("tracks.id"), nullable=True)
+    track_id = Column(Integer, ForeignKey("tracks.id"), nullable=True, index=True)
     prompt_hash = Column(String(64))
     model = Column(String(100))
     tokens_used = Column(Integer)
+    # Разбивка токенов из usage ответа; cached_tokens — вход, взятый провайдером из кэша префиксов
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    cached_tokens = Column(Integer, nullable=True)
+    # "length" — ответ упёрся в max_tokens (по таким поднимается бюджет токенов трека)
+    finish_reason = Column(String(20), nullable=True)
+    # Версия промпта трека (для дайджестов и синтеза — пусто)
+    prompt_id = Column(Integer, ForeignKey("prompts.id"), nullable=True, index=True)
     response_time_ms = Column(Integer)
     status = Column(String(50))
     error = Column(Text, nullable=True)
+    cache_status = Column(String(20), nullable=True)
+    # Ожидание в очереди общего лимитера RPM/TPM до отправки запроса
+    queue_wait_ms = Column(Integer, nullable=True)
+    # Номер попытки в политике повторов и признак дублирующего (hedged) запроса
+    attempt = Column(Integer, nullable=True)
+    hedged = Column(Boolean, nullable=True)
+    first_token_ms = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
 
 class Setting(Base):
@@ -92,3 +148,16 @@ class Setting(Base):
     key = Column(String(100), unique=True, nullable=False)
     value = Column(Text)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+# Дневной агрегат для дашборда, пересчитывается периодической задачей
+class DailyJobStat(Base):
+    __tablename__ = "daily_job_stats"
+    
+    day = Column(Date, primary_key=True)
+    jobs_total = Column(Integer, default=0, nullable=False)
+    jobs_done = Column(Integer, default=0, nullable=False)
+    jobs_failed = Column(Integer, default=0, nullable=False)
+    jobs_partial = Column(Integer, default=0, nullable=False)
+    llm_requests = Column(Integer, default=0, nullable=False)
+    tokens_used = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import string
+import logging
+import threading
+import redis
+from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from app.database import SessionLocal
+from app.models import Prompt
+from app.routers.forms import FormData
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379/0"), decode_responses=True)
+
+INVALIDATE_CHANNEL = "prompts:invalidate"
+FORM_FIELDS = set(FormData.model_fields)
+
+_CONVERSIONS = {"s": str, "r": repr, "a": ascii}
+
+class PromptParams(BaseModel):
+    """Параметры запуска трека из Prompt.params; пустое поле — значение по умолчанию"""
+    model_config = ConfigDict(extra="forbid", protected_namespaces=())
+
+    model: Optional[str] = Field(None, min_length=1, max_length=100)
+    max_tokens: Optional[int] = Field(None, gt=0, le=128000)
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    timeout: Optional[float] = Field(None, gt=0, le=3600)
+    stream: Optional[bool] = None
+
+class CompiledPrompt:
+    """Шаблон промпта, разобранный один раз: поля проверены по схеме FormData.
+
+    Провайдер кэширует общий префикс запросов, поэтому в шаблонах методика идёт
+    первой, а поля анкеты — в конце.
+    """
+
+    def __init__(self, template: str, id: int = None, track_name: str = None, version: int = None, params: dict = None):
+        self.id = id
+        self.track_name = track_name
+        self.version = version
+        self.template = template
+
+        try:
+            # Только заданные параметры: остальное берёт call_llm по умолчанию
+            self.params = PromptParams.model_validate(params or {}).model_dump(exclude_none=True)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            raise ValueError(f"Некорректные параметры: {errors}")
+
+        try:
+            self.segments = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError(f"Некорректный шаблон: {e}")
+
+        self.fields = {field for _, field, _, _ in self.segments if field is not None}
+        unknown = self.fields - FORM_FIELDS
+        if unknown:
+            raise ValueError(f"Неизвестные поля в шаблоне: {', '.join(sorted(unknown))}")
+
+        # Литеральный текст после первого поля анкеты: его провайдер не сможет кэшировать как общий префикс
+        self.uncached_static_chars = 0
+        seen_field = False
+        for literal, field, _, _ in self.segments:
+            if seen_field:
+                self.uncached_static_chars += len(literal)
+            if field is not None:
+                seen_field = True
+
+    def render(self, form_data: dict) -> str:
+        """Эквивалент template.format(**form_data) без повторного разбора шаблона"""
+        parts = []
+        for literal, field, spec, conversion in self.segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            value = form_data[field]
+            if conversion:
+                value = _CONVERSIONS[conversion](value)
+            parts.append(format(value, spec or ""))
+        return "".join(parts)
+
+_prompts = {}
+_loaded = False
+_lock = threading.Lock()
+_listener_pid = None
+
+def load_prompts():
+    """Загружает все активные промпты одним запросом и атомарно подменяет реестр"""
+    global _prompts, _loaded
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Prompt).filter(Prompt.is_active == True).all()
+    finally:
+        db.close()
+
+    compiled = {}
+    for p in rows:
+        try:
+            compiled[p.track_name] = CompiledPrompt(p.prompt_template, p.id, p.track_name, p.version, p.params)
+        except ValueError as e:
+            logger.error(f"Prompt {p.track_name} v{p.version} skipped: {e}")
+
+    with _lock:
+        _prompts = compiled
+        _loaded = True
+    logger.info(f"Prompt registry loaded: {', '.join(f'{k} v{v.version}' for k, v in compiled.items())}")
+
+def get_prompt(track_name: str):
+    """Активный промпт трека из памяти процесса (в БД идём только при первом обращении)"""
+    if not _loaded:
+        load_prompts()
+    return _prompts.get(track_name)
+
+def publish_invalidation(track_name: str = None):
+    """Сообщает всем воркерам, что активные промпты изменились"""
+    try:
+        redis_client.publish(INVALIDATE_CHANNEL, json.dumps({"track_name": track_name}))
+    except Exception as e:
+        logger.error(f"Prompt invalidation publish failed: {e}")
+
+def start_listener():
+    """Фоновый поток: прогревает реестр и перечитывает его по сообщению об инвалидации"""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    _listener_pid = os.getpid()
+
+    def listen():
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                # Перечитываем после (пере)подписки, чтобы не пропустить обновления за время разрыва
+                load_prompts()
+                for message in pubsub.listen():
+                    logger.info(f"Prompt invalidation received: {message['data']}")
+                    load_prompts()
+            except Exception as e:
+                logger.warning(f"Prompt registry listener error: {e}")
+                time.sleep(5)
+
+    threading.Thread(target=listen, name="prompt-registry", daemon=True).start()
@@ -0,0 +1,202 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, case, select, tuple_, or_
+from app.models import Batch, Job, Form, Track, LLMRequest, Prompt, DailyJobStat, ReportSection
+from app.report_store import MANIFEST_COLUMNS
+
+# Запросы роутеров и задач с нетривиальной структурой. Ими же пользуется check_query_plans.py:
+# EXPLAIN проверяет ровно тот SQL, который уходит в базу из обработчиков.
+
+def stats_rollup(date_from: date = None, date_to: date = None):
+    """Строки по дням и итог за период (строка с day = NULL) одним GROUP BY ROLLUP"""
+    query = select(
+        DailyJobStat.day,
+        func.sum(DailyJobStat.jobs_total),
+        func.sum(DailyJobStat.jobs_done),
+        func.sum(DailyJobStat.tokens_used)
+    ).group_by(func.rollup(DailyJobStat.day))
+    if date_from:
+        query = query.where(DailyJobStat.day >= date_from)
+    if date_to:
+        query = query.where(DailyJobStat.day <= date_to)
+    return query
+
+def jobs_page(status: str = None, date_from: date = None, date_to: date = None, after: tuple = None, limit: int = 20):
+    """Страница списка анализов, keyset-пагинация: after — (created_at, id) последней строки"""
+    # Берём industry_products из новой анкеты, или idea_description из старой, обрезаем прямо в SQL
+    idea = (
+        select(func.substr(func.coalesce(
+            Form.payload['industry_products'].as_string(),
+            Form.payload['idea_description'].as_string(),
+            'N/A'
+        ), 1, 100))
+        .where(Form.session_id == Job.session_id)
+        .order_by(Form.id)
+        .limit(1)
+        .correlate(Job)
+        .scalar_subquery()
+    )
+
+    query = select(Job.id, Job.created_at, Job.status, func.coalesce(idea, 'N/A'))
+    if status:
+        query = query.where(Job.status == status)
+    if date_from:
+        query = query.where(Job.created_at >= date_from)
+    if date_to:
+        query = query.where(Job.created_at < date_to + timedelta(days=1))
+    if after:
+        query = query.where(tuple_(Job.created_at, Job.id) < tuple_(*after))
+    return query.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit)
+
+def prompt_versions(track_names: list):
+    return select(Prompt).where(Prompt.track_name.in_(track_names)).order_by(Prompt.track_name, Prompt.version.desc())
+
+def llm_logs(limit: int = 50):
+    return select(LLMRequest).order_by(LLMRequest.created_at.desc()).limit(limit)
+
+def prompt_cache_usage(since: datetime):
+    """Токены и кэш префиксов по версиям промптов за период"""
+    return (
+        select(
+            Prompt.track_name,
+            Prompt.version,
+            Prompt.is_active,
+            func.count(LLMRequest.id),
+            func.sum(LLMRequest.prompt_tokens),
+            func.sum(LLMRequest.cached_tokens),
+            func.sum(LLMRequest.completion_tokens),
+            func.avg(LLMRequest.first_token_ms)
+        )
+        .join(Prompt, Prompt.id == LLMRequest.prompt_id)
+        .where(LLMRequest.created_at >= since, LLMRequest.prompt_tokens.isnot(None))
+        .group_by(Prompt.track_name, Prompt.version, Prompt.is_active)
+        .order_by(Prompt.track_name, Prompt.version.desc())
+    )
+
+def jobs_by_day(since: date):
+    """Анкеты по дням: всего, done, failed, partial"""
+    day = func.date(Job.created_at)
+    return select(
+        day,
+        func.count(Job.id),
+        func.sum(case((Job.status == 'done', 1), else_=0)),
+        func.sum(case((Job.status == 'failed', 1), else_=0)),
+        func.sum(case((Job.status == 'partial', 1), else_=0))
+    ).where(Job.created_at >= since).group_by(day)
+
+def llm_requests_by_day(since: date):
+    """Запросы к модели и токены по дням"""
+    day = func.date(LLMRequest.created_at)
+    return select(
+        day,
+        func.count(LLMRequest.id),
+        func.coalesce(func.sum(LLMRequest.tokens_used), 0)
+    ).where(LLMRequest.created_at >= since).group_by(day)
+
+def hedge_latency(model: str, stream: bool, percentile: float, samples: int):
+    """(число ответов, перцентиль латентности, мс) по последним samples ответам модели на треках.
+
+    При стриминге — время до первого токена, иначе — до ответа без ожидания лимитера.
+    """
+    if stream:
+        latency = LLMRequest.first_token_ms
+    else:
+        latency = LLMRequest.response_time_ms - func.coalesce(LLMRequest.queue_wait_ms, 0)
+
+    recent = (
+        select(latency.label("latency"))
+        .where(
+            LLMRequest.model == model,
+            # Только треки: дайджесты и синтез пишутся без track_id и по длительности на них не похожи
+            LLMRequest.track_id.isnot(None),
+            LLMRequest.status == "success",
+            or_(LLMRequest.cache_status.is_(None), LLMRequest.cache_status != "hit"),
+            latency.isnot(None)
+        )
+        .order_by(LLMRequest.id.desc())
+        .limit(samples)
+        .subquery()
+    )
+    return select(func.count(), func.percentile_cont(percentile).within_group(recent.c.latency))
+
+def completion_stats(percentile: float, samples: int, prompt_id: int = None, track_name: str = None):
+    """Длина последних samples ответов версии промпта (или всего трека): число, p50, перцентиль,
+    сколько обрезано по лимиту и самый длинный обрезанный"""
+    if prompt_id is not None:
+        condition = LLMRequest.prompt_id == prompt_id
+    else:
+        condition = LLMRequest.prompt_id.in_(select(Prompt.id).where(Prompt.track_name == track_name))
+
+    recent = (
+        select(LLMRequest.completion_tokens.label("tokens"), LLMRequest.finish_reason.label("finish_reason"))
+        .where(condition, LLMRequest.status == "success", LLMRequest.completion_tokens.isnot(None))
+        .order_by(LLMRequest.id.desc())
+        .limit(samples)
+        .subquery()
+    )
+    return select(
+        func.count(),
+        func.percentile_cont(0.5).within_group(recent.c.tokens),
+        func.percentile_cont(percentile).within_group(recent.c.tokens),
+        func.count().filter(recent.c.finish_reason == "length"),
+        func.max(recent.c.tokens).filter(recent.c.finish_reason == "length")
+    )
+
+def report_sections(job_id: int, name: str = None):
+    query = select(ReportSection).where(ReportSection.job_id == job_id)
+    if name:
+        query = query.where(ReportSection.name == name)
+    return query
+
+def section_manifest_rows(job_id: int):
+    """Разделы отчета без содержимого — для манифеста"""
+    return select(*MANIFEST_COLUMNS).where(ReportSection.job_id == job_id)
+
+def batch_created_day(batch_id: int):
+    """День создания пакета (и всех его анкет) в часовом поясе базы"""
+    return select(func.date(Batch.created_at)).where(Batch.id == batch_id)
+
+def batch_job_ids(batch_id: int):
+    return select(Job.id).where(Job.batch_id == batch_id).order_by(Job.id)
+
+def batch_jobs(batch_id: int):
+    return select(Job.id, Job.status).where(Job.batch_id == batch_id).order_by(Job.id)
+
+def batch_job_counts(batch_id: int):
+    """Анкеты пакета по статусам"""
+    return select(Job.status, func.count()).where(Job.batch_id == batch_id).group_by(Job.status)
+
+def batch_track_counts(batch_id: int):
+    """Треки пакета по статусам"""
+    return (
+        select(Track.status, func.count()).join(Job, Job.id == Track.job_id)
+        .where(Job.batch_id == batch_id).group_by(Track.status)
+    )
+
+def batch_tracks(batch_id: int, status: str):
+    return (
+        select(Track).join(Job, Job.id == Track.job_id)
+        .where(Job.batch_id == batch_id, Track.status == status)
+    )
+
+def queued_batch_tracks(batch_id: int, limit: int):
+    """Следующая порция треков пакета на отправку, вместе с анкетами"""
+    return (
+        select(Track, Form)
+        .join(Job, Job.id == Track.job_id)
+        .join(Form, Form.session_id == Job.session_id)
+        .where(Job.batch_id == batch_id, Track.status == "queued")
+        .order_by(Track.id)
+        .limit(limit)
+    )
+
+def pending_job_track_counts(batch_id: int):
+    """(анкета, статус трека, число) по ещё не завершённым анкетам пакета"""
+    return (
+        select(Track.job_id, Track.status, func.count())
+        .join(Job, Job.id == Track.job_id)
+        .where(Job.batch_id == batch_id, Job.status == "pending")
+        .group_by(Track.job_id, Track.status)
+    )
+
+def unfinished_batch_job(batch_id: int):
+    return select(Job.id).where(Job.batch_id == batch_id, Job.status.in_(["pending", "running"])).limit(1)
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379/0"), decode_responses=True)
+
+# Лимиты аккаунта по умолчанию и переопределения по моделям:
+# LLM_RATE_LIMITS='{"gpt-4.1-nano": {"rpm": 500, "tpm": 200000}}'
+DEFAULT_RPM = int(os.getenv("LLM_RPM_LIMIT", "500"))
+DEFAULT_TPM = int(os.getenv("LLM_TPM_LIMIT", "200000"))
+MODEL_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+
+# Адаптивная конкурентность (AIMD): +1 за "окно" успешных ответов, /2 на 429
+CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "2"))
+CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "50"))
+LEASE_TTL_MS = int(os.getenv("LLM_LEASE_TTL_SECONDS", "600")) * 1000
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "900"))
+DEFAULT_RETRY_AFTER_MS = 5000
+
+# KEYS: rpm bucket, tpm bucket, leases, limit, cooldown
+# ARGV: rpm, tpm, tokens, lease_id, lease_ttl_ms, default_limit
+# Возвращает 0, если слот выдан, иначе сколько мс подождать
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local cooldown = redis.call('PTTL', KEYS[5])
+if cooldown > 0 then return cooldown end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+local limit = tonumber(redis.call('GET', KEYS[4]) or ARGV[6])
+if redis.call('ZCARD', KEYS[3]) >= math.floor(limit) then return 100 end
+
+local function level(key, capacity)
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    return math.min(capacity, tokens + (now - ts) * capacity / 60000)
+end
+
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local need = math.min(tonumber(ARGV[3]), tpm)
+local requests = level(KEYS[1], rpm)
+local tokens = level(KEYS[2], tpm)
+
+local wait = 0
+if requests < 1 then wait = math.ceil((1 - requests) * 60000 / rpm) end
+if tokens < need then wait = math.max(wait, math.ceil((need - tokens) * 60000 / tpm)) end
+if wait > 0 then return wait end
+
+redis.call('HSET', KEYS[1], 'tokens', requests - 1, 'ts', now)
+redis.call('HSET', KEYS[2], 'tokens', tokens - need, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+redis.call('PEXPIRE', KEYS[2], 120000)
+redis.call('ZADD', KEYS[3], now + tonumber(ARGV[5]), ARGV[4])
+redis.call('PEXPIRE', KEYS[3], ARGV[5])
+return 0
+"""
+
+# KEYS: tpm bucket, leases, limit, cooldown
+# ARGV: lease_id, token_delta, throttled, retry_after_ms, min, max, default_limit
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+
+local delta = tonumber(ARGV[2])
+if delta ~= 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'tokens', -delta)
+end
+
+local limit = tonumber(redis.call('GET', KEYS[3]) or ARGV[7])
+if ARGV[3] == '1' then
+    -- Одна волна 429 уменьшает лимит один раз
+    if redis.call('PTTL', KEYS[4]) <= 0 then
+        limit = math.max(tonumber(ARGV[5]), limit / 2)
+    end
+    redis.call('SET', KEYS[4], 1, 'PX', ARGV[4])
+else
+    limit = math.min(tonumber(ARGV[6]), limit + 1 / limit)
+end
+redis.call('SET', KEYS[3], limit, 'EX', 3600)
+return tostring(limit)
+"""
+
+_acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+_release = redis_client.register_script(RELEASE_SCRIPT)
+
+class RateLimitTimeout(Exception):
+    pass
+
+class Lease:
+    """Слот на один запрос к модели: держит место в лимите конкурентности до release"""
+
+    def __init__(self, model: str, lease_id: str, tokens: int, wait_ms: int):
+        self.model = model
+        self.lease_id = lease_id
+        self.tokens = tokens
+        self.wait_ms = wait_ms
+
+def _keys(model: str) -> dict:
+    prefix = f"llm_limit:{model}"
+    return {
+        "rpm": f"{prefix}:rpm",
+        "tpm": f"{prefix}:tpm",
+        "leases": f"{prefix}:leases",
+        "limit": f"{prefix}:concurrency",
+        "cooldown": f"{prefix}:cooldown",
+    }
+
+def estimate_tokens(text: str, max_tokens: int) -> int:
+    """OpenAI списывает с TPM токены промпта + max_tokens; для кириллицы ~3 символа на токен"""
+    return len(text) // 3 + max_tokens
+
+def acquire(model: str, tokens: int) -> Lease:
+    """Ждёт, пока общий лимит всех воркеров позволит отправить запрос.
+
+    Если Redis недоступен, пропускает запрос без ограничений.
+    """
+    limits = MODEL_LIMITS.get(model, {})
+    keys = _keys(model)
+    lease_id = uuid.uuid4().hex
+    start = time.time()
+
+    while True:
+        try:
+            wait_ms = _acquire(
+                keys=[keys["rpm"], keys["tpm"], keys["leases"], keys["limit"], keys["cooldown"]],
+                args=[limits.get("rpm", DEFAULT_RPM), limits.get("tpm", DEFAULT_TPM), tokens, lease_id, LEASE_TTL_MS, CONCURRENCY_MAX]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable, sending without limit: {e}")
+            return Lease(model, None, tokens, int((time.time() - start) * 1000))
+
+        waited = time.time() - start
+        if wait_ms == 0:
+            if waited > 1:
+                logger.info(f"LLM rate limit queue: model={model}, waited={int(waited * 1000)}ms")
+            return Lease(model, lease_id, tokens, int(waited * 1000))
+
+        if waited > QUEUE_TIMEOUT:
+            raise RateLimitTimeout(f"Rate limit queue timeout for {model} after {int(waited)}s")
+        # Небольшой джиттер, чтобы ожидающие воркеры не просыпались одновременно
+        time.sleep(min(wait_ms, 5000) / 1000 * random.uniform(1, 1.2))
+
+def release(lease: Lease, used_tokens: int = None, throttled: bool = False, retry_after_ms: int = None):
+    """Освобождает слот; реальный расход токенов корректирует бакет, 429 снижает конкурентность"""
+    if lease.lease_id is None:
+        return
+
+    keys = _keys(lease.model)
+    delta = used_tokens - lease.tokens if used_tokens is not None else 0
+    try:
+        limit = _release(
+            keys=[keys["tpm"], keys["leases"], keys["limit"], keys["cooldown"]],
+            args=[lease.lease_id, delta, 1 if throttled else 0, retry_after_ms or DEFAULT_RETRY_AFTER_MS,
+                  CONCURRENCY_MIN, CONCURRENCY_MAX, CONCURRENCY_MAX]
+        )
+        if throttled:
+            logger.warning(f"LLM 429 for {lease.model}: concurrency limit -> {float(limit):.1f}, cooldown {retry_after_ms}ms")
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter release failed: {e}")
+
+def retry_after_ms(error) -> int:
+    """Пауза из заголовков 429-ответа (retry-after-ms или retry-after в секундах)"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return int(float(headers["retry-after-ms"]))
+        if headers.get("retry-after"):
+            return int(float(headers["retry-after"]) * 1000)
+    except ValueError:
+        pass
+    return DEFAULT_RETRY_AFTER_MS
@@ -0,0 +1,157 @@
+import os
+import json
+import asyncio
+import logging
+import redis
+import redis.asyncio as aioredis
+from app.local_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# Воркеры пишут статус, API читает готовые ответы — клиенты раздельные
+redis_client = redis.from_url(REDIS_URL)
+async_redis_client = aioredis.from_url(REDIS_URL)
+
+# Готовый отчет не меняется, пока его не перегенерируют; TTL — чтобы Redis мог его вытеснить
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", str(7 * 24 * 3600)))
+# Статус незавершённого анализа обновляется событиями прогресса и снимается на финальном
+REPORT_STATUS_TTL = int(os.getenv("REPORT_STATUS_TTL", "300"))
+# Статус, прочитанный API из БД, — совсем коротко: воркер мог уже завершить анализ
+API_STATUS_TTL = int(os.getenv("REPORT_API_STATUS_TTL", "5"))
+INVALIDATE_CHANNEL = "report_cache:invalidate"
+
+local_cache = LRUCache(
+    max_items=int(os.getenv("REPORT_CACHE_LOCAL_ITEMS", "512")),
+    max_bytes=int(os.getenv("REPORT_CACHE_LOCAL_BYTES", str(64 * 1024 * 1024))),
+    ttl=REPORT_CACHE_TTL
+)
+# Где лежат PDF/DOCX отчета: job_id -> {"pdf": url или путь, "docx": ...}
+local_files = LRUCache(
+    max_items=int(os.getenv("REPORT_CACHE_LOCAL_ITEMS", "512")),
+    ttl=REPORT_CACHE_TTL
+)
+
+def _report_key(job_id: int) -> str:
+    return f"report_cache:{job_id}"
+
+def _status_key(job_id: int) -> str:
+    return f"report_status:{job_id}"
+
+def _files_key(job_id: int) -> str:
+    return f"report_files:{job_id}"
+
+def _dumps(body: dict) -> bytes:
+    # Так же, как сериализует JSONResponse
+    return json.dumps(body, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def status_body(job_id: int, status: str) -> dict:
+    return {"job_id": job_id, "status": status, "message": "В процессе"}
+
+# --- Воркеры (синхронно) ---
+
+def set_status(job_id: int, status: str = "running"):
+    """Обновляет статус незавершённого анализа; вызывается на каждом событии прогресса"""
+    try:
+        redis_client.set(_status_key(job_id), _dumps(status_body(job_id, status)), ex=REPORT_STATUS_TTL)
+    except Exception as e:
+        logger.warning(f"Report status cache write failed: {e}")
+
+def drop_status(job_id: int):
+    try:
+        redis_client.delete(_status_key(job_id))
+    except Exception as e:
+        logger.warning(f"Report status cache delete failed: {e}")
+
+def invalidate(job_id: int):
+    """Отчет (пере)сгенерирован: сбрасываем Redis и LRU во всех процессах API"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.delete(_report_key(job_id), _status_key(job_id), _files_key(job_id))
+        pipe.publish(INVALIDATE_CHANNEL, str(job_id))
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Report cache invalidation failed for job {job_id}: {e}")
+
+# --- API (асинхронно) ---
+
+async def get(job_id: int):
+    """Готовые байты ответа: LRU процесса → отчет в Redis → статус в Redis; None — идти в БД"""
+    raw = local_cache.get(job_id)
+    if raw is not None:
+        return raw
+
+    try:
+        report, status = await async_redis_client.mget(_report_key(job_id), _status_key(job_id))
+    except Exception as e:
+        logger.warning(f"Report cache read failed: {e}")
+        return None
+
+    if report is not None:
+        local_cache.set(job_id, report, size=len(report))
+        return report
+    return status
+
+async def put_report(job_id: int, body: dict) -> bytes:
+    raw = _dumps(body)
+    local_cache.set(job_id, raw, size=len(raw))
+    try:
+        await async_redis_client.set(_report_key(job_id), raw, ex=REPORT_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Report cache write failed: {e}")
+    return raw
+
+async def put_status(job_id: int, body: dict) -> bytes:
+    raw = _dumps(body)
+    try:
+        # nx: не затираем статус, который только что записал воркер
+        await async_redis_client.set(_status_key(job_id), raw, ex=API_STATUS_TTL, nx=True)
+    except Exception as e:
+        logger.warning(f"Report status cache write failed: {e}")
+    return raw
+
+async def get_files(job_id: int):
+    files = local_files.get(job_id)
+    if files is not None:
+        return files
+
+    try:
+        raw = await async_redis_client.get(_files_key(job_id))
+    except Exception as e:
+        logger.warning(f"Report files cache read failed: {e}")
+        return None
+    if raw is None:
+        return None
+
+    files = json.loads(raw)
+    local_files.set(job_id, files, size=len(raw))
+    return files
+
+async def put_files(job_id: int, files: dict):
+    raw = _dumps(files)
+    local_files.set(job_id, files, size=len(raw))
+    try:
+        await async_redis_client.set(_files_key(job_id), raw, ex=REPORT_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Report files cache write failed: {e}")
+
+async def listen_invalidations():
+    """Фоновая задача API: выкидывает из LRU перегенерированные отчеты и их файлы"""
+    while True:
+        pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(INVALIDATE_CHANNEL)
+            # За время разрыва инвалидации могли пройти мимо
+            local_cache.clear()
+            local_files.clear()
+            async for message in pubsub.listen():
+                job_id = int(message["data"])
+                local_cache.delete(job_id)
+                local_files.delete(job_id)
+        except asyncio.CancelledError:
+            await pubsub.aclose()
+            raise
+        except Exception as e:
+            logger.warning(f"Report cache listener error: {e}")
+            await pubsub.aclose()
+            await asyncio.sleep(5)
@@ -0,0 +1,49 @@
+import gzip
+import hashlib
+from app.models import ReportSection
+
+# Разделы отчета и их место в report_json
+SECTIONS = {
+    "market_analysis": ("tracks", "market_analysis"),
+    "growth_opportunities": ("tracks", "growth_opportunities"),
+    "risks_constraints": ("tracks", "risks_constraints"),
+    "executive_summary": ("consolidation", "executive_summary"),
+}
+
+def split_sections(report_json: dict) -> dict:
+    """{имя раздела: текст} из report_json; пустые разделы пропускаются"""
+    sections = {}
+    for name, (group, key) in SECTIONS.items():
+        text = (report_json or {}).get(group, {}).get(key)
+        if text:
+            sections[name] = text
+    return sections
+
+def pack_section(job_id: int, name: str, text: str) -> ReportSection:
+    """Раздел в сжатом виде: gzip отдаётся клиентам как есть, без повторного сжатия"""
+    data = text.encode("utf-8")
+    content = gzip.compress(data, compresslevel=9, mtime=0)
+    return ReportSection(
+        job_id=job_id,
+        name=name,
+        content=content,
+        size=len(data),
+        compressed_size=len(content),
+        sha256=hashlib.sha256(data).hexdigest()
+    )
+
+def pack_sections(job_id: int, report_json: dict) -> list:
+    return [pack_section(job_id, name, text) for name, text in split_sections(report_json).items()]
+
+def section_text(section: ReportSection) -> str:
+    return gzip.decompress(section.content).decode("utf-8")
+
+# Колонки для манифеста: сам content (gzip разделов) читать незачем
+MANIFEST_COLUMNS = (ReportSection.name, ReportSection.size, ReportSection.compressed_size, ReportSection.sha256)
+
+def section_manifest(sections: list) -> dict:
+    """Хэш и размеры каждого раздела — всё, что нужно клиенту, чтобы решить, что загружать.
+
+    sections — разделы или строки с MANIFEST_COLUMNS.
+    """
+    return {s.name: {"hash": s.sha256, "size": s.size, "compressed_size": s.compressed_size} for s in sections}
@@ -1,11 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
-from app.models import AdminUser, Job, LLMRequest, Session as DBSession, Prompt, Setting
+from app.models import AdminUser, Prompt, Setting
+from app import queries
+from app.prompt_registry import CompiledPrompt, PromptParams, publish_invalidation
+from app.s3_service import get_metrics as get_s3_metrics
+from app import token_budget
 from pydantic import BaseModel
+from typing import Optional
 import hashlib
-from datetime import datetime, timedelta
+import base64
+from datetime import date, datetime, timedelta
 import os
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
@@ -15,12 +22,12 @@ class LoginRequest(BaseModel):
     password: str
 
 @router.post("/login")
-async def login(data: LoginRequest, db: Session = Depends(get_db)):
+async def login(data: LoginRequest, db: AsyncSession = Depends(get_db)):
     hashed = hashlib.sha256(data.password.encode()).hexdigest()
-    admin = db.query(AdminUser).filter(
+    admin = (await db.execute(select(AdminUser).where(
         AdminUser.email == data.email,
         AdminUser.password_hash == hashed
-    ).first()
+    ))).scalars().first()
     
     if not admin:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -29,23 +36,35 @@ async def login(data: LoginRequest, db: Session = Depends(get_db)):
     return {"token": token, "email": admin.email}
 
 @router.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
-    total_jobs = db.query(func.count(Job.id)).scalar()
-    today_jobs = db.query(func.count(Job.id)).filter(
-        Job.created_at >= datetime.now().date()
-    ).scalar()
-    
-    success_jobs = db.query(func.count(Job.id)).filter(Job.status == 'done').scalar()
-    total_tokens = db.query(func.sum(LLMRequest.tokens_used)).scalar() or 0
+async def get_stats(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Статистика из дневных агрегатов daily_job_stats.
+    
+    Один запрос с GROUP BY ROLLUP отдаёт и строки по дням, и итог за период
+    (по умолчанию — за всё время). График строится за период или за последние 7 дней.
+    """
+    today = datetime.now().date()
+    
+    per_day = {}
+    total_jobs, success_jobs, total_tokens = 0, 0, 0
+    for day, jobs, done, tokens in (await db.execute(queries.stats_rollup(date_from, date_to))).all():
+        if day is None:
+            total_jobs, success_jobs, total_tokens = jobs or 0, done or 0, tokens or 0
+        else:
+            per_day[day] = jobs
+    
+    today_jobs = per_day.get(today, 0)
     cost = (total_tokens / 1_000_000) * 0.25
     
+    chart_end = date_to or today
+    chart_start = date_from or chart_end - timedelta(days=6)
     days = []
-    for i in range(6, -1, -1):
-        date = datetime.now().date() - timedelta(days=i)
-        count = db.query(func.count(Job.id)).filter(
-            func.date(Job.created_at) == date
-        ).scalar()
-        days.append({"date": str(date), "count": count})
+    for i in range((chart_end - chart_start).days + 1):
+        day = chart_start + timedelta(days=i)
+        days.append({"date": str(day), "count": per_day.get(day, 0)})
     
     return {
         "total_jobs": total_jobs,
@@ -55,36 +74,49 @@ async def get_stats(db: Session = Depends(get_db)):
         "chart_data": days
     }
 
+def _encode_cursor(created_at: datetime, job_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{job_id}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(job_id)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
 @router.get("/jobs")
-async def get_jobs(skip: int = 0, limit: int = 20, db: Session = Depends(get_db)):
-    jobs = db.query(Job).order_by(Job.created_at.desc()).offset(skip).limit(limit).all()
-    
-    result = []
-    for job in jobs:
-        from app.models import Form
-        form = db.query(Form).filter(Form.session_id == job.session_id).first()
-        
-        # Берём industry_products из новой анкеты, или idea_description из старой
-        idea_text = 'N/A'
-        if form:
-            idea_text = form.payload.get('industry_products', form.payload.get('idea_description', 'N/A'))[:100]
-        
-        result.append({
-            "id": job.id,
-            "created_at": job.created_at.isoformat(),
-            "status": job.status,
-            "idea": idea_text
-        })
+async def get_jobs(
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    status: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Список анализов: один запрос, keyset-пагинация по (created_at, id).
+    
+    Для следующей страницы передайте next_cursor из предыдущего ответа.
+    """
+    limit = max(1, min(limit, 100))
+    after = _decode_cursor(cursor) if cursor else None
+    
+    rows = (await db.execute(queries.jobs_page(status, date_from, date_to, after, limit))).all()
     
-    return result
+    items = [{
+        "id": job_id,
+        "created_at": created_at.isoformat(),
+        "status": job_status,
+        "idea": idea_text
+    } for job_id, created_at, job_status, idea_text in rows]
+    
+    next_cursor = _encode_cursor(rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
 
 @router.get("/prompts")
-async def get_prompts(db: Session = Depends(get_db)):
+async def get_prompts(db: AsyncSession = Depends(get_db)):
     # Показываем только новые треки
     new_tracks = ['track1_market_analysis', 'track2_growth_strategy', 'track3_risks_analysis']
-    prompts = db.query(Prompt).filter(
-        Prompt.track_name.in_(new_tracks)
-    ).order_by(Prompt.track_name, Prompt.version.desc()).all()
+    prompts = (await db.execute(queries.prompt_versions(new_tracks))).scalars().all()
     
     grouped = {}
     for p in prompts:
@@ -95,67 +127,132 @@ async def get_prompts(db: Session = Depends(get_db)):
             "version": p.version,
             "is_active": p.is_active,
             "prompt_template": p.prompt_template,
+            "params": p.params,
             "updated_at": p.updated_at.isoformat()
         })
     
     return grouped
 
+# Сколько постоянного текста после полей анкеты допускаем без предупреждения
+PROMPT_CACHE_WARN_CHARS = 1000
+
 class PromptUpdate(BaseModel):
     prompt_template: str
+    # Не передан — новая версия наследует параметры предыдущей
+    params: Optional[PromptParams] = None
 
 @router.post("/prompts/{prompt_id}/update")
-async def update_prompt(prompt_id: int, data: PromptUpdate, db: Session = Depends(get_db)):
-    old = db.query(Prompt).filter(Prompt.id == prompt_id).first()
+async def update_prompt(prompt_id: int, data: PromptUpdate, db: AsyncSession = Depends(get_db)):
+    old = await db.get(Prompt, prompt_id)
     if not old:
         raise HTTPException(404, "Prompt not found")
     
+    params = data.params.model_dump(exclude_none=True) if data.params is not None else old.params
+    
+    # Шаблон должен подставляться из полей анкеты, иначе треки упадут на каждом анализе
+    try:
+        compiled = CompiledPrompt(data.prompt_template, params=params)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    
+    warnings = []
+    if compiled.uncached_static_chars > PROMPT_CACHE_WARN_CHARS:
+        warnings.append(
+            f"После полей анкеты идёт {compiled.uncached_static_chars} символов постоянного текста: "
+            "кэш префиксов у провайдера его не покроет — перенесите поля в конец шаблона"
+        )
+    
     old.is_active = False
     
     new = Prompt(
         track_name=old.track_name,
         prompt_template=data.prompt_template,
-        params=old.params,
+        params=params,
         version=old.version + 1,
         updated_by="admin",
         is_active=True
     )
     db.add(new)
-    db.commit()
+    await db.commit()
+    
+    # Воркеры держат активные промпты в памяти — просим их перечитать
+    await run_in_threadpool(publish_invalidation, new.track_name)
     
-    return {"success": True, "new_version": new.version}
+    return {"success": True, "new_version": new.version, "warnings": warnings}
 
 @router.get("/llm-logs")
-async def get_llm_logs(limit: int = 50, db: Session = Depends(get_db)):
-    logs = db.query(LLMRequest).order_by(LLMRequest.created_at.desc()).limit(limit).all()
+async def get_llm_logs(limit: int = 50, db: AsyncSession = Depends(get_db)):
+    logs = (await db.execute(queries.llm_logs(limit))).scalars().all()
     
     return [{
         "id": l.id,
         "track_id": l.track_id,
         "model": l.model,
         "tokens_used": l.tokens_used,
+        "prompt_tokens": l.prompt_tokens,
+        "completion_tokens": l.completion_tokens,
+        "cached_tokens": l.cached_tokens,
         "response_time_ms": l.response_time_ms,
         "status": l.status,
+        "cache_status": l.cache_status,
+        "queue_wait_ms": l.queue_wait_ms,
         "created_at": l.created_at.isoformat()
     } for l in logs]
 
+@router.get("/prompt-cache")
+async def get_prompt_cache(days: int = 7, db: AsyncSession = Depends(get_db)):
+    """Кэш префиксов у провайдера по версиям промптов: доля входных токенов, взятых из кэша.
+
+    Учитываются только ответы модели с usage (попадания в свой кэш LLM токенов не тратят).
+    """
+    since = datetime.now() - timedelta(days=days)
+    rows = (await db.execute(queries.prompt_cache_usage(since))).all()
+    
+    return [{
+        "track_name": track_name,
+        "version": version,
+        "is_active": is_active,
+        "requests": requests,
+        "prompt_tokens": prompt_tokens or 0,
+        "cached_tokens": cached_tokens or 0,
+        "completion_tokens": completion_tokens or 0,
+        "cache_hit_ratio": round((cached_tokens or 0) / prompt_tokens, 3) if prompt_tokens else 0,
+        "avg_first_token_ms": round(avg_first_token_ms) if avg_first_token_ms is not None else None
+    } for track_name, version, is_active, requests, prompt_tokens, cached_tokens, completion_tokens, avg_first_token_ms in rows]
+
+@router.get("/token-budgets")
+async def get_token_budgets(db: AsyncSession = Depends(get_db)):
+    """Текущие лимиты ответа по активным промптам: бюджет, потолок и статистика, из которой он посчитан"""
+    prompts = (await db.execute(
+        select(Prompt).where(Prompt.is_active == True).order_by(Prompt.track_name)
+    )).scalars().all()
+    
+    budgets = []
+    for p in prompts:
+        ceiling = (p.params or {}).get("max_tokens")
+        budget = await run_in_threadpool(token_budget.compute, p.id, p.track_name, ceiling)
+        budgets.append({"track_name": p.track_name, "version": p.version, "prompt_id": p.id, **budget})
+    
+    return {"enabled": token_budget.TOKEN_BUDGET_ENABLED, "budgets": budgets}
+
 @router.get("/settings")
-async def get_settings(db: Session = Depends(get_db)):
-    settings = db.query(Setting).all()
+async def get_settings(db: AsyncSession = Depends(get_db)):
+    settings = (await db.execute(select(Setting))).scalars().all()
     return {s.key: s.value for s in settings}
 
 class SettingUpdate(BaseModel):
     settings: dict
 
 @router.post("/settings/update")
-async def update_settings(data: SettingUpdate, db: Session = Depends(get_db)):
+async def update_settings(data: SettingUpdate, db: AsyncSession = Depends(get_db)):
     for key, value in data.settings.items():
-        setting = db.query(Setting).filter(Setting.key == key).first()
+        setting = (await db.execute(select(Setting).where(Setting.key == key))).scalars().first()
         if setting:
             setting.value = value
         else:
             db.add(Setting(key=key, value=value))
     
-    db.commit()
+    await db.commit()
     
     env_path = '/app/.env'
     with open(env_path, 'r') as f:
@@ -186,14 +283,20 @@ async def update_settings(data: SettingUpdate, db: Session = Depends(get_db)):
     
     return {"success": True, "message": "Настройки сохранены"}
 
+@router.get("/s3-metrics")
+async def s3_metrics():
+    """Успешные/неудачные загрузки в S3, ретраи и откаты на локальный диск"""
+    return await run_in_threadpool(get_s3_metrics)
+
 @router.post("/restart-worker")
 async def restart_worker():
     try:
         # Используем Docker socket
         import docker
         client = docker.from_env()
-        container = client.containers.get('bizeval_worker')
-        container.restart()
+        # Настройки LLM и S3 читают все воркеры
+        for name in ('bizeval_worker', 'bizeval_worker_llm', 'bizeval_worker_batch'):
+            client.containers.get(name).restart()
         return {"success": True, "message": "Worker перезапущен успешно"}
     except Exception as e:
         return {"success": False, "message": f"Ошибка: {str(e)}"}
\ No newline at end of file
@@ -0,0 +1,138 @@
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
+from app.database import get_db
+from app.models import Batch, Job, Form, Session as DBSession
+from app import queries
+from app.routers.forms import FormData
+from app.batch_llm import BATCH_BACKEND, BACKENDS, TRACK_NAMES
+import os
+import io
+import csv
+import json
+import uuid
+
+router = APIRouter(prefix="/api/batch", tags=["batches"])
+
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "1000"))
+
+def _parse_rows(filename: str, data: bytes) -> list:
+    """Строки анкет из CSV (заголовок — поля FormData) или NDJSON (объект на строку)"""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        # Номер строки — по числу переводов строки до первого неверного байта; в CSV первая строка — заголовок
+        number = data[:e.start].count(b"\n") + 1
+        if filename.lower().endswith(".csv"):
+            number -= 1
+        raise HTTPException(status_code=422, detail=[{"row": number, "errors": "File is not valid UTF-8"}])
+    if filename.lower().endswith(".csv"):
+        return list(csv.DictReader(io.StringIO(text)))
+    rows = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=422, detail=[{"row": number, "errors": f"Invalid JSON: {e}"}])
+        if not isinstance(row, dict):
+            raise HTTPException(status_code=422, detail=[{"row": number, "errors": "Expected a JSON object"}])
+        rows.append(row)
+    return rows
+
+@router.post("")
+async def create_batch(
+    file: UploadFile = File(...),
+    backend: str = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Пакетная оценка: CSV или NDJSON с анкетами, все анализы создаются одной транзакцией.
+
+    Треки считаются через Batch API (backend=openai) или локальную заглушку (backend=local).
+    """
+    backend = backend or BATCH_BACKEND
+    if backend not in BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown backend: {backend}")
+
+    rows = _parse_rows(file.filename or "", await file.read())
+    if not rows:
+        raise HTTPException(status_code=422, detail="No rows in file")
+    if len(rows) > BATCH_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Too many rows: {len(rows)} > {BATCH_MAX_ROWS}")
+
+    forms, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        try:
+            # Пустые ячейки CSV — незаполненные необязательные поля
+            forms.append(FormData(**{k: v for k, v in row.items() if v not in ("", None)}))
+        except (ValidationError, TypeError) as e:
+            errors.append({"row": number, "errors": e.errors() if isinstance(e, ValidationError) else str(e)})
+    if errors:
+        raise HTTPException(status_code=422, detail=errors[:50])
+
+    batch = Batch(status="pending", total=len(forms), backend=backend, provider_batches=[])
+    db.add(batch)
+    await db.flush()
+
+    # Анкете нужна своя сессия: отчет ищет форму по session_id анализа
+    sessions = [DBSession(status="batch", ws_token=str(uuid.uuid4())) for _ in forms]
+    db.add_all(sessions)
+    await db.flush()
+
+    db.add_all([Form(session_id=s.id, payload=f.model_dump()) for s, f in zip(sessions, forms)])
+    db.add_all([Job(session_id=s.id, status="pending", batch_id=batch.id) for s in sessions])
+    await db.commit()
+
+    from app.tasks import start_batch
+    start_batch.delay(batch.id)
+
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": batch.total,
+        "backend": backend
+    }
+
+@router.get("/{batch_id}")
+async def get_batch(batch_id: int, db: AsyncSession = Depends(get_db)):
+    """Прогресс пакета: анализы и треки по статусам"""
+    batch = await db.get(Batch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    jobs = dict((await db.execute(queries.batch_job_counts(batch_id))).all())
+    tracks = dict((await db.execute(queries.batch_track_counts(batch_id))).all())
+
+    total_tracks = batch.total * len(TRACK_NAMES)
+    tracks_done = tracks.get("completed", 0) + tracks.get("failed", 0)
+    jobs_done = sum(n for status, n in jobs.items() if status not in ("pending", "running"))
+
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "backend": batch.backend,
+        "total": batch.total,
+        "jobs": jobs,
+        "tracks": tracks,
+        "progress": {
+            "tracks": round(tracks_done / total_tracks, 3) if total_tracks else 0,
+            "jobs": round(jobs_done / batch.total, 3) if batch.total else 0
+        },
+        "provider_batches": batch.provider_batches,
+        "created_at": batch.created_at,
+        "finished_at": batch.finished_at
+    }
+
+@router.get("/{batch_id}/jobs")
+async def get_batch_jobs(batch_id: int, db: AsyncSession = Depends(get_db)):
+    """Анализы пакета: отчеты забираются по /api/report/{job_id}"""
+    batch = await db.get(Batch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    rows = (await db.execute(queries.batch_jobs(batch_id))).all()
+    return {
+        "batch_id": batch_id,
+        "jobs": [{"job_id": job_id, "status": status} for job_id, status in rows]
+    }
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import Form, Session as DBSession, Job
 from pydantic import BaseModel
@@ -79,11 +79,15 @@ async def get_form_structure():
 async def submit_form(
     session_id: int,
     form_data: FormData,
-    db: Session = Depends(get_db)
+    no_cache: bool = False,
+    db: AsyncSession = Depends(get_db)
 ):
-    """Отправка формы и запуск анализа через Celery"""
+    """Отправка формы и запуск анализа через Celery.
+    
+    no_cache=true заставляет заново вызвать LLM, даже если такой анализ уже есть в кэше.
+    """
     # Проверяем существование сессии
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
+    session = await db.get(DBSession, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -93,8 +97,8 @@ async def submit_form(
         payload=form_data.dict()
     )
     db.add(new_form)
-    db.commit()
-    db.refresh(new_form)
+    await db.commit()
+    await db.refresh(new_form)
     
     # Создаем задание (job)
     new_job = Job(
@@ -102,12 +106,12 @@ async def submit_form(
         status="pending"
     )
     db.add(new_job)
-    db.commit()
-    db.refresh(new_job)
+    await db.commit()
+    await db.refresh(new_job)
     
     # Запускаем Celery задачу с правильными параметрами
     from app.tasks import run_full_analysis
-    task = run_full_analysis.delay(new_job.id, session_id, form_data.dict())
+    task = run_full_analysis.delay(new_job.id, session_id, form_data.dict(), use_cache=not no_cache)
     
     return {
         "job_id": new_job.id,
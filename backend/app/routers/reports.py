@@ -1,60 +1,120 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse, RedirectResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import RedirectResponse, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import Report, Job
-import os
+from app.report_store import SECTIONS, pack_sections, section_text, section_manifest
+from app import queries
+from app import report_cache
+from app.file_delivery import etag_matches, file_response
+from app.s3_service import presigned_url
 
 router = APIRouter(prefix="/api/report", tags=["reports"])
 
 @router.get("/{job_id}")
-async def get_report(job_id: int, db: Session = Depends(get_db)):
-    job = db.query(Job).filter(Job.id == job_id).first()
+async def get_report(job_id: int, db: AsyncSession = Depends(get_db)):
+    # Готовый ответ из кэша: отчет — до перегенерации, статус — пока идёт анализ
+    cached = await report_cache.get(job_id)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+    
+    job = await db.get(Job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    report = db.query(Report).filter(Report.job_id == job_id).first()
+    report = (await db.execute(select(Report).where(Report.job_id == job_id))).scalars().first()
     
     if not report:
         if job.status in ["pending", "running"]:
-            return {"job_id": job_id, "status": job.status, "message": "В процессе"}
+            raw = await report_cache.put_status(job_id, report_cache.status_body(job_id, job.status))
+            return Response(raw, media_type="application/json")
         raise HTTPException(status_code=404, detail="Report not found")
     
-    return {
+    body = {
         "job_id": job_id,
         "status": job.status,
         "report": report.report_json,
+        "sections": await _load_manifest(db, report),
         "files": {
             "pdf": f"/api/report/{job_id}/download/pdf",
             "docx": f"/api/report/{job_id}/download/docx"
         }
     }
+    # Отчет уже записан, но finalize ещё не отметил job — такой ответ не кэшируем
+    if job.status != "done":
+        return body
+    raw = await report_cache.put_report(job_id, body)
+    return Response(raw, media_type="application/json")
 
-@router.get("/{job_id}/download/{file_type}")
-async def download_file(job_id: int, file_type: str, db: Session = Depends(get_db)):
-    report = db.query(Report).filter(Report.job_id == job_id).first()
+async def _load_sections(db: AsyncSession, report: Report, name: str = None) -> list:
+    """Сжатые разделы отчета; для отчетов до появления report_sections — собранные из report_json"""
+    sections = (await db.execute(queries.report_sections(report.job_id, name))).scalars().all()
+    if sections:
+        return sections
+    return [s for s in pack_sections(report.job_id, report.report_json) if not name or s.name == name]
+
+async def _load_manifest(db: AsyncSession, report: Report) -> dict:
+    """Манифест разделов без их содержимого; для отчетов до появления report_sections — по report_json"""
+    rows = (await db.execute(queries.section_manifest_rows(report.job_id))).all()
+    return section_manifest(rows or pack_sections(report.job_id, report.report_json))
+
+@router.get("/{job_id}/sections/{name}")
+async def get_report_section(job_id: int, name: str, request: Request, db: AsyncSession = Depends(get_db)):
+    """Текст одного раздела отчета (markdown).
+
+    Клиент перепроверяет раздел по ETag и получает 304, пока тот не изменился;
+    сжатый раздел отдаётся как есть, если клиент принимает gzip.
+    """
+    if name not in SECTIONS:
+        raise HTTPException(status_code=404, detail="Unknown section")
+    
+    report = (await db.execute(select(Report).where(Report.job_id == job_id))).scalars().first()
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
     
-    # Если URL начинается с https - редирект на S3
-    if file_type == "pdf":
-        url = report.pdf_url
-        if url.startswith('https://'):
-            return RedirectResponse(url=url)
-        path = url
-        media = "application/pdf"
-        filename = f"bizeval_report_{job_id}.pdf"
-    elif file_type == "docx":
-        url = report.docx_url
-        if url.startswith('https://'):
-            return RedirectResponse(url=url)
-        path = url
-        media = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        filename = f"bizeval_report_{job_id}.docx"
-    else:
+    sections = await _load_sections(db, report, name)
+    if not sections:
+        raise HTTPException(status_code=404, detail="Section not found")
+    section = sections[0]
+    
+    etag = f'"{section.sha256}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(section.content, media_type="text/plain; charset=utf-8", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(section_text(section), media_type="text/plain; charset=utf-8", headers=headers)
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+@router.get("/{job_id}/download/{file_type}")
+async def download_file(job_id: int, file_type: str, request: Request, db: AsyncSession = Depends(get_db)):
+    if file_type not in MEDIA_TYPES:
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail="File not found")
+    # Где лежат файлы отчета — из кэша, в БД только при первом скачивании
+    files = await report_cache.get_files(job_id)
+    if files is None:
+        report = (await db.execute(select(Report).where(Report.job_id == job_id))).scalars().first()
+        if not report:
+            raise HTTPException(status_code=404, detail="Report not found")
+        files = {"pdf": report.pdf_url, "docx": report.docx_url}
+        await report_cache.put_files(job_id, files)
+    
+    url = files[file_type]
+    filename = f"bizeval_report_{job_id}.{file_type}"
+    
+    # Приватный бакет — подписанная ссылка, публичный — редирект как есть
+    if url.startswith('s3://'):
+        return RedirectResponse(url=presigned_url(url, filename))
+    if url.startswith('https://'):
+        return RedirectResponse(url=url)
     
-    return FileResponse(path, media_type=media, filename=filename)
+    # S3 был недоступен, файл остался на диске
+    return file_response(request, url, MEDIA_TYPES[file_type], filename)
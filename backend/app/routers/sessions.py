@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import Session as DBSession
 from pydantic import BaseModel
@@ -14,7 +14,7 @@ class SessionResponse(BaseModel):
     status: str
 
 @router.post("/start", response_model=SessionResponse)
-async def start_session(db: Session = Depends(get_db)):
+async def start_session(db: AsyncSession = Depends(get_db)):
     """Создает новую сессию и возвращает ws_token"""
     ws_token = str(uuid.uuid4())
     
@@ -25,8 +25,8 @@ async def start_session(db: Session = Depends(get_db)):
     )
     
     db.add(new_session)
-    db.commit()
-    db.refresh(new_session)
+    await db.commit()
+    await db.refresh(new_session)
     
     return SessionResponse(
         session_id=new_session.id,
@@ -35,9 +35,9 @@ async def start_session(db: Session = Depends(get_db)):
     )
 
 @router.get("/{session_id}/status")
-async def get_session_status(session_id: int, db: Session = Depends(get_db)):
+async def get_session_status(session_id: int, db: AsyncSession = Depends(get_db)):
     """Получить статус сессии"""
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
+    session = await db.get(DBSession, session_id)
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -1,32 +1,186 @@
+import io
 import os
+import gzip
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+import redis
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
-import logging
+from app.local_cache import LRUCache
+from app import metrics
 
 logger = logging.getLogger(__name__)
 
+redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379/0"), decode_responses=True)
+
+# Для локальной проверки достаточно указать S3_ENDPOINT на MinIO/moto server
+S3_REGION = os.getenv('S3_REGION', 'ru-central1')
+S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL', 'https://{bucket}.storage.yandexcloud.net/{key}')
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '20'))
+# Единственный уровень повторов — botocore (adaptive: с backoff и ограничением темпа при троттлинге).
+# Повторяется отдельный запрос, а не весь файл: у multipart — только упавшая часть.
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '5'))
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', '5'))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '60'))
+S3_UPLOAD_WORKERS = int(os.getenv('S3_UPLOAD_WORKERS', '4'))
+# Приватный бакет: в БД пишем s3://bucket/key, а /download редиректит на подписанную ссылку
+S3_PRESIGN_URLS = os.getenv('S3_PRESIGN_URLS', 'false').lower() == 'true'
+S3_PRESIGN_EXPIRES = int(os.getenv('S3_PRESIGN_EXPIRES_SECONDS', '3600'))
+
+MB = 1024 * 1024
+
+# Файлы больше порога уходят multipart-загрузкой, части грузятся параллельно
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(os.getenv('S3_MULTIPART_THRESHOLD_MB', '8')) * MB,
+    multipart_chunksize=int(os.getenv('S3_MULTIPART_CHUNK_MB', '8')) * MB,
+    max_concurrency=int(os.getenv('S3_MULTIPART_CONCURRENCY', '4')),
+)
+
+METRICS_KEY = 's3:metrics'
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Подписанная ссылка переиспользуется, пока до её истечения остаётся больше трети срока
+_presigned = LRUCache(max_items=1024, ttl=S3_PRESIGN_EXPIRES * 2 / 3)
+
+_metrics = {"uploads_ok": 0, "uploads_failed": 0, "retries": 0, "fallback_local": 0, "bytes_uploaded": 0, "upload_ms_total": 0}
+_metrics_lock = threading.Lock()
+
 def get_s3_client():
-    config = Config(signature_version='s3v4')
-    return boto3.client(
-        's3',
-        endpoint_url=os.getenv('S3_ENDPOINT'),
-        aws_access_key_id=os.getenv('S3_ACCESS_KEY'),
-        aws_secret_access_key=os.getenv('S3_SECRET_KEY'),
-        region_name='ru-central1',
-        config=config
-    )
-
-def upload_to_s3(file_path: str, object_name: str):
+    """Один клиент на процесс: креды, endpoint и пул соединений настраиваются один раз"""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            config = Config(
+                signature_version='s3v4',
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                connect_timeout=S3_CONNECT_TIMEOUT,
+                read_timeout=S3_READ_TIMEOUT,
+                # max_attempts у botocore — число повторов, total_max_attempts — всех попыток
+                retries={'total_max_attempts': S3_MAX_ATTEMPTS, 'mode': 'adaptive'}
+            )
+            _client = boto3.client(
+                's3',
+                endpoint_url=os.getenv('S3_ENDPOINT'),
+                aws_access_key_id=os.getenv('S3_ACCESS_KEY'),
+                aws_secret_access_key=os.getenv('S3_SECRET_KEY'),
+                region_name=S3_REGION,
+                config=config
+            )
+            _client.meta.events.register('request-created.s3', _count_retry)
+            _client_pid = os.getpid()
+    return _client
+
+def _count_retry(request, **kwargs):
+    # botocore создаёт запрос заново на каждую попытку; номер попытки — в контексте
+    if request.context.get('retries', {}).get('attempt', 1) > 1:
+        _record(retries=1)
+
+def _record(**counters):
+    """Счётчики процесса + общий хэш в Redis (для админки)"""
+    with _metrics_lock:
+        for name, value in counters.items():
+            _metrics[name] += value
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for name, value in counters.items():
+            pipe.hincrby(METRICS_KEY, name, value)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"S3 metrics write failed: {e}")
+
+def get_metrics() -> dict:
+    """Метрики загрузок: текущего процесса и суммарные по всем воркерам"""
+    with _metrics_lock:
+        local = dict(_metrics)
     try:
-        s3 = get_s3_client()
-        bucket = os.getenv('S3_BUCKET')
-        
-        with open(file_path, 'rb') as f:
-            s3.put_object(Bucket=bucket, Key=object_name, Body=f)
-        
-        url = f"https://{bucket}.storage.yandexcloud.net/{object_name}"
-        logger.info(f"S3 OK: {url}")
+        total = {k: int(v) for k, v in redis_client.hgetall(METRICS_KEY).items()}
+    except Exception as e:
+        logger.warning(f"S3 metrics read failed: {e}")
+        total = None
+    return {"process": local, "total": total}
+
+REPORTS_DIR = os.getenv('REPORTS_DIR', '/app/reports')
+
+def save_local(data: bytes, object_name: str) -> str:
+    """Запасной вариант: кладём файл на локальный диск, его отдаст /download"""
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = os.path.join(REPORTS_DIR, os.path.basename(object_name))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    # Сжатая копия рядом — её отдаст /download, если она заметно меньше (DOCX уже zip)
+    packed = gzip.compress(data, compresslevel=6)
+    if len(packed) < len(data) * 0.9:
+        with open(path + '.gz', 'wb') as f:
+            f.write(packed)
+    elif os.path.exists(path + '.gz'):
+        os.remove(path + '.gz')
+    return path
+
+def public_url(object_name: str) -> str:
+    if S3_PRESIGN_URLS:
+        return f"s3://{os.getenv('S3_BUCKET')}/{object_name}"
+    return S3_PUBLIC_URL.format(bucket=os.getenv('S3_BUCKET'), key=object_name)
+
+def presigned_url(url: str, filename: str = None) -> str:
+    """Подписанная ссылка на объект s3://bucket/key; подпись кэшируется на часть срока жизни"""
+    cache_key = (url, filename)
+    cached = _presigned.get(cache_key)
+    if cached is not None:
+        return cached
+
+    bucket, key = url[len('s3://'):].split('/', 1)
+    params = {'Bucket': bucket, 'Key': key}
+    if filename:
+        params['ResponseContentDisposition'] = f'attachment; filename="{filename}"'
+    signed = get_s3_client().generate_presigned_url('get_object', Params=params, ExpiresIn=S3_PRESIGN_EXPIRES)
+    _presigned.set(cache_key, signed, size=len(signed))
+    return signed
+
+def _put(data, object_name: str):
+    """upload_fileobj; повторы отдельных запросов делает botocore, см. S3_MAX_ATTEMPTS"""
+    with (io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else open(data, 'rb')) as fileobj:
+        get_s3_client().upload_fileobj(fileobj, os.getenv('S3_BUCKET'), object_name, Config=TRANSFER_CONFIG)
+
+def upload_to_s3(data, object_name: str):
+    """data — путь к файлу, bytes или BytesIO. При ошибке возвращает локальный путь"""
+    if hasattr(data, 'read'):
+        data = data.getvalue() if hasattr(data, 'getvalue') else data.read()
+
+    start = time.time()
+    try:
+        size = len(data) if isinstance(data, (bytes, bytearray)) else os.path.getsize(data)
+        _put(data, object_name)
+
+        elapsed_ms = int((time.time() - start) * 1000)
+        _record(uploads_ok=1, bytes_uploaded=size, upload_ms_total=elapsed_ms)
+        metrics.S3_UPLOAD_SECONDS.labels("ok").observe(elapsed_ms / 1000)
+        url = public_url(object_name)
+        logger.info(f"S3 OK: {url} ({size} bytes, {elapsed_ms} ms)")
         return url
     except Exception as e:
-        logger.error(f"S3 fail: {e}")
-        return file_path
+        logger.error(f"S3 fail: {object_name}: {e}")
+        _record(uploads_failed=1)
+        metrics.S3_UPLOAD_SECONDS.labels("failed").observe(time.time() - start)
+        if isinstance(data, (bytes, bytearray)):
+            _record(fallback_local=1)
+            return save_local(data, object_name)
+        return data
+
+def upload_many(items: dict) -> dict:
+    """Параллельная загрузка {object_name: data} -> {object_name: url}"""
+    if len(items) <= 1:
+        return {name: upload_to_s3(data, name) for name, data in items.items()}
+
+    with ThreadPoolExecutor(max_workers=min(len(items), S3_UPLOAD_WORKERS), thread_name_prefix="s3-upload") as pool:
+        futures = {name: pool.submit(upload_to_s3, data, name) for name, data in items.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.models import DailyJobStat
+from app.queries import jobs_by_day, llm_requests_by_day
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _empty_day() -> dict:
+    return {"jobs_total": 0, "jobs_done": 0, "jobs_failed": 0, "jobs_partial": 0, "llm_requests": 0, "tokens_used": 0}
+
+def rebuild_daily_stats(db: Session, days: int = 2, since: date = None):
+    """Пересчитывает дневные агрегаты за последние days дней (или начиная с дня since).
+    
+    Пересчёт идемпотентный: строки за окно перезаписываются целиком,
+    поэтому задачу можно безопасно запускать по расписанию сколь угодно часто.
+    """
+    # «Сегодня» — по часам и часовому поясу базы: по ним же func.date() делит анкеты на дни
+    today = db.execute(select(func.current_date())).scalar()
+    if since is None:
+        since = today - timedelta(days=days - 1)
+    days = (today - since).days + 1
+    
+    job_rows = db.execute(jobs_by_day(since)).all()
+    llm_rows = db.execute(llm_requests_by_day(since)).all()
+    
+    # Дни без активности тоже пишем, чтобы обнулить устаревшие значения
+    stats = {since + timedelta(days=i): _empty_day() for i in range(days)}
+    for day, total, done, failed, partial in job_rows:
+        stats.setdefault(day, _empty_day()).update(
+            jobs_total=total, jobs_done=done, jobs_failed=failed, jobs_partial=partial
+        )
+    for day, requests, tokens in llm_rows:
+        stats.setdefault(day, _empty_day()).update(llm_requests=requests, tokens_used=tokens)
+    
+    rows = [{"day": day, **values} for day, values in stats.items()]
+    stmt = insert(DailyJobStat).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyJobStat.day],
+        set_={
+            "jobs_total": stmt.excluded.jobs_total,
+            "jobs_done": stmt.excluded.jobs_done,
+            "jobs_failed": stmt.excluded.jobs_failed,
+            "jobs_partial": stmt.excluded.jobs_partial,
+            "llm_requests": stmt.excluded.llm_requests,
+            "tokens_used": stmt.excluded.tokens_used,
+            "updated_at": func.now()
+        }
+    )
+    db.execute(stmt)
+    db.commit()
+    
+    logger.info(f"Daily stats refreshed since {since}: {len(rows)} days")
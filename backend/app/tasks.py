@@ -1,29 +1,77 @@
 from celery import chord
 from celery_app import celery_app
 from app.database import SessionLocal
-from app.models import Job, Track, LLMRequest, Prompt
-from app.llm_service import call_llm
-from app.consolidation import consolidate_and_swot
+from app.models import Job, Track, Batch
+from app.llm_policy import call_llm_with_policy
+from app.llm_service import DEFAULT_MAX_TOKENS
+from app.consolidation import consolidate_and_swot, digest_track_output
+from app.stats import rebuild_daily_stats
+from app.prompt_registry import get_prompt
+from app.report_store import section_manifest
+from app import queries
+from app import report_cache, metrics, batch_llm, token_budget
 import logging
 import redis
+from redis.exceptions import LockError
 import json
+import os
+import time
+from datetime import date, datetime, timezone
 
 logger = logging.getLogger(__name__)
 redis_client = redis.Redis(host='redis', port=6379, decode_responses=True)
 
-def publish_status(session_id: int, status: str, message: str, data: dict = None):
-    """Публикуем статус в Redis для WebSocket"""
+# События прогресса сессии хранятся в ограниченном Redis Stream, чтобы
+# переподключившийся WebSocket мог дочитать пропущенное
+EVENTS_MAXLEN = int(os.getenv("SESSION_EVENTS_MAXLEN", "200"))
+EVENTS_TTL = int(os.getenv("SESSION_EVENTS_TTL_SECONDS", str(24 * 3600)))
+EVENTS_FINISHED_TTL = int(os.getenv("SESSION_EVENTS_FINISHED_TTL_SECONDS", "3600"))
+TERMINAL_EVENTS = {"analysis_completed", "analysis_failed", "analysis_partial"}
+# Опрос и отправка пакетов не должны идти параллельно из двух воркеров:
+# оба выбрали бы одни и те же queued-треки и отправили их провайдеру дважды
+BATCH_POLL_LOCK = "batch:poll"
+BATCH_POLL_LOCK_SECONDS = int(os.getenv("BATCH_POLL_LOCK_SECONDS", "600"))
+
+def publish_status(session_id: int, status: str, message: str, data: dict = None, job_id: int = None):
+    """Записываем статус в stream сессии и публикуем в Redis для WebSocket.
+
+    С job_id заодно обновляем закэшированный статус для GET /api/report.
+    """
     payload = {
         "type": status,
         "message": message,
         "data": data or {}
     }
+    event = json.dumps(payload)
+    stream = f"session:{session_id}:events"
+    
+    event_id = redis_client.xadd(stream, {"event": event}, maxlen=EVENTS_MAXLEN, approximate=True)
+    pipe = redis_client.pipeline(transaction=False)
+    # Завершённые сессии держим недолго — только чтобы успел переподключиться клиент
+    pipe.expire(stream, EVENTS_FINISHED_TTL if status in TERMINAL_EVENTS else EVENTS_TTL)
+    pipe.publish(f"session:{session_id}", json.dumps({"id": event_id, **payload}))
+    pipe.execute()
+    logger.info(f"Published to session:{session_id} ({event_id}): {message}")
+    
+    if job_id is not None:
+        if status in TERMINAL_EVENTS:
+            report_cache.drop_status(job_id)
+        else:
+            report_cache.set_status(job_id)
+
+def publish_delta(session_id: int, track_name: str, delta: str):
+    """Публикуем фрагмент ответа трека (без логирования и без записи в stream — событий много)"""
+    payload = {
+        "type": "track_delta",
+        "message": "",
+        "data": {"track": track_name, "delta": delta}
+    }
     redis_client.publish(f"session:{session_id}", json.dumps(payload))
-    logger.info(f"Published to session:{session_id}: {message}")
 
 @celery_app.task(bind=True)
-def analyze_track(self, job_id: int, session_id: int, track_name: str, form_data: dict):
+def analyze_track(self, job_id: int, session_id: int, track_name: str, form_data: dict, use_cache: bool = True):
     db = SessionLocal()
+    start_time = time.time()
     
     # Русские названия треков
     track_labels = {
@@ -33,13 +81,10 @@ def analyze_track(self, job_id: int, session_id: int, track_name: str, form_data
     }
     
     try:
-        publish_status(session_id, "track_started", f"📄 {track_labels.get(track_name, track_name)}...")
+        publish_status(session_id, "track_started", f"📄 {track_labels.get(track_name, track_name)}...", job_id=job_id)
         
-        # Получаем активный промпт
-        prompt_obj = db.query(Prompt).filter(
-            Prompt.track_name == track_name,
-            Prompt.is_active == True
-        ).first()
+        # Активный промпт берём из реестра в памяти воркера
+        prompt_obj = get_prompt(track_name)
         
         if not prompt_obj:
             raise Exception(f"No active prompt for {track_name}")
@@ -48,63 +93,143 @@ def analyze_track(self, job_id: int, session_id: int, track_name: str, form_data
         track = Track(
             job_id=job_id,
             track_name=track_name,
-            status="running"
+            status="running",
+            started_at=datetime.now(timezone.utc)
         )
         db.add(track)
         db.commit()
         db.refresh(track)
+        track_id = track.id
+        # Закрываем транзакцию, чтобы не держать соединение из пула всё время ожидания LLM
+        db.commit()
         
-        # Вызываем LLM
-        result = call_llm(
-            prompt=prompt_obj.prompt_template,
-            form_data=form_data,
-            track_id=track.id,
-            db=db
-        )
+        # Модель, лимит токенов, temperature, таймаут и стриминг задаются в параметрах версии промпта
+        params = dict(prompt_obj.params)
+        stream = params.pop("stream", os.getenv("LLM_STREAMING", "true").lower() == "true")
+        # max_tokens из параметров — потолок; сам лимит подбирается по длине прошлых ответов трека
+        ceiling = params.get("max_tokens", DEFAULT_MAX_TOKENS)
+        params["max_tokens"] = token_budget.max_tokens_for(prompt_obj)
+        
+        prompt = prompt_obj.render(form_data)
+        on_retry = lambda attempt, model: publish_status(session_id, "track_retry", f"🔁 {track_labels.get(track_name, track_name)}: повторная попытка", {"track": track_name, "attempt": attempt}, job_id=job_id)
+        
+        def run():
+            # Вызываем LLM (с повторами и запасными моделями), по мере генерации отдаём текст в WebSocket
+            return call_llm_with_policy(
+                prompt=prompt,
+                track_id=track_id,
+                stream=stream,
+                on_delta=lambda delta: publish_delta(session_id, track_name, delta),
+                on_retry=on_retry,
+                use_cache=use_cache,
+                prompt_id=prompt_obj.id,
+                **params
+            )
+        
+        result = run()
+        # Ответ обрезан урезанным бюджетом: повторяем с полным лимитом, бюджет пересчитается по истории
+        if result["status"] == "success" and result.get("finish_reason") == "length" and params["max_tokens"] < ceiling:
+            logger.warning(f"Track {track_name} truncated at {params['max_tokens']} tokens, retrying with {ceiling}")
+            token_budget.invalidate(prompt_obj.id)
+            on_retry(result.get("attempts", 1) + 1, result.get("model"))
+            params["max_tokens"] = ceiling
+            result = run()
+        
+        track.finished_at = datetime.now(timezone.utc)
+        metrics.STAGE_SECONDS.labels("track").observe(time.time() - start_time)
         
-        if result:
+        if result["status"] == "success":
             track.status = "completed"
             track.raw_output = result
             db.commit()
             
-            publish_status(session_id, "track_completed", f"✅ {track_labels.get(track_name, track_name)} завершен", {"track": track_name})
-            return {"success": True, "track_name": track_name}
+            publish_status(session_id, "track_completed", f"✅ {track_labels.get(track_name, track_name)} завершен", {"track": track_name}, job_id=job_id)
+            return {
+                "success": True,
+                "track_name": track_name,
+                "track_id": track_id,
+                "elapsed_ms": int((time.time() - start_time) * 1000)
+            }
         else:
             track.status = "failed"
+            track.raw_output = result
             db.commit()
-            publish_status(session_id, "track_failed", f"❌ {track_labels.get(track_name, track_name)} ошибка")
-            return {"success": False, "track_name": track_name}
+            publish_status(session_id, "track_failed", f"❌ {track_labels.get(track_name, track_name)} ошибка", job_id=job_id)
+            return {"success": False, "track_name": track_name, "error": result.get("error")}
             
     except Exception as e:
         logger.error(f"Track {track_name} error: {e}")
-        publish_status(session_id, "track_failed", f"❌ {track_labels.get(track_name, track_name)} ошибка: {str(e)}")
+        publish_status(session_id, "track_failed", f"❌ {track_labels.get(track_name, track_name)} ошибка: {str(e)}", job_id=job_id)
         return {"success": False, "track_name": track_name, "error": str(e)}
     finally:
         db.close()
 
 @celery_app.task(bind=True)
-def finalize_analysis(self, results, job_id: int, session_id: int):
+def digest_track(self, track_result: dict, job_id: int, session_id: int, use_cache: bool = True):
+    """Сжимает готовый трек в дайджест, пока остальные треки ещё считаются"""
+    if not track_result.get('success'):
+        return track_result
+    
+    db = SessionLocal()
+    start_time = time.time()
+    try:
+        track = db.query(Track).filter(Track.id == track_result['track_id']).first()
+        result = digest_track_output(track, use_cache=use_cache)
+        digest_ms = int((time.time() - start_time) * 1000)
+        
+        if result["status"] != "success":
+            # Без дайджеста синтез просто возьмёт полный текст трека
+            logger.warning(f"Digest for {track.track_name} failed: {result.get('error')}")
+            return {**track_result, "digest_ms": digest_ms}
+        
+        return {**track_result, "digest": result["result"], "digest_ms": digest_ms}
+        
+    except Exception as e:
+        logger.error(f"Digest error for job {job_id}: {e}")
+        return track_result
+    finally:
+        db.close()
+
+@celery_app.task(bind=True)
+def finalize_analysis(self, results, job_id: int, session_id: int, started_at: float = None, use_cache: bool = True):
     """Финализация анализа"""
     db = SessionLocal()
     try:
-        publish_status(session_id, "consolidation_started", "📄 Формирую итоговое резюме...")
+        publish_status(session_id, "consolidation_started", "📄 Формирую итоговое резюме...", job_id=job_id)
         
         success_count = sum(1 for r in results if r.get('success'))
         logger.info(f"Finalize job {job_id}: {success_count}/3 tracks succeeded")
         
         if success_count >= 3:
-            report = consolidate_and_swot(job_id)
+            # Длительности этапов: треки и дайджесты идут параллельно, берём самый медленный
+            timings = {
+                "tracks_ms": max(r.get('elapsed_ms', 0) for r in results),
+                "digests_ms": max(r.get('digest_ms', 0) for r in results)
+            }
+            digests = {r['track_name']: r['digest'] for r in results if r.get('digest')}
+            
+            report = consolidate_and_swot(job_id, digests=digests, timings=timings, use_cache=use_cache)
+            
+            if started_at:
+                timings["total_ms"] = int((time.time() - started_at) * 1000)
+            logger.info(f"Job {job_id} stage timings: {timings}")
+            # tracks/digests здесь — самый медленный трек; по отдельным трекам есть stage="track"
+            for stage, ms in timings.items():
+                metrics.STAGE_SECONDS.labels(stage.removesuffix("_ms")).observe(ms / 1000)
             
             if report:
                 job = db.query(Job).filter(Job.id == job_id).first()
                 job.status = "done"
+                job.finished_at = datetime.now(timezone.utc)
                 db.commit()
                 
                 logger.info(f"Job {job_id} completed successfully")
+                # Сам отчет не шлём: только манифест разделов, тексты клиент заберёт по API
                 publish_status(session_id, "analysis_completed", "🎉 Анализ завершен!", {
                     "job_id": job_id,
-                    "report": report
-                })
+                    "sections": section_manifest(db.execute(queries.section_manifest_rows(job_id)).all()),
+                    "timings": timings
+                }, job_id=job_id)
                 
                 return {"job_id": job_id, "status": "done"}
             else:
@@ -112,37 +237,135 @@ def finalize_analysis(self, results, job_id: int, session_id: int):
                 job.status = "failed"
                 db.commit()
                 logger.error(f"Job {job_id} consolidation failed")
-                publish_status(session_id, "analysis_failed", "❌ Ошибка при создании отчета")
+                publish_status(session_id, "analysis_failed", "❌ Ошибка при создании отчета", job_id=job_id)
         else:
             job = db.query(Job).filter(Job.id == job_id).first()
             job.status = "partial"
             db.commit()
             logger.warning(f"Job {job_id} partially completed: {success_count}/3")
-            publish_status(session_id, "analysis_partial", f"⚠️ Завершено частично: {success_count}/3 треков")
+            publish_status(session_id, "analysis_partial", f"⚠️ Завершено частично: {success_count}/3 треков", job_id=job_id)
             
         return {"job_id": job_id}
         
     except Exception as e:
         logger.error(f"Finalize error for job {job_id}: {e}", exc_info=True)
-        publish_status(session_id, "analysis_failed", f"❌ Ошибка финализации: {str(e)}")
+        publish_status(session_id, "analysis_failed", f"❌ Ошибка финализации: {str(e)}", job_id=job_id)
         return {"job_id": job_id, "status": "failed", "error": str(e)}
     finally:
         db.close()
 
 @celery_app.task(bind=True)
-def run_full_analysis(self, job_id: int, session_id: int, form_data: dict):
+def run_full_analysis(self, job_id: int, session_id: int, form_data: dict, use_cache: bool = True):
     try:
-        publish_status(session_id, "analysis_started", "🚀 Запускаю параллельный анализ по 3 направлениям...")
+        started_at = time.time()
+        publish_status(session_id, "analysis_started", "🚀 Запускаю параллельный анализ по 3 направлениям...", job_id=job_id)
         
         track_tasks = [
-            analyze_track.s(job_id, session_id, 'track1_market_analysis', form_data),
-            analyze_track.s(job_id, session_id, 'track2_growth_strategy', form_data),
-            analyze_track.s(job_id, session_id, 'track3_risks_analysis', form_data)
+            analyze_track.s(job_id, session_id, 'track1_market_analysis', form_data, use_cache),
+            analyze_track.s(job_id, session_id, 'track2_growth_strategy', form_data, use_cache),
+            analyze_track.s(job_id, session_id, 'track3_risks_analysis', form_data, use_cache)
         ]
         
-        callback = finalize_analysis.s(job_id, session_id)
+        # Конвейер: каждый трек сразу по готовности сжимается в дайджест,
+        # и итоговому синтезу остаётся работать с компактными входами
+        if os.getenv("PIPELINED_CONSOLIDATION", "true").lower() == "true":
+            track_tasks = [t | digest_track.s(job_id, session_id, use_cache) for t in track_tasks]
+        
+        callback = finalize_analysis.s(job_id, session_id, started_at, use_cache)
         chord(track_tasks)(callback)
         
     except Exception as e:
         logger.error(f"run_full_analysis error: {e}", exc_info=True)
-        publish_status(session_id, "analysis_failed", f"❌ Ошибка запуска: {str(e)}")
\ No newline at end of file
+        publish_status(session_id, "analysis_failed", f"❌ Ошибка запуска: {str(e)}", job_id=job_id)
+
+@celery_app.task
+def refresh_daily_stats(days: int = 2, since: str = None):
+    """Периодически пересчитывает дневные агрегаты для дашборда; since — ISO-дата начала пересчёта"""
+    db = SessionLocal()
+    try:
+        rebuild_daily_stats(db, days, date.fromisoformat(since) if since else None)
+    finally:
+        db.close()
+
+@celery_app.task
+def start_batch(batch_id: int):
+    """Создаёт треки пакетной оценки и отправляет первую порцию в Batch API.
+    
+    Если сейчас идёт опрос пакетов, отправку оставляем ему: pending-пакеты он тоже продвигает.
+    """
+    db = SessionLocal()
+    try:
+        batch = db.get(Batch, batch_id)
+        batch_llm.create_tracks(db, batch)
+        
+        lock = redis_client.lock(BATCH_POLL_LOCK, timeout=BATCH_POLL_LOCK_SECONDS)
+        if not lock.acquire(blocking=False):
+            logger.info(f"Batch {batch_id}: poll in progress, submission left to poll_batches")
+            return
+        try:
+            batch_llm.submit_pending(db, batch)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning(f"Batch {batch_id}: poll lock expired before release")
+    finally:
+        db.close()
+
+@celery_app.task
+def poll_batches():
+    """Периодически продвигает незавершённые пакеты; анкеты с готовыми треками уходят на синтез"""
+    lock = redis_client.lock(BATCH_POLL_LOCK, timeout=BATCH_POLL_LOCK_SECONDS)
+    if not lock.acquire(blocking=False):
+        return
+    db = SessionLocal()
+    try:
+        for batch in db.query(Batch).filter(Batch.status.in_(["pending", "running"])).all():
+            # Каждый пакет — заново полный TTL блокировки: опрос многих пакетов может идти долго
+            try:
+                lock.reacquire()
+            except LockError:
+                # Блокировка истекла и могла достаться другому воркеру — опрос продолжит он
+                logger.warning("Batch poll lock lost, stopping poll")
+                break
+            try:
+                ready = batch_llm.advance(db, batch)
+            except Exception as e:
+                logger.error(f"Batch {batch.id} poll error: {e}", exc_info=True)
+                db.rollback()
+                continue
+            for job_id in ready:
+                finalize_batch_job.delay(job_id)
+            if batch.status == "done":
+                # Анкеты пакета завершаются до суток и дольше — позже окна регулярного пересчёта
+                created = db.execute(queries.batch_created_day(batch.id)).scalar()
+                refresh_daily_stats.delay(since=str(created))
+    finally:
+        db.close()
+        try:
+            lock.release()
+        except LockError:
+            # Блокировка истекла раньше, чем закончился опрос; снимать уже нечего
+            logger.warning("Batch poll lock expired before release")
+
+@celery_app.task
+def finalize_batch_job(job_id: int):
+    """Синтез и документы для анкеты из пакета (без WebSocket: её никто не слушает)"""
+    timings = {}
+    try:
+        report = consolidate_and_swot(job_id, timings=timings)
+    except Exception as e:
+        # Иначе анкета навсегда останется running, а пакет — незавершённым
+        logger.error(f"Batch job {job_id} consolidation error: {e}", exc_info=True)
+        report = None
+    for stage, ms in timings.items():
+        metrics.STAGE_SECONDS.labels(stage.removesuffix("_ms")).observe(ms / 1000)
+    
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        job.status = "done" if report else "failed"
+        job.finished_at = datetime.now(timezone.utc)
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,78 @@
+import os
+import math
+import time
+import logging
+from app.database import SessionLocal
+from app.llm_service import DEFAULT_MAX_TOKENS
+from app import queries
+
+logger = logging.getLogger(__name__)
+
+# max_tokens трека по истории ответов: p99 длины ответа × запас, но не выше лимита из Prompt.params.
+# Лишний лимит съедает запас TPM в лимитере и позволяет модели «растекаться» на хвосте.
+TOKEN_BUDGET_ENABLED = os.getenv("LLM_TOKEN_BUDGET_ENABLED", "true").lower() == "true"
+TOKEN_BUDGET_PERCENTILE = float(os.getenv("LLM_TOKEN_BUDGET_PERCENTILE", "0.99"))
+TOKEN_BUDGET_MARGIN = float(os.getenv("LLM_TOKEN_BUDGET_MARGIN", "1.3"))
+TOKEN_BUDGET_SAMPLES = int(os.getenv("LLM_TOKEN_BUDGET_SAMPLES", "200"))
+TOKEN_BUDGET_MIN_SAMPLES = int(os.getenv("LLM_TOKEN_BUDGET_MIN_SAMPLES", "30"))
+TOKEN_BUDGET_MIN = int(os.getenv("LLM_TOKEN_BUDGET_MIN", "1024"))
+# Во сколько раз поднимаем бюджет, если ответы упирались в лимит
+TOKEN_BUDGET_RAISE = float(os.getenv("LLM_TOKEN_BUDGET_RAISE", "2"))
+# Бюджет округляется вверх до шага: max_tokens входит в ключ кэша LLM, он не должен меняться от каждого ответа
+TOKEN_BUDGET_STEP = 512
+TOKEN_BUDGET_TTL = 300
+
+_budgets = {}
+
+def _stats(db, **scope) -> dict:
+    """Длина последних ответов модели: p50, выбранный перцентиль и самый длинный обрезанный"""
+    samples, p50, percentile, truncated, truncated_max = db.execute(
+        queries.completion_stats(TOKEN_BUDGET_PERCENTILE, TOKEN_BUDGET_SAMPLES, **scope)
+    ).one()
+    return {"samples": samples, "p50": p50, "percentile": percentile, "truncated": truncated, "truncated_max": truncated_max}
+
+def compute(prompt_id: int, track_name: str, ceiling: int = None) -> dict:
+    """Бюджет для версии промпта; у новой версии с короткой историей — по всему треку.
+
+    ceiling — max_tokens из Prompt.params (или DEFAULT_MAX_TOKENS): бюджет его не превышает.
+    """
+    ceiling = ceiling or DEFAULT_MAX_TOKENS
+    result = {"max_tokens": ceiling, "ceiling": ceiling, "source": "default"}
+
+    db = SessionLocal()
+    try:
+        for source, scope in (("version", {"prompt_id": prompt_id}), ("track", {"track_name": track_name})):
+            stats = _stats(db, **scope)
+            if stats["samples"] < TOKEN_BUDGET_MIN_SAMPLES or not stats["percentile"]:
+                continue
+
+            budget = stats["percentile"] * TOKEN_BUDGET_MARGIN
+            if stats["truncated_max"]:
+                # Обрезанный ответ не показывает, сколько модели было нужно: поднимаем с запасом
+                budget = max(budget, stats["truncated_max"] * TOKEN_BUDGET_RAISE)
+            budget = math.ceil(budget / TOKEN_BUDGET_STEP) * TOKEN_BUDGET_STEP
+            result.update(stats, max_tokens=int(min(max(budget, TOKEN_BUDGET_MIN), ceiling)), source=source)
+            break
+    except Exception as e:
+        logger.warning(f"Token budget for {track_name} unavailable: {e}")
+    finally:
+        db.close()
+    return result
+
+def max_tokens_for(prompt) -> int:
+    """max_tokens для запуска трека по CompiledPrompt; история перечитывается раз в TOKEN_BUDGET_TTL"""
+    ceiling = prompt.params.get("max_tokens", DEFAULT_MAX_TOKENS)
+    if not TOKEN_BUDGET_ENABLED or prompt.id is None:
+        return ceiling
+
+    cached = _budgets.get(prompt.id)
+    if cached and time.time() - cached[1] < TOKEN_BUDGET_TTL:
+        return min(cached[0], ceiling)
+
+    budget = compute(prompt.id, prompt.track_name, ceiling)["max_tokens"]
+    _budgets[prompt.id] = (budget, time.time())
+    return budget
+
+def invalidate(prompt_id: int):
+    """Ответ обрезан по бюджету: следующий запуск пересчитает его по свежей истории"""
+    _budgets.pop(prompt_id, None)
@@ -0,0 +1,112 @@
+"""Бенчмарк рендеринга отчета в PDF и DOCX.
+
+Генерирует типичный отчет (3 трека + итоговое резюме, ~16k токенов каждый),
+меряет время рендеринга каждого формата (первый вызов и повторный, когда шрифты
+и стили уже закэшированы), пиковый RSS процесса рендеринга и выигрыш от
+параллельного рендеринга через render_documents.
+
+    python benchmark_documents.py [--tokens 16000] [--runs 3]
+"""
+import sys
+import os
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.document_generator import render_pdf_bytes, render_docx_bytes, render_documents
+
+WORDS = (
+    "рынок ниша клиент стратегия рост выручка модель сегмент канал продукт платформа партнерство "
+    "конкуренция риск гипотеза эксперимент метрика подписка масштабирование экспертиза ценность "
+    "спрос предложение география регуляция команда ресурс монетизация маржинальность"
+).split()
+
+FORM_INPUT = {
+    "industry_products": "Консалтинг и обучение в области стратегического управления",
+    "customers": "Собственники и топ-менеджеры малого и среднего бизнеса",
+    "business_model": "Проектный консалтинг, групповые программы, подписка на материалы",
+    "geography": "Россия, СНГ",
+    "constraints": "Небольшая команда, ограниченное время основателя",
+    "strategic_goals": "Масштабировать выручку в 3 раза за 2 года"
+}
+
+def make_section(tokens: int, rng: random.Random) -> str:
+    """~4 символа на токен: абзацы из bullets и обычного текста"""
+    paragraphs = []
+    size = 0
+    while size < tokens * 4:
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "." for _ in range(rng.randint(2, 5))]
+        paragraph = "\n".join(f"- {s}" for s in sentences) if rng.random() < 0.4 else " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph)
+    return "\n\n".join(paragraphs)
+
+def make_report(tokens: int) -> dict:
+    rng = random.Random(42)
+    return {
+        "tracks": {
+            "market_analysis": make_section(tokens, rng),
+            "growth_opportunities": make_section(tokens, rng),
+            "risks_constraints": make_section(tokens, rng)
+        },
+        "consolidation": {
+            "executive_summary": make_section(tokens, rng)
+        }
+    }
+
+def measure_format(fmt: str, report: dict, runs: int) -> dict:
+    """Запускается в отдельном процессе, чтобы пиковый RSS относился к одному формату"""
+    render = render_pdf_bytes if fmt == "pdf" else render_docx_bytes
+    data, cold_ms = render(report, FORM_INPUT)
+    warm = [render(report, FORM_INPUT)[1] for _ in range(runs)]
+    return {
+        "cold_ms": cold_ms,
+        "warm_ms": sum(warm) / len(warm),
+        "size_kb": len(data) // 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=16000, help="токенов на раздел")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    report = make_report(args.tokens)
+    chars = sum(len(t) for t in report["tracks"].values()) + len(report["consolidation"]["executive_summary"])
+    print(f"Report: 4 sections x ~{args.tokens} tokens ({chars // 1024} KB of text)\n")
+
+    context = multiprocessing.get_context("spawn")
+    for fmt in ("pdf", "docx"):
+        with context.Pool(1) as pool:
+            r = pool.apply(measure_format, (fmt, report, args.runs))
+        print(f"{fmt.upper():5} cold {r['cold_ms']:6} ms | warm {r['warm_ms']:8.0f} ms | "
+              f"{r['size_kb']:5} KB | peak RSS {r['peak_rss_mb']:.0f} MB")
+
+    # Прогреваем пул, затем меряем последовательный и параллельный рендеринг
+    render_documents(report, FORM_INPUT)
+
+    start = time.time()
+    for _ in range(args.runs):
+        render_pdf_bytes(report, FORM_INPUT)
+        render_docx_bytes(report, FORM_INPUT)
+    sequential_ms = (time.time() - start) * 1000 / args.runs
+
+    start = time.time()
+    for _ in range(args.runs):
+        render_documents(report, FORM_INPUT)
+    parallel_ms = (time.time() - start) * 1000 / args.runs
+
+    print(f"\nSequential PDF+DOCX: {sequential_ms:.0f} ms")
+    print(f"Parallel   PDF+DOCX: {parallel_ms:.0f} ms")
+    print(f"Peak RSS (this process / render pool): "
+          f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB / "
+          f"{resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    main()
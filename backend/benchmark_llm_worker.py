@@ -0,0 +1,133 @@
+"""Нагрузочный бенчмарк пула LLM-воркера против локального фейкового OpenAI.
+
+Сравнивает пропускную способность (анализов в минуту, 1 анализ = 3 трека)
+в двух режимах, которые повторяют модели конкурентности Celery:
+
+  prefork — N процессов, каждый выполняет треки по одному (текущий --concurrency=3)
+  threads — один процесс с N потоками (worker-llm: -P threads --concurrency=N)
+
+Внутри используется настоящий call_llm и клиент OpenAI, ответы отдаёт
+локальный сервер с задержкой --latency. Метрики пишутся во временную SQLite.
+
+    python benchmark_llm_worker.py [--jobs 30] [--latency 2] [--prefork 3] [--threads 100]
+"""
+import sys
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(__file__))
+
+TRACKS_PER_JOB = 3
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """POST /v1/chat/completions: ждёт latency секунд и отвечает (стримом или целиком)"""
+    latency = 2.0
+    chunks = 20
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        text = "Фейковый ответ модели. " * 50
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for i in range(self.chunks):
+                time.sleep(self.latency / self.chunks)
+                chunk = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                         "choices": [{"index": 0, "delta": {"content": text[i::self.chunks]}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            usage = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body["model"], "choices": [],
+                     "usage": {"prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500}}
+            self.wfile.write(f"data: {json.dumps(usage)}\n\ndata: [DONE]\n\n".encode())
+            return
+
+        time.sleep(self.latency)
+        payload = json.dumps({
+            "id": "fake", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+def start_fake_openai(latency: float) -> ThreadingHTTPServer:
+    FakeOpenAIHandler.latency = latency
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_track(stream: bool) -> bool:
+    """Один трек: как analyze_track, но без Celery и Redis"""
+    from app.llm_service import call_llm
+
+    result = call_llm("Проанализируй рынок", None, None, stream=stream, use_cache=False)
+    return result["status"] == "success"
+
+def run_prefork(processes: int, tracks: int, stream: bool) -> int:
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        return sum(pool.map(run_track, [stream] * tracks, chunksize=1))
+
+def run_threads(threads: int, tracks: int, stream: bool) -> int:
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return sum(pool.map(run_track, [stream] * tracks))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=30, help="сколько анализов прогнать в каждом режиме")
+    parser.add_argument("--latency", type=float, default=2.0, help="время ответа фейковой модели, с")
+    parser.add_argument("--prefork", type=int, default=3, help="процессов в prefork-режиме")
+    parser.add_argument("--threads", type=int, default=100, help="потоков в threads-режиме")
+    parser.add_argument("--stream", action="store_true", help="запрашивать ответ стримом")
+    args = parser.parse_args()
+
+    server = start_fake_openai(args.latency)
+
+    # Окружение нужно выставить до импорта app.*
+    os.environ.update({
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_port}/v1",
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/benchmark.db",
+        # Асинхронный движок бенчмарку не нужен, но создаётся при импорте app.database
+        "ASYNC_DATABASE_URL": "postgresql+asyncpg://benchmark@127.0.0.1/benchmark",
+        "LLM_CACHE_ENABLED": "false",
+        "LLM_PROCESS_MAX_INFLIGHT": str(args.threads),
+        "DB_POOL_SIZE": str(args.threads),
+    })
+
+    from app.database import Base, engine
+    import app.models
+    Base.metadata.create_all(engine)
+
+    tracks = args.jobs * TRACKS_PER_JOB
+    print(f"{args.jobs} analyses ({tracks} LLM calls), model latency {args.latency}s, stream={args.stream}\n")
+
+    results = {}
+    for mode, runner, workers in (("prefork", run_prefork, args.prefork), ("threads", run_threads, args.threads)):
+        start = time.time()
+        ok = runner(workers, tracks, args.stream)
+        elapsed = time.time() - start
+        results[mode] = args.jobs / elapsed * 60
+        print(f"{mode:8} x{workers:<4} {elapsed:7.1f} s | {ok}/{tracks} ok | {results[mode]:7.1f} analyses/min")
+
+    print(f"\nSpeedup: x{results['threads'] / results['prefork']:.1f}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Бенчмарк раздачи событий по WebSocket: N одновременных сокетов на один процесс API.
+
+Запускает uvicorn с main:app, открывает --sockets соединений на --sessions сессий,
+публикует в Redis --events событий на каждую сессию и меряет:
+  - число клиентских соединений Redis до и после подключения сокетов;
+  - CPU и RSS процесса API на подключении и на раздаче событий;
+  - сколько событий дошло до клиентов и за какое время.
+
+Нужен запущенный Redis (REDIS_URL), Postgres не нужен.
+
+    REDIS_URL=redis://localhost:6379/0 python benchmark_ws_fanout.py [--sockets 5000] [--sessions 500] [--events 20]
+"""
+import sys
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import subprocess
+import redis
+from websockets.asyncio.client import connect
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def process_usage(pid: int) -> tuple:
+    """(CPU-секунды, RSS в МБ) процесса из /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    return cpu, rss
+
+def start_api(port: int) -> subprocess.Popen:
+    env = {**os.environ, "REDIS_URL": REDIS_URL, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "benchmark")}
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--backlog", "8192", "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return api
+        except OSError:
+            time.sleep(0.1)
+    api.kill()
+    sys.exit("API не запустился")
+
+async def client(url: str, ready: asyncio.Event, counts: list, index: int, errors: list):
+    try:
+        async with connect(url, open_timeout=60) as ws:
+            await ws.recv()  # connected
+            ready.set()
+            async for message in ws:
+                counts[index] += 1
+                if json.loads(message)["type"] == "benchmark_done":
+                    return
+    except Exception as e:
+        errors.append(repr(e))
+    finally:
+        ready.set()
+
+async def run(args):
+    port = free_port()
+    r = redis.from_url(REDIS_URL)
+    session_ids = [f"bench{i}" for i in range(args.sessions)]
+
+    clients_before = r.info("clients")["connected_clients"]
+    api = start_api(port)
+    try:
+        await asyncio.sleep(1)
+        cpu_start, _ = process_usage(api.pid)
+
+        # Подключаем сокеты пачками, чтобы не упереться в backlog
+        counts = [0] * args.sockets
+        errors = []
+        tasks, readies = [], []
+        start = time.time()
+        for i in range(args.sockets):
+            ready = asyncio.Event()
+            url = f"ws://127.0.0.1:{port}/ws/{session_ids[i % args.sessions]}"
+            tasks.append(asyncio.create_task(client(url, ready, counts, i, errors)))
+            readies.append(ready)
+            if i % 500 == 499:
+                await asyncio.gather(*(e.wait() for e in readies[-500:]))
+        await asyncio.gather(*(e.wait() for e in readies))
+        connect_s = time.time() - start
+
+        cpu_connected, rss_connected = process_usage(api.pid)
+        clients_after = r.info("clients")["connected_clients"]
+
+        # Раздача: events событий в каждую сессию, затем финальное
+        start = time.time()
+        for n in range(args.events):
+            pipe = r.pipeline(transaction=False)
+            for session_id in session_ids:
+                pipe.publish(f"session:{session_id}", json.dumps({"type": "track_delta", "message": "", "data": {"track": "t", "delta": "x" * 200, "n": n}}))
+            pipe.execute()
+        for session_id in session_ids:
+            r.publish(f"session:{session_id}", json.dumps({"type": "benchmark_done", "message": "", "data": {}}))
+        _, pending = await asyncio.wait(tasks, timeout=300)
+        fanout_s = time.time() - start
+        for task in pending:
+            task.cancel()
+        cpu_end, rss_end = process_usage(api.pid)
+    finally:
+        api.terminate()
+        api.wait()
+
+    delivered = sum(counts)
+    expected = args.sockets * (args.events + 1)
+    print(f"Sockets: {args.sockets} on {args.sessions} sessions, {len(errors)} failed, {len(pending)} timed out")
+    print(f"Redis clients: {clients_before} before API, {clients_after} with all sockets open")
+    print(f"Connect: {connect_s:.1f} s, API CPU {cpu_connected - cpu_start:.1f} s, RSS {rss_connected:.0f} MB")
+    print(f"Fan-out: {delivered}/{expected} messages in {fanout_s:.1f} s "
+          f"({delivered / fanout_s:.0f} msg/s), API CPU {cpu_end - cpu_connected:.1f} s, RSS {rss_end:.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--events", type=int, default=20, help="событий на сессию")
+    args = parser.parse_args()
+
+    # Клиентам и серверу нужно по дескриптору на сокет
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
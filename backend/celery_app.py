@@ -1,5 +1,9 @@
 import os
 from celery import Celery
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
+from app.metrics import instrument_celery, reset_process_files
 
 # Celery приложение
 celery_app = Celery(
@@ -16,10 +20,56 @@ celery_app.conf.update(
     timezone='UTC',
     enable_utc=True,
     task_track_started=True,
-    task_time_limit=60,
+    # Ответ на 16k токенов с повторами может идти дольше минуты
+    task_time_limit=int(os.getenv("CELERY_TASK_TIME_LIMIT", "1800")),
     worker_prefetch_multiplier=1,
-    worker_max_tasks_per_child=100
+    worker_max_tasks_per_child=100,
+    # Запросы к LLM — чистое ожидание сети: их обслуживает отдельный воркер с threads-пулом
+    task_routes={
+        'app.tasks.analyze_track': {'queue': os.getenv("LLM_QUEUE", "llm")},
+        'app.tasks.digest_track': {'queue': os.getenv("LLM_QUEUE", "llm")},
+        # Пакетная оценка — своя очередь и свой воркер, чтобы не занимать онлайн-анализы
+        'app.tasks.start_batch': {'queue': os.getenv("BATCH_QUEUE", "batch")},
+        'app.tasks.poll_batches': {'queue': os.getenv("BATCH_QUEUE", "batch")},
+        'app.tasks.finalize_batch_job': {'queue': os.getenv("BATCH_QUEUE", "batch")},
+    },
+    beat_schedule={
+        # Дневные агрегаты для /api/admin/stats
+        'refresh-daily-stats': {
+            'task': 'app.tasks.refresh_daily_stats',
+            'schedule': float(os.getenv("DAILY_STATS_REFRESH_SECONDS", "60")),
+        },
+        'poll-batches': {
+            'task': 'app.tasks.poll_batches',
+            'schedule': float(os.getenv("BATCH_POLL_SECONDS", "60")),
+        },
+    }
 )
 
+# Ожидание в очереди и длительность задач — в Prometheus
+instrument_celery()
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """В каждом процессе воркера прогреваем реестр промптов и слушаем инвалидацию"""
+    from app.prompt_registry import start_listener
+    start_listener()
+
+@worker_init.connect
+def init_worker(sender=None, **kwargs):
+    """Пулы без дочерних процессов (threads, gevent) не получают worker_process_init"""
+    # Главный процесс воркера стартует раньше дочерних: убираем метрики прошлого запуска
+    reset_process_files()
+    if not issubclass(get_implementation(sender.pool_cls), PreforkPool):
+        from app.prompt_registry import start_listener
+        start_listener()
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_telemetry(**kwargs):
+    """Дописываем буфер логов LLM-запросов: дочерние процессы prefork выходят без atexit"""
+    from app.llm_telemetry import flush
+    flush()
+
 # Импортируем tasks явно
 import app.tasks
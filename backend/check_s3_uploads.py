@@ -0,0 +1,157 @@
+"""Проверка загрузок в S3 на MinIO или moto server.
+
+Гоняет upload_many по настоящему S3-совместимому API: мелкие файлы, путь на диске и
+multipart-загрузку; затем подмешивает ответы 503 SlowDown и проверяет, что botocore
+повторяет отдельные запросы, а счётчики (retries, uploads_ok, uploads_failed,
+fallback_local) и гистограмма Prometheus сходятся с тем, что произошло.
+Завершается с кодом 1, если хоть одна проверка не прошла.
+
+    moto_server -p 5000 &
+    CHECK_S3_ENDPOINT=http://127.0.0.1:5000 python check_s3_uploads.py
+
+Для MinIO дополнительно укажите S3_ACCESS_KEY и S3_SECRET_KEY.
+"""
+import sys
+import os
+import tempfile
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(__file__))
+
+ENDPOINT = os.getenv("CHECK_S3_ENDPOINT")
+if not ENDPOINT:
+    sys.exit("Укажите CHECK_S3_ENDPOINT — MinIO или moto server; в бакет будут записаны тестовые объекты")
+os.environ["S3_ENDPOINT"] = ENDPOINT
+os.environ["S3_BUCKET"] = os.getenv("CHECK_S3_BUCKET", "bizeval-upload-check")
+os.environ.setdefault("S3_ACCESS_KEY", "test")
+os.environ.setdefault("S3_SECRET_KEY", "test")
+os.environ.setdefault("S3_REGION", "us-east-1")
+os.environ["S3_PRESIGN_URLS"] = "false"
+# Минимальный размер части multipart у S3 — 5 МБ
+os.environ["S3_MULTIPART_THRESHOLD_MB"] = "5"
+os.environ["S3_MULTIPART_CHUNK_MB"] = "5"
+os.environ["REPORTS_DIR"] = tempfile.mkdtemp(prefix="s3-check-")
+
+import io
+from botocore.awsrequest import AWSResponse
+from prometheus_client import REGISTRY
+from app import s3_service
+
+if s3_service.S3_MAX_ATTEMPTS < 3:
+    sys.exit("Проверке повторов нужно S3_MAX_ATTEMPTS не меньше 3")
+
+BUCKET = os.environ["S3_BUCKET"]
+MB = 1024 * 1024
+
+class Faults:
+    """Подменяет ответ S3 на 503 SlowDown для заданных ключей: {ключ: сколько раз, -1 — всегда}"""
+    BODY = b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>'
+
+    def __init__(self):
+        self.remaining = {}
+        self.injected = 0
+
+    def __call__(self, request, **kwargs):
+        if request.method not in ("PUT", "POST"):
+            return None
+        for key, left in self.remaining.items():
+            if f"/{key}" in request.url and left != 0:
+                self.remaining[key] = left - 1 if left > 0 else left
+                self.injected += 1
+                return AWSResponse(request.url, 503, {}, _Raw(self.BODY))
+        return None
+
+class _Raw:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+def _counters() -> dict:
+    return dict(s3_service.get_metrics()["process"])
+
+def _histogram_count(result: str) -> float:
+    return REGISTRY.get_sample_value("bizeval_s3_upload_duration_seconds_count", {"result": result}) or 0
+
+def _object(key: str) -> bytes:
+    return s3_service.get_s3_client().get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+def check_s3_uploads() -> bool:
+    s3 = s3_service.get_s3_client()
+    try:
+        s3.create_bucket(Bucket=BUCKET)
+    except (s3.exceptions.BucketAlreadyOwnedByYou, s3.exceptions.BucketAlreadyExists):
+        pass
+    faults = Faults()
+    s3.meta.events.register("before-send.s3", faults)
+
+    failures = []
+    def check(name: str, ok: bool, details: str = ""):
+        print(f"{'✅' if ok else '❌'} {name}{': ' + details if details and not ok else ''}")
+        if not ok:
+            failures.append(name)
+
+    # 1. Параллельная загрузка разных видов данных, включая multipart
+    path = os.path.join(os.environ["REPORTS_DIR"], "from-disk.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    with open(path, "rb") as f:
+        disk_data = f.read()
+    items = {
+        "check/small.pdf": os.urandom(10 * 1024),
+        "check/stream.docx": io.BytesIO(os.urandom(20 * 1024)),
+        "check/from-disk.bin": path,
+        "check/multipart.bin": os.urandom(12 * MB),
+    }
+    expected = {
+        "check/small.pdf": items["check/small.pdf"],
+        "check/stream.docx": items["check/stream.docx"].getvalue(),
+        "check/from-disk.bin": disk_data,
+        "check/multipart.bin": items["check/multipart.bin"],
+    }
+    before, ok_before = _counters(), _histogram_count("ok")
+    urls = s3_service.upload_many(items)
+    after = _counters()
+    check("upload_many returns public urls", urls == {name: s3_service.public_url(name) for name in items}, str(urls))
+    check("uploaded objects match", all(_object(name) == data for name, data in expected.items()))
+    check("uploads_ok counter", after["uploads_ok"] - before["uploads_ok"] == len(items))
+    check("bytes_uploaded counter", after["bytes_uploaded"] - before["bytes_uploaded"] == sum(len(d) for d in expected.values()))
+    check("no retries without faults", after["retries"] == before["retries"])
+    check("histogram ok count", _histogram_count("ok") - ok_before == len(items))
+
+    # 2. Временные 503: botocore повторяет запрос, загрузка проходит, повторы посчитаны
+    faults.remaining = {"check/retry-small.pdf": 2, "check/retry-multipart.bin": 1}
+    faults.injected = 0
+    retry_items = {"check/retry-small.pdf": os.urandom(8 * 1024), "check/retry-multipart.bin": os.urandom(11 * MB)}
+    before = _counters()
+    urls = s3_service.upload_many(retry_items)
+    after = _counters()
+    check("uploads survive transient 503", urls == {name: s3_service.public_url(name) for name in retry_items}, str(urls))
+    check("retried objects match", all(_object(name) == data for name, data in retry_items.items()))
+    check("retries counter", after["retries"] - before["retries"] == faults.injected == 3,
+          f"counted {after['retries'] - before['retries']}, injected {faults.injected}")
+    check("no failures on transient 503", after["uploads_failed"] == before["uploads_failed"])
+
+    # 3. S3 не отвечает дольше S3_MAX_ATTEMPTS попыток: файл сохраняется локально
+    faults.remaining = {"check/always-failing.pdf": -1}
+    faults.injected = 0
+    data = os.urandom(4 * 1024)
+    before, failed_before = _counters(), _histogram_count("failed")
+    result = s3_service.upload_many({"check/always-failing.pdf": data})["check/always-failing.pdf"]
+    after = _counters()
+    check("fallback to local file", os.path.exists(result) and open(result, "rb").read() == data, result)
+    check("attempts limited by S3_MAX_ATTEMPTS", faults.injected == s3_service.S3_MAX_ATTEMPTS,
+          f"{faults.injected} attempts, S3_MAX_ATTEMPTS={s3_service.S3_MAX_ATTEMPTS}")
+    check("uploads_failed and fallback_local counters",
+          after["uploads_failed"] - before["uploads_failed"] == 1 and after["fallback_local"] - before["fallback_local"] == 1)
+    check("retries counter on failure", after["retries"] - before["retries"] == s3_service.S3_MAX_ATTEMPTS - 1)
+    check("histogram failed count", _histogram_count("failed") - failed_before == 1)
+
+    s3.meta.events.unregister("before-send.s3", faults)
+    if failures:
+        print(f"\n{len(failures)} checks failed")
+    return not failures
+
+if __name__ == "__main__":
+    sys.exit(0 if check_s3_uploads() else 1)
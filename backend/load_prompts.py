@@ -8,15 +8,6 @@ from app.models import Prompt
 PROMPTS = {
     "track1_market_analysis": """Ты — стратегический консультант уровня топ‑фирм.
 
-КОНТЕКСТ БИЗНЕСА:
-Отрасль и продукты: {industry_products}
-Клиенты: {customers}
-Бизнес-модель: {business_model}
-География: {geography}
-Ограничения: {constraints}
-Стратегические цели: {strategic_goals}
-Дополнительно: {additional_info}
-
 Твоя задача — провести расширенный анализ возможных направлений роста (новые ниши, рынки, бизнес‑модели, продукты/форматы) с опорой на продвинутые методики.
 
 ШАГ 1. Фрейминг задачи и критериев
@@ -93,9 +84,7 @@ PROMPTS = {
 - В каждом шаге явно фиксируй допущения и аргументы
 - Не сужайся до одной‑двух ниш: показывай широту поля и структуру выбора
 - Используй bullets, таблицы, структурированный текст для читаемости
-- Пиши на русском языке""",
-
-    "track2_growth_strategy": """Твоя роль — стратегический исследователь бизнес моделей.
+- Пиши на русском языке
 
 КОНТЕКСТ БИЗНЕСА:
 Отрасль и продукты: {industry_products}
@@ -104,6 +93,9 @@ PROMPTS = {
 География: {geography}
 Ограничения: {constraints}
 Стратегические цели: {strategic_goals}
+Дополнительно: {additional_info}""",
+
+    "track2_growth_strategy": """Твоя роль — стратегический исследователь бизнес моделей.
 
 Твоя задача — выполнить глубинный анализ аналогов (успешных примеров) и антилогов (неудачных/противоречивых примеров) для выбранного направления, а затем выдать практические выводы для проектирования и настройки модели.
 
@@ -176,9 +168,7 @@ PROMPTS = {
 
 В финале дай сжатую выжимку: опирайся на такие-то паттерны аналогов, избегай таких-то паттернов антилогов, и начинай с таких-то экспериментов — максимально конкретно, без общих слов.
 
-Формат ответа: структурированный текст с bullets, таблицами, разделами. Пиши на русском языке.""",
-
-    "track3_risks_analysis": """Твоя роль — эксперт по анализу клиентских болей и Jobs-to-be-Done.
+Формат ответа: структурированный текст с bullets, таблицами, разделами. Пиши на русском языке.
 
 КОНТЕКСТ БИЗНЕСА:
 Отрасль и продукты: {industry_products}
@@ -186,6 +176,9 @@ PROMPTS = {
 Бизнес-модель: {business_model}
 География: {geography}
 Ограничения: {constraints}
+Стратегические цели: {strategic_goals}""",
+
+    "track3_risks_analysis": """Твоя роль — эксперт по анализу клиентских болей и Jobs-to-be-Done.
 
 Проанализируй целевую аудиторию и её ключевые боли в контексте решения конкретной задачи или достижения результата. Сфокусируйся на job-to-be-done и desired outcomes клиентов. Используй логику Outcome-Driven Innovation (ODI): для каждого outcome оцени важность и степень удовлетворённости, чтобы выявить недообслуженные зоны.
 
@@ -253,7 +246,14 @@ PROMPTS = {
 • какие требования к формату/каналам/цене следуют из структуры болей и opportunity scores;
 • каких решений, наоборот, стоит избегать, потому что они закрывают overserved outcomes или создают малоценные улучшения.
 
-Формат ответа: структурированный текст с bullets, таблицами, разделами. Пиши на русском языке."""
+Формат ответа: структурированный текст с bullets, таблицами, разделами. Пиши на русском языке.
+
+КОНТЕКСТ БИЗНЕСА:
+Отрасль и продукты: {industry_products}
+Клиенты: {customers}
+Бизнес-модель: {business_model}
+География: {geography}
+Ограничения: {constraints}"""
 }
 
 def load_prompts():
@@ -274,7 +274,8 @@ def load_prompts():
         new_prompt = Prompt(
             track_name=track_name,
             prompt_template=prompt_text,
-            params={"temperature": 0.7, "max_tokens": 8000},
+            # Без "model" трек идёт на LLM_MODEL; можно задать model, max_tokens, temperature, timeout, stream
+            params={"temperature": 0.7, "max_tokens": 16000},
             version=1,
             updated_by="system",
             is_active=True
@@ -1,25 +1,53 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
 import redis.asyncio as aioredis
 import json
+import os
+import re
 import asyncio
+import time
 
-from app.routers import sessions, forms, analysis, reports, admin
+from app.routers import sessions, forms, analysis, reports, admin, batches
+from app.database import async_engine
+from app.event_hub import EventHub, LAGGED
+from app import report_cache, metrics, llm_telemetry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 redis_client = None
+event_hub = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global redis_client
+    global redis_client, event_hub
     logger.info("Starting BizEval API...")
-    redis_client = await aioredis.from_url("redis://redis:6379", decode_responses=True)
+    metrics.reset_process_files()
+    # Ограниченный пул: всплеск подключений ждёт свободное соединение, а не открывает новые
+    pool = aioredis.BlockingConnectionPool.from_url(
+        os.getenv("REDIS_URL", "redis://redis:6379/0"),
+        decode_responses=True,
+        max_connections=int(os.getenv("API_REDIS_MAX_CONNECTIONS", "50")),
+        timeout=int(os.getenv("API_REDIS_POOL_TIMEOUT", "30"))
+    )
+    redis_client = aioredis.Redis(connection_pool=pool)
+    # Одна подписка на все сессии вместо pubsub на каждый сокет
+    event_hub = EventHub(redis_client)
+    await event_hub.start()
+    # Сброс локального кэша отчетов, когда их перегенерируют в воркере
+    report_invalidations = asyncio.create_task(report_cache.listen_invalidations())
     yield
-    await redis_client.close()
+    report_invalidations.cancel()
+    await asyncio.gather(report_invalidations, return_exceptions=True)
+    await report_cache.async_redis_client.aclose()
+    await event_hub.stop()
+    await redis_client.aclose()
+    await pool.aclose()
+    # Логи LLM-запросов старого синхронного эндпоинта анализа
+    await asyncio.to_thread(llm_telemetry.flush)
+    await async_engine.dispose()
     logger.info("Shutting down BizEval API...")
 
 app = FastAPI(
@@ -29,6 +57,8 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(metrics.PrometheusMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -42,6 +72,7 @@ app.include_router(forms.router)
 app.include_router(analysis.router)
 app.include_router(reports.router)
 app.include_router(admin.router)
+app.include_router(batches.router)
 
 @app.get("/")
 async def root():
@@ -63,14 +94,36 @@ async def root():
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики Prometheus: API и воркеры Celery (через общий PROMETHEUS_MULTIPROC_DIR)"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+EVENT_ID_RE = re.compile(r"^\d+-\d+$")
+
+def _event_order(event_id: str) -> tuple:
+    """Id записи Redis Stream ("<ms>-<seq>") в сравнимый вид"""
+    ms, seq = event_id.split("-")
+    return int(ms), int(seq)
+
+async def _replay(websocket: WebSocket, session_id: str, after: str = None) -> str:
+    """Отправляет события из stream сессии после after (все, если after нет), возвращает id последнего"""
+    history = await redis_client.xrange(f"session:{session_id}:events", min=f"({after}" if after else "-")
+    for event_id, fields in history:
+        await websocket.send_json({"id": event_id, **json.loads(fields["event"])})
+        after = event_id
+    return after
+
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
+async def websocket_endpoint(websocket: WebSocket, session_id: str, last_event_id: str = None):
     await websocket.accept()
-    logger.info(f"WebSocket connected: session_id={session_id}")
+    logger.info(f"WebSocket connected: session_id={session_id}, last_event_id={last_event_id}")
+    
+    if last_event_id and not EVENT_ID_RE.match(last_event_id):
+        last_event_id = None
     
-    # Подписываемся на канал сессии
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(f"session:{session_id}")
+    # Подписываемся на сессию до чтения истории, чтобы не потерять события между ними
+    subscription = event_hub.subscribe(session_id)
     
     try:
         await websocket.send_json({
@@ -78,12 +131,27 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
             "message": f"Подключено к сессии {session_id}"
         })
         
-        # Слушаем Redis и отправляем в WebSocket
+        # Досылаем события, которые клиент пропустил (или все, если он подключился впервые)
+        last_sent = await _replay(websocket, session_id, last_event_id)
+        
+        # Слушаем события сессии и отправляем в WebSocket
         async def redis_listener():
-            async for message in pubsub.listen():
-                if message['type'] == 'message':
-                    data = json.loads(message['data'])
-                    await websocket.send_json(data)
+            nonlocal last_sent
+            while True:
+                data = await subscription.get()
+                if data is LAGGED:
+                    # Очередь переполнилась: фрагменты потеряны, статусы догоняем по stream
+                    logger.warning(f"WebSocket lagged behind: session_id={session_id}")
+                    last_sent = await _replay(websocket, session_id, last_sent)
+                    continue
+                # События, уже отправленные из истории, пропускаем
+                if data.get("id") and last_sent and _event_order(data["id"]) <= _event_order(last_sent):
+                    continue
+                await websocket.send_json(data)
+                if data.get("id"):
+                    last_sent = data["id"]
+                    # Id записи stream начинается с времени XADD в мс
+                    metrics.WS_EVENT_DELIVERY_SECONDS.observe(max(time.time() - _event_order(last_sent)[0] / 1000, 0))
         
         # Слушаем WebSocket от клиента
         async def ws_receiver():
@@ -98,6 +166,10 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         logger.info(f"WebSocket disconnected: session_id={session_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
+        # Закрываем сокет явно: клиент переподключится и догонит события по last_event_id
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
     finally:
-        await pubsub.unsubscribe(f"session:{session_id}")
-        await pubsub.close()
+        event_hub.unsubscribe(subscription)
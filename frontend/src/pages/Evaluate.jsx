@@ -1,6 +1,9 @@
 import { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 
+// После этих событий сервер больше ничего не пришлёт — переподключаться незачем
+const TERMINAL_EVENTS = ['analysis_completed', 'analysis_failed', 'analysis_partial']
+
 function Evaluate() {
   const navigate = useNavigate()
   const [sessionId, setSessionId] = useState(null)
@@ -12,6 +15,7 @@ function Evaluate() {
   const [analyzing, setAnalyzing] = useState(false)
   const [report, setReport] = useState(null)
   const [jobId, setJobId] = useState(null)
+  const [liveTracks, setLiveTracks] = useState({})
   const messagesEndRef = useRef(null)
   const shouldScrollRef = useRef(false)
   
@@ -36,63 +40,110 @@ function Evaluate() {
   }, [messages])
 
   useEffect(() => {
+    let websocket = null
+    let retryTimer = null
+    let stopped = false
+
     fetch('/api/session/start', { method: 'POST' })
       .then(r => r.json())
       .then(data => {
+        if (stopped) return
         setSessionId(data.session_id)
         
         const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
-        const websocket = new WebSocket(`${wsProtocol}//${window.location.hostname}:8000/ws/${data.session_id}`)
-        
-        websocket.onopen = () => {
-          console.log('WebSocket connected')
-        }
+        // Id последнего полученного события: при переподключении сервер дошлёт пропущенные
+        let lastEventId = null
+        let retryDelay = 1000
         
-        websocket.onmessage = (event) => {
-          const data = JSON.parse(event.data)
-          console.log('WS message:', data)
+        const connect = () => {
+          const query = lastEventId ? `?last_event_id=${lastEventId}` : ''
+          websocket = new WebSocket(`${wsProtocol}//${window.location.hostname}:8000/ws/${data.session_id}${query}`)
+          
+          websocket.onopen = () => {
+            console.log('WebSocket connected')
+            retryDelay = 1000
+          }
           
-          shouldScrollRef.current = true
+          websocket.onmessage = (event) => {
+            const data = JSON.parse(event.data)
+            console.log('WS message:', data)
+            if (data.id) {
+              lastEventId = data.id
+            }
+            
+            shouldScrollRef.current = true
+            
+            if (data.type === 'connected') {
+              console.log(data.message)
+            } else if (data.type === 'analysis_started') {
+              addMessage('ai', data.message)
+            } else if (data.type === 'track_started') {
+              addMessage('ai', data.message)
+            } else if (data.type === 'track_delta') {
+              const { track, delta } = data.data
+              setLiveTracks(prev => ({ ...prev, [track]: (prev[track] || '') + delta }))
+            } else if (data.type === 'track_retry') {
+              // Повторная попытка начинает ответ заново — сбрасываем частичный текст
+              addMessage('ai', data.message)
+              setLiveTracks(prev => ({ ...prev, [data.data.track]: '' }))
+            } else if (data.type === 'track_completed') {
+              addMessage('ai', data.message)
+            } else if (data.type === 'consolidation_started') {
+              addMessage('ai', data.message)
+            } else if (data.type === 'analysis_completed') {
+              addMessage('ai', data.message)
+              setJobId(data.data.job_id)
+              loadReportSections(data.data.job_id, data.data.sections)
+              setAnalyzing(false)
+            } else if (data.type === 'analysis_failed' || data.type === 'analysis_partial') {
+              addMessage('ai', data.message)
+              setAnalyzing(false)
+            }
+
+            if (TERMINAL_EVENTS.includes(data.type)) {
+              stopped = true
+              websocket.close()
+            }
+          }
           
-          if (data.type === 'connected') {
-            console.log(data.message)
-          } else if (data.type === 'analysis_started') {
-            addMessage('ai', data.message)
-          } else if (data.type === 'track_started') {
-            addMessage('ai', data.message)
-          } else if (data.type === 'track_completed') {
-            addMessage('ai', data.message)
-          } else if (data.type === 'consolidation_started') {
-            addMessage('ai', data.message)
-          } else if (data.type === 'analysis_completed') {
-            addMessage('ai', data.message)
-            setReport(data.data.report)
-            setJobId(data.data.job_id)
-            setAnalyzing(false)
-          } else if (data.type === 'analysis_failed') {
-            addMessage('ai', data.message)
-            setAnalyzing(false)
+          websocket.onerror = (error) => {
+            console.error('WebSocket error:', error)
           }
+          
+          websocket.onclose = () => {
+            console.log('WebSocket closed')
+            if (stopped) return
+            // Обрыв соединения: переподключаемся с нарастающей паузой
+            retryTimer = setTimeout(connect, retryDelay)
+            retryDelay = Math.min(retryDelay * 2, 10000)
+          }
+          
+          setWs(websocket)
         }
         
-        websocket.onerror = (error) => {
-          console.error('WebSocket error:', error)
-        }
-        
-        websocket.onclose = () => {
-          console.log('WebSocket closed')
-        }
-        
-        setWs(websocket)
-        
-        return () => websocket.close()
+        connect()
       })
+
+    return () => {
+      stopped = true
+      clearTimeout(retryTimer)
+      websocket?.close()
+    }
   }, [])
 
   const addMessage = (role, text) => {
     setMessages(prev => [...prev, { role, text }])
   }
 
+  // Событие о завершении несёт только манифест разделов — тексты забираем отдельными запросами
+  const loadReportSections = async (jobId, sections) => {
+    const names = Object.keys(sections || {})
+    const texts = await Promise.all(names.map(name =>
+      fetch(`/api/report/${jobId}/sections/${name}`).then(res => res.ok ? res.text() : null)
+    ))
+    setReport(Object.fromEntries(names.map((name, i) => [name, texts[i]])))
+  }
+
   const handleSubmit = async (e) => {
     e.preventDefault()
     
@@ -240,6 +291,13 @@ function Evaluate() {
           </div>
         )}
 
+        {analyzing && Object.entries(liveTracks).map(([track, text]) => (
+          <div key={track} className="chat-message ai">
+            <div className="message-avatar">🤖</div>
+            <div className="message-text" style={{whiteSpace: 'pre-wrap', maxHeight: '240px', overflowY: 'auto', opacity: 0.8}}>{text}</div>
+          </div>
+        ))}
+
         {report && (
           <div className="chat-message ai">
             <div className="message-avatar">🤖</div>
@@ -248,28 +306,28 @@ function Evaluate() {
               <div className="report-section">
                 <h2>📊 АНАЛИЗ РЫНКОВ И НИШ</h2>
                 <div style={{whiteSpace: 'pre-wrap', lineHeight: '1.7'}}>
-                  {report.tracks?.market_analysis || report.consolidation?.market_analysis || 'Данные отсутствуют'}
+                  {report.market_analysis || 'Данные отсутствуют'}
                 </div>
               </div>
 
               <div className="report-section">
                 <h2>🔍 АНАЛИЗ АНАЛОГОВ И АНТИЛОГОВ</h2>
                 <div style={{whiteSpace: 'pre-wrap', lineHeight: '1.7'}}>
-                  {report.tracks?.growth_opportunities || report.consolidation?.growth_opportunities || 'Данные отсутствуют'}
+                  {report.growth_opportunities || 'Данные отсутствуют'}
                 </div>
               </div>
 
               <div className="report-section">
                 <h2>💡 АНАЛИЗ КЛИЕНТСКИХ БОЛЕЙ</h2>
                 <div style={{whiteSpace: 'pre-wrap', lineHeight: '1.7'}}>
-                  {report.tracks?.risks_constraints || report.consolidation?.risks_constraints || 'Данные отсутствуют'}
+                  {report.risks_constraints || 'Данные отсутствуют'}
                 </div>
               </div>
 
               <div className="report-section score-section">
                 <h2>📋 ИТОГОВОЕ РЕЗЮМЕ</h2>
                 <div style={{whiteSpace: 'pre-wrap', lineHeight: '1.7', color: 'white'}}>
-                  {report.consolidation?.executive_summary || 'Данные отсутствуют'}
+                  {report.executive_summary || 'Данные отсутствуют'}
                 </div>
               </div>
 